@@ -3,6 +3,11 @@ ASGI config for EduNav project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The streaming AI feedback endpoints (``api/*/feedback/stream/``) are async
+views; serve the project through this module (e.g. ``uvicorn
+EduNav.asgi:application``) so tokens reach the browser as they arrive. Under
+WSGI they still work, but the response is buffered until it is complete.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 """
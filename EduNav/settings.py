@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -82,6 +83,43 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # AI replies keyed by a hash of model and messages, shared by all worker
+    # processes so that a repeated request is only sent to the API once. Once
+    # MAX_ENTRIES is reached, expired and then a third of the entries are culled.
+    'feedback': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'dashboard_feedback_cache',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+    # Rendered student exports keyed by their ETag; see EXPORT_CACHE_MAX_BYTES.
+    'exports': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'exports',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 200},
+    },
+    # Rate limit buckets, feedback slots, login counters (dashboard/
+    # ratelimit.py) and the reply cache statistics. They must be shared by all
+    # worker processes, so they are kept in the database. The tables of the
+    # database caches are created by dashboard migrations.
+    # Culling would reset live counters, hence the high MAX_ENTRIES.
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'dashboard_ratelimit_cache',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 100_000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -100,6 +138,12 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Student passwords use a cheaper hasher than teacher accounts (see
+# dashboard/hashers.py); existing hashes are upgraded on login. Measure with
+# "manage.py bench_student_login" before changing the iteration count.
+STUDENT_PASSWORD_HASHER = 'dashboard.hashers.StudentPBKDF2PasswordHasher'
+STUDENT_PASSWORD_ITERATIONS = 100_000
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.0/topics/i18n/
@@ -125,3 +169,80 @@ LOGIN_URL = 'login'
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# OpenAI integration
+OPENAI_API_BASE = 'https://api.openai.com/v1'
+OPENAI_TIMEOUT = 30
+OPENAI_MAX_CONCURRENCY = 8
+# Retries on 429/5xx with exponential backoff (base * 2 ** attempt, capped);
+# a Retry-After longer than OPENAI_BACKOFF_MAX fails the call immediately.
+OPENAI_MAX_RETRIES = 3
+OPENAI_BACKOFF_BASE = 0.5
+OPENAI_BACKOFF_MAX = 10
+
+# Serialized diaries are cached per student and versioned by their entries,
+# so the timeout only bounds how long unused diaries stay in the cache.
+DIARY_CACHE_TIMEOUT = 60 * 60 * 24
+
+# AI feedback jobs: "thread" answers jobs in a process-local thread pool,
+# "worker" leaves them for `manage.py run_feedback_worker`, "eager" answers
+# them inside the request (used by the tests).
+FEEDBACK_JOB_BACKEND = 'thread'
+FEEDBACK_JOB_WORKERS = 4
+# Jobs still running after this many seconds are failed by
+# `manage.py run_feedback_worker`, e.g. after the process running them died.
+FEEDBACK_JOB_TIMEOUT = 5 * 60
+
+# AI conversations live in the database and are referenced from the session.
+# Long conversations drop their oldest follow-up rounds; `manage.py
+# purge_feedback_history` deletes conversations and jobs older than the
+# retention period.
+FEEDBACK_CONVERSATION_MAX_MESSAGES = 20
+FEEDBACK_RETENTION_DAYS = 30
+
+# Upper bound for AI feedback requests across all classrooms; the per-student
+# and per-classroom limits are configured on each classroom. The limiter keeps
+# its counters in the shared 'ratelimit' cache (see CACHES).
+FEEDBACK_GLOBAL_PER_MINUTE = 120
+
+# Student login throttling (dashboard/ratelimit.py), also kept in the
+# 'ratelimit' cache. After LOGIN_FAILURES_PER_ACCOUNT failed logins an account
+# is locked out, starting at LOGIN_LOCKOUT_SECONDS and doubling with every
+# further failure; its failures are forgotten after LOGIN_FAILURE_WINDOW
+# seconds. Each client IP may fail LOGIN_FAILURES_PER_IP times per
+# LOGIN_FAILURE_WINDOW (a token bucket); once they are used up, requests for
+# unknown accounts are refused, while known accounts can still log in.
+LOGIN_FAILURES_PER_ACCOUNT = 5
+LOGIN_FAILURES_PER_IP = 50
+LOGIN_LOCKOUT_SECONDS = 30
+LOGIN_LOCKOUT_MAX_SECONDS = 60 * 60
+LOGIN_FAILURE_WINDOW = 15 * 60
+# META key with the client address set by a trusted reverse proxy, e.g.
+# 'HTTP_X_FORWARDED_FOR'; None uses REMOTE_ADDR. Only set it if every request
+# passes the proxy, as clients can send the header themselves.
+LOGIN_CLIENT_IP_HEADER = None
+
+# Seconds other processes may keep serving AppSettings after they were changed;
+# the process that saves the settings sees the change immediately.
+APP_SETTINGS_CACHE_TIMEOUT = 30
+
+# The settings page shows the stored result of the last API key check and
+# re-checks the key in the background once it is older than this (seconds).
+OPENAI_KEY_CHECK_INTERVAL = 60 * 60
+
+# Study-wide exports are written to EXPORT_ROOT by a background job and only
+# served through the download view. "thread" runs the job in a background
+# thread, "worker" leaves it for `manage.py run_export_worker`, "eager" runs it
+# inside the request (used by the tests). Jobs not finished EXPORT_JOB_TIMEOUT
+# seconds after they were started are failed; `manage.py purge_exports`
+# deletes jobs and archives older than EXPORT_RETENTION_DAYS.
+MEDIA_ROOT = BASE_DIR / 'media'
+EXPORT_ROOT = MEDIA_ROOT / 'exports'
+EXPORT_JOB_BACKEND = 'thread'
+EXPORT_JOB_TIMEOUT = 60 * 60
+EXPORT_RETENTION_DAYS = 7
+# Larger rendered exports are not kept in the 'exports' cache.
+EXPORT_CACHE_MAX_BYTES = 2 * 1024 * 1024
+# Key of the hashed student and classroom ids in research exports. Keep it
+# fixed across exports so that the ids stay stable.
+RESEARCH_EXPORT_KEY = os.environ.get('RESEARCH_EXPORT_KEY', SECRET_KEY)
@@ -0,0 +1,123 @@
+"""Shared helpers for the benchmark commands and the tests that use them.
+
+``legacy_entry_flat`` keeps the export flattening as it was before
+``exporters.ENTRY_COLUMNS`` so the benchmarks have a baseline and the tests a
+reference for the CSV columns.
+"""
+
+from datetime import date, timedelta
+
+from dashboard.models import SRLEntry
+
+
+def synthetic_entries(count):
+    """Unsaved entries with every list field filled, for benchmarking."""
+    start = date(2024, 1, 1)
+    return [
+        SRLEntry(
+            session_date=start + timedelta(days=i % 365),
+            goals=["Vokabeln lernen", "Aufsatz gliedern"],
+            priorities=["Vokabeln lernen"],
+            strategies=["Karteikarten", "Mindmap"],
+            resources=["Buch", "App"],
+            time_planning=[
+                {"goal": "Vokabeln lernen", "time": "00:30"},
+                {"goal": "Aufsatz gliedern", "time": "00:45"},
+            ],
+            expectations=[{"goal": "Vokabeln lernen", "indicator": "20 Wörter"}],
+            steps=["Wiederholen", "Abfragen"],
+            time_usage=[{"goal": "Vokabeln lernen", "time": "00:35"}],
+            strategy_check=[
+                {"strategy": "Karteikarten", "used": True, "useful": True},
+                {"strategy": "Mindmap", "used": False, "adaptation": "später"},
+            ],
+            problems="Ablenkung durch das Handy",
+            emotions="motiviert",
+            goal_achievement=[
+                {"goal": "Vokabeln lernen", "achievement": "erreicht", "comment": "gut"}
+            ],
+            strategy_evaluation=["Karteikarten helfen"],
+            learned_subject="20 neue Wörter",
+            learned_work="Pausen einplanen",
+            planning_realistic="ja",
+            motivation_rating="4",
+            next_phase="Grammatik",
+            strategy_outlook="Karteikarten beibehalten",
+        )
+        for i in range(count)
+    ]
+
+
+def legacy_entry_flat(entry):
+    """Dict-based flattening with per-call closures, as used before ENTRY_COLUMNS."""
+
+    def _join(lst):
+        return "; ".join(lst) if lst else ""
+
+    def _tp(lst):
+        return "; ".join(f"{item.get('goal')} ({item.get('time')})" for item in lst)
+
+    def _exp(lst):
+        return "; ".join(
+            f"{item.get('goal')}{': ' + item.get('indicator') if item.get('indicator') else ''}"
+            for item in lst
+        )
+
+    def _sc(lst):
+        parts = []
+        for item in lst:
+            txt = item.get("strategy", "")
+            if item.get("used") is not None:
+                txt += f" – {'genutzt' if item['used'] else 'nicht genutzt'}"
+            if item.get("useful") is not None:
+                txt += f", {'sinnvoll' if item['useful'] else 'nicht sinnvoll'}"
+            if item.get("adaptation"):
+                txt += f" – {item['adaptation']}"
+            parts.append(txt)
+        return "; ".join(parts)
+
+    def _ga(lst):
+        return "; ".join(
+            f"{item.get('goal')}: {item.get('achievement')}{' – ' + item.get('comment') if item.get('comment') else ''}"
+            for item in lst
+        )
+
+    return {
+        "Datum": str(entry.session_date),
+        "Ziele": _join(entry.goals),
+        "Prioritäten": _join(entry.priorities),
+        "Strategien": _join(entry.strategies),
+        "Ressourcen": _join(entry.resources),
+        "Zeitplanung": _tp(entry.time_planning),
+        "Erwartungen": _exp(entry.expectations),
+        "Schritte": _join(entry.steps),
+        "Zeitnutzung": _tp(entry.time_usage),
+        "Strategie-Check": _sc(entry.strategy_check),
+        "Probleme": entry.problems,
+        "Emotionen": entry.emotions,
+        "Zielerreichung": _ga(entry.goal_achievement),
+        "Strategie-Bewertung": _join(entry.strategy_evaluation),
+        "Gelerntes (Inhaltlich)": entry.learned_subject,
+        "Gelerntes (Arbeitsweise)": entry.learned_work,
+        "War die Planung realistisch?": entry.planning_realistic,
+        "Abweichungen von der Planung": entry.planning_deviations,
+        "Motivation (Bewertung)": entry.motivation_rating,
+        "Motivation verbessern": entry.motivation_improve,
+        "Nächste Lernphase": entry.next_phase,
+        "Strategie-Ausblick": entry.strategy_outlook,
+    }
+
+
+def legacy_rows(student, group_label, entries):
+    """Export rows of ``entries`` as dicts keyed by column, the old way."""
+    rows = []
+    for e in entries:
+        row = {
+            "Pseudonym": student.pseudonym,
+            "Gruppenzugehörigkeit": group_label,
+            "Gesamtziel": student.overall_goal or "",
+            "Fälligkeitsdatum des Gesamtziels": student.overall_goal_due_date or "",
+        }
+        row.update(legacy_entry_flat(e))
+        rows.append(row)
+    return rows
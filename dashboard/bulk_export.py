@@ -0,0 +1,150 @@
+"""Study-wide export of all classrooms of a teacher as a background job.
+
+The archive contains a CSV and an XLSX file per classroom and a combined CSV
+and XLSX file with an additional ``Klasse`` column. Every classroom is read
+once in chunks (see :func:`~dashboard.export_views.classroom_rows`) and its
+rows are written to all four files at the same time.
+"""
+
+import csv
+import logging
+import os
+import zipfile
+from datetime import timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.text import slugify
+from openpyxl import Workbook
+
+from . import jobs
+from .export_views import classroom_rows
+from .exporters import FIELDNAMES
+from .models import Classroom, ExportJob
+
+logger = logging.getLogger(__name__)
+
+COMBINED_NAME = "alle-klassen"
+STALE_ERROR = "Der Export wurde abgebrochen. Bitte starte ihn erneut."
+
+
+def export_path(job):
+    return Path(settings.EXPORT_ROOT) / job.file
+
+
+def _classroom_name(classroom):
+    return f"{slugify(classroom.name) or 'klasse'}-{classroom.id}"
+
+
+def write_archive(job, classrooms, target):
+    """Write the export of ``classrooms`` to the ZIP file ``target``."""
+    entries_done = 0
+    with TemporaryDirectory() as tmpdir, zipfile.ZipFile(
+        target, "w", zipfile.ZIP_DEFLATED
+    ) as archive:
+        tmpdir = Path(tmpdir)
+        combined_wb = Workbook(write_only=True)
+        combined_ws = combined_wb.create_sheet("Alle Klassen")
+        combined_ws.append(["Klasse"] + FIELDNAMES)
+        combined_csv_path = tmpdir / f"{COMBINED_NAME}.csv"
+        with open(combined_csv_path, "w", newline="", encoding="utf-8") as combined:
+            combined_writer = csv.writer(combined)
+            combined_writer.writerow(["Klasse"] + FIELDNAMES)
+            for done, classroom in enumerate(classrooms, start=1):
+                name = _classroom_name(classroom)
+                wb = Workbook(write_only=True)
+                ws = wb.create_sheet()
+                ws.append(FIELDNAMES)
+                csv_path = tmpdir / f"{name}.csv"
+                xlsx_path = tmpdir / f"{name}.xlsx"
+                with open(csv_path, "w", newline="", encoding="utf-8") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(FIELDNAMES)
+                    for row in classroom_rows(classroom):
+                        writer.writerow(row)
+                        ws.append(row)
+                        combined_writer.writerow((classroom.name,) + row)
+                        combined_ws.append((classroom.name,) + row)
+                        entries_done += 1
+                wb.save(xlsx_path)
+                for path in (csv_path, xlsx_path):
+                    archive.write(path, path.name)
+                    os.remove(path)
+                ExportJob.objects.filter(id=job.id).update(
+                    classrooms_done=done, entries_done=entries_done
+                )
+        archive.write(combined_csv_path, combined_csv_path.name)
+        combined_xlsx_path = tmpdir / f"{COMBINED_NAME}.xlsx"
+        combined_wb.save(combined_xlsx_path)
+        archive.write(combined_xlsx_path, combined_xlsx_path.name)
+
+
+def run_export(job_id):
+    """Write the archive for a pending job and record the outcome."""
+    if not jobs.claim(ExportJob, job_id):
+        return
+    job = ExportJob.objects.get(id=job_id)
+    classrooms = list(
+        Classroom.objects.filter(teacher_id=job.teacher_id).order_by("name", "id")
+    )
+    ExportJob.objects.filter(id=job_id).update(classrooms_total=len(classrooms))
+    job.file = f"studie-{job.teacher_id}-{job.id}.zip"
+    target = export_path(job)
+    partial = target.with_suffix(".part")
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        write_archive(job, classrooms, partial)
+        os.replace(partial, target)
+    except Exception as exc:
+        logger.exception("Export job %s failed", job_id)
+        if partial.exists():
+            partial.unlink()
+        ExportJob.objects.filter(id=job_id).update(
+            status=ExportJob.Status.FAILED,
+            error=str(exc)[:255],
+            finished_at=timezone.now(),
+        )
+        return
+    ExportJob.objects.filter(id=job_id).update(
+        status=ExportJob.Status.DONE, file=job.file, finished_at=timezone.now()
+    )
+
+
+# Exports are memory and CPU heavy, so they run one at a time.
+_runner = jobs.JobRunner(run_export, "export-job")
+
+
+def enqueue_export(teacher):
+    """Create an export job for ``teacher`` and start it per ``EXPORT_JOB_BACKEND``."""
+    job = ExportJob.objects.create(teacher=teacher)
+    return _runner.start(job, settings.EXPORT_JOB_BACKEND)
+
+
+def is_stale(job):
+    """Whether ``job`` is unfinished ``EXPORT_JOB_TIMEOUT`` seconds after creation."""
+    cutoff = timezone.now() - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT)
+    unfinished = job.status in (ExportJob.Status.PENDING, ExportJob.Status.RUNNING)
+    return unfinished and job.created_at < cutoff
+
+
+def reap_stale_exports(timeout=None):
+    """Fail exports that did not finish, e.g. because the process restarted.
+
+    Jobs run by a process-local thread are lost with the process, so pending
+    jobs are failed as well as running ones. Returns the number of jobs.
+    """
+    timeout = timeout or settings.EXPORT_JOB_TIMEOUT
+    return len(jobs.reap_stale(ExportJob, timeout, STALE_ERROR, pending=True))
+
+
+def purge_exports(cutoff):
+    """Delete export jobs created before ``cutoff`` and their archives."""
+    old = ExportJob.objects.filter(created_at__lt=cutoff)
+    for job in old.exclude(file=""):
+        path = export_path(job)
+        path.unlink(missing_ok=True)
+        path.with_suffix(".part").unlink(missing_ok=True)
+    deleted, _ = old.delete()
+    return deleted
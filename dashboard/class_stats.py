@@ -0,0 +1,151 @@
+"""Per-day aggregates of a classroom's entries (:class:`ClassroomDayStats`).
+
+Every entry contributes counters to the row of its classroom and session
+date. When an entry is saved its previous contribution is subtracted and the
+new one added with ``F()`` updates, so concurrent saves do not lose counts
+and no other entries have to be read. :func:`rebuild` recomputes the rows
+from scratch, e.g. after bulk updates that bypass the signals.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import ClassroomDayStats, SRLEntry, total_minutes
+
+STAT_FIELDS = (
+    "entries",
+    "planned_minutes",
+    "used_minutes",
+    "strategies_checked",
+    "strategies_used",
+    "strategies_useful",
+    "goals_full",
+    "goals_partial",
+    "goals_missed",
+)
+
+# ``SRLEntry`` fields the counters are computed from.
+SOURCE_FIELDS = ("time_planning", "time_usage", "strategy_check", "goal_achievement")
+
+# Answers of the goal achievement question in the reflection form.
+ACHIEVEMENT_FIELDS = {
+    "vollständig": "goals_full",
+    "teilweise": "goals_partial",
+    "nicht": "goals_missed",
+}
+
+
+def entry_stats(entry):
+    """Return the counters ``entry`` contributes to its day."""
+    stats = dict.fromkeys(STAT_FIELDS, 0)
+    stats["entries"] = 1
+    stats["planned_minutes"] = total_minutes(entry.time_planning or [])
+    stats["used_minutes"] = total_minutes(entry.time_usage or [])
+    for item in entry.strategy_check or []:
+        stats["strategies_checked"] += 1
+        stats["strategies_used"] += bool(item.get("used"))
+        stats["strategies_useful"] += bool(item.get("useful"))
+    for item in entry.goal_achievement or []:
+        field = ACHIEVEMENT_FIELDS.get(item.get("achievement"))
+        if field:
+            stats[field] += 1
+    return stats
+
+
+def _add(classroom_id, day, stats, sign):
+    changes = {f: F(f) + sign * stats[f] for f in STAT_FIELDS if stats[f]}
+    if not changes:
+        return
+    rows = ClassroomDayStats.objects.filter(classroom_id=classroom_id, date=day)
+    if sign > 0:
+        # A subtracted contribution was added before, so only additions may
+        # need to create the row.
+        ClassroomDayStats.objects.get_or_create(classroom_id=classroom_id, date=day)
+    rows.update(**changes)
+
+
+def snapshot(entry):
+    """Return ``(classroom_id, date, stats)`` of an entry as stored in the DB."""
+    stored = (
+        SRLEntry.objects.filter(id=entry.id)
+        .select_related("student")
+        .only("session_date", "student__classroom_id", *SOURCE_FIELDS)
+        .first()
+    )
+    if stored is None:
+        return None
+    return stored.student.classroom_id, stored.session_date, entry_stats(stored)
+
+
+def entry_changed(entry, before=None, deleted=False):
+    """Move the contribution of ``entry`` from ``before`` to its new values."""
+    with transaction.atomic():
+        if before:
+            _add(*before, -1)
+        if not deleted:
+            classroom_id = entry.student.classroom_id
+            _add(classroom_id, entry.session_date, entry_stats(entry), 1)
+
+
+def rebuild(classrooms=None):
+    """Recompute the rows of ``classrooms`` (all if ``None``) from the entries."""
+    entries = SRLEntry.objects.select_related("student").only(
+        "session_date", "student__classroom_id", *SOURCE_FIELDS
+    )
+    rows = ClassroomDayStats.objects.all()
+    if classrooms is not None:
+        entries = entries.filter(student__classroom__in=classrooms)
+        rows = rows.filter(classroom__in=classrooms)
+    totals = defaultdict(lambda: dict.fromkeys(STAT_FIELDS, 0))
+    for entry in entries.iterator(chunk_size=2000):
+        day = totals[(entry.student.classroom_id, entry.session_date)]
+        for field, value in entry_stats(entry).items():
+            day[field] += value
+    with transaction.atomic():
+        rows.delete()
+        ClassroomDayStats.objects.bulk_create(
+            ClassroomDayStats(classroom_id=classroom_id, date=day, **stats)
+            for (classroom_id, day), stats in totals.items()
+        )
+
+
+def _percent(part, whole):
+    return round(100 * part / whole) if whole else 0
+
+
+def classroom_summary(classroom):
+    """Return days, weeks and totals of the classroom for the analytics page."""
+    days = list(classroom.day_stats.filter(entries__gt=0).order_by("date"))
+    weeks = {}
+    totals = dict.fromkeys(STAT_FIELDS, 0)
+    for day in days:
+        monday = day.date - timedelta(days=day.date.weekday())
+        week = weeks.setdefault(
+            monday, {"start": monday, **dict.fromkeys(STAT_FIELDS, 0)}
+        )
+        for field in STAT_FIELDS:
+            value = getattr(day, field)
+            week[field] += value
+            totals[field] += value
+    for week in weeks.values():
+        week["used_rate"] = _percent(week["used_minutes"], week["planned_minutes"])
+    goals = totals["goals_full"] + totals["goals_partial"] + totals["goals_missed"]
+    totals["strategies_used_rate"] = _percent(
+        totals["strategies_used"], totals["strategies_checked"]
+    )
+    totals["strategies_useful_rate"] = _percent(
+        totals["strategies_useful"], totals["strategies_checked"]
+    )
+    totals["used_rate"] = _percent(totals["used_minutes"], totals["planned_minutes"])
+    totals["goals"] = goals
+    totals["goals_distribution"] = [
+        (label, totals[field], _percent(totals[field], goals))
+        for label, field in ACHIEVEMENT_FIELDS.items()
+    ]
+    busiest = max((day.entries for day in days), default=0)
+    for day in days:
+        day.bar = _percent(day.entries, busiest)
+    return {"days": days, "weeks": list(weeks.values()), "totals": totals}
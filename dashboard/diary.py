@@ -0,0 +1,91 @@
+"""Per-student cache of the serialized diary.
+
+Every entry is serialized once with :func:`~dashboard.exporters.entry_nested`
+and kept in the default cache until the student's entries change. Full JSON
+exports and the feedback prompts splice these parts into their documents
+instead of serializing the whole diary again.
+"""
+
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .exporters import entry_nested
+
+
+def _diary_cache_key(student_id):
+    return f"dashboard:diary:{student_id}"
+
+
+def invalidate_diary_cache(student_id):
+    cache.delete(_diary_cache_key(student_id))
+
+
+def _cached_entries(student):
+    """Return the cached per-entry JSON of the student's diary.
+
+    The cache is reused as long as the number of entries and their latest
+    ``updated_at`` are unchanged, so repeated feedback requests and exports
+    do not re-serialize the whole diary.
+    """
+    version = student.entries.aggregate(count=Count("id"), updated=Max("updated_at"))
+    version = (version["count"], version["updated"])
+    key = _diary_cache_key(student.id)
+    cached = cache.get(key)
+    if not cached or cached["version"] != version:
+        entries = student.entries.order_by("session_date", "id")
+        cached = {"version": version, "ids": [], "parts": [], "indented": {}}
+        for entry in entries:
+            cached["ids"].append(entry.id)
+            cached["parts"].append(json.dumps(entry_nested(entry), ensure_ascii=False))
+        cache.set(key, cached, settings.DIARY_CACHE_TIMEOUT)
+    return cached
+
+
+def entry_json_parts(student):
+    """Return ``(entry_id, json)`` pairs for the student's entries in order."""
+    cached = _cached_entries(student)
+    return list(zip(cached["ids"], cached["parts"]))
+
+
+def join_entry_parts(parts):
+    """Join per-entry JSON into a list, as ``json.dumps`` would without indent."""
+    return "[" + ", ".join(parts) + "]"
+
+
+def entries_json(student, indent=None):
+    """Return the student's entries serialized with :func:`entry_nested`."""
+    cached = _cached_entries(student)
+    if indent is None:
+        return join_entry_parts(cached["parts"])
+    if indent not in cached["indented"]:
+        cached["indented"][indent] = json.dumps(
+            [json.loads(part) for part in cached["parts"]],
+            ensure_ascii=False,
+            indent=indent,
+        )
+        cache.set(_diary_cache_key(student.id), cached, settings.DIARY_CACHE_TIMEOUT)
+    return cached["indented"][indent]
+
+
+def splice_entries(header, entries, indent=None):
+    """Serialize the non-empty ``header`` with ``entries`` appended.
+
+    ``entries`` is a JSON list produced with the same ``indent``; the output
+    is identical to ``json.dumps({**header, "Einträge": [...]})``.
+    """
+    head = json.dumps(header, ensure_ascii=False, indent=indent)
+    if indent is None:
+        return f'{head[:-1]}, "Einträge": {entries}}}'
+    # Nested one level deeper, every line of the entries needs extra padding;
+    # newlines only occur between JSON tokens, never inside strings.
+    pad = " " * indent
+    entries = entries.replace("\n", "\n" + pad)
+    return f'{head[:-2]},\n{pad}"Einträge": {entries}\n}}'
+
+
+def diary_json(student, header, indent=None):
+    """Serialize ``header`` followed by the student's cached entries."""
+    return splice_entries(header, entries_json(student, indent), indent)
@@ -1,243 +1,329 @@
-import csv
-import json
+import hashlib
+import io
+import re
+import tempfile
+from datetime import datetime, time
+from datetime import timezone as dt_timezone
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from django.core.cache import caches
+from django.db.models import Count, Max, Prefetch
+from django.http import (
+    FileResponse,
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import parse_etags
 from django.utils.text import slugify
 
-from openpyxl import Workbook
+from .diary import diary_json
+from .exporters import (
+    ExportSource,
+    get_exporter,
+    group_label,
+    student_header,
+)
+from .models import Classroom, Student, SRLEntry
+from .pseudonymize import Pseudonymizer, research_id
 
-from .models import Classroom, Student
+# Students are fetched in chunks, each with one prefetch query for their
+# entries, so memory use does not grow with the size of the classroom.
+STUDENT_CHUNK_SIZE = 50
 
+WATERMARK_HEADER = "X-Next-Watermark"
 
-@login_required
-def export_classroom_data(request, classroom_id):
-    """Placeholder view for exporting classroom data."""
-    return HttpResponse("Export interface not implemented yet.")
-
-
-def _entry_nested(entry):
-    def _tp(lst):
-        return [{"Ziel": item.get("goal"), "Zeit": item.get("time")} for item in lst]
-
-    def _exp(lst):
-        return [
-            {"Ziel": item.get("goal"), "Indikator": item.get("indicator")} for item in lst
-        ]
-
-    def _tu(lst):
-        return [{"Ziel": item.get("goal"), "Zeit": item.get("time")} for item in lst]
-
-    def _sc(lst):
-        return [
-            {
-                "Strategie": item.get("strategy"),
-                "Genutzt": item.get("used"),
-                "Sinnvoll": item.get("useful"),
-                "Anpassung": item.get("adaptation"),
-            }
-            for item in lst
-        ]
-
-    def _ga(lst):
-        return [
-            {
-                "Ziel": item.get("goal"),
-                "Ergebnis": item.get("achievement"),
-                "Kommentar": item.get("comment"),
-            }
-            for item in lst
-        ]
-
-    return {
-        "Datum": str(entry.session_date),
-        "Planung": {
-            "Ziele": entry.goals,
-            "Prioritäten": entry.priorities,
-            "Strategien": entry.strategies,
-            "Ressourcen": entry.resources,
-            "Zeitplanung": _tp(entry.time_planning),
-            "Erwartungen": _exp(entry.expectations),
-        },
-        "Durchführung": {
-            "Schritte": entry.steps,
-            "Zeitnutzung": _tu(entry.time_usage),
-            "Strategie-Check": _sc(entry.strategy_check),
-            "Probleme": entry.problems,
-            "Emotionen": entry.emotions,
-        },
-        "Reflexion": {
-            "Zielerreichung": _ga(entry.goal_achievement),
-            "Strategie-Bewertung": entry.strategy_evaluation,
-            "Gelerntes (Inhaltlich)": entry.learned_subject,
-            "Gelerntes (Arbeitsweise)": entry.learned_work,
-            "War die Planung realistisch?": entry.planning_realistic,
-            "Abweichungen von der Planung": entry.planning_deviations,
-            "Motivation (Bewertung)": entry.motivation_rating,
-            "Motivation verbessern": entry.motivation_improve,
-            "Nächste Lernphase": entry.next_phase,
-            "Strategie-Ausblick": entry.strategy_outlook,
-        },
-    }
-
-
-def _entry_flat(entry):
-    def _join(lst):
-        return "; ".join(lst) if lst else ""
-
-    def _tp(lst):
-        return "; ".join(
-            f"{item.get('goal')} ({item.get('time')})" for item in lst
+
+# A UTC offset after a time whose "+" was decoded to a space, as happens when
+# "+00:00" is put into a query string without escaping it.
+_SPACED_OFFSET = re.compile(r"(\d:\d\d(?::\d\d(?:\.\d+)?)?) (\d\d:?\d\d)$")
+
+
+def parse_watermark(value):
+    value = _SPACED_OFFSET.sub(r"\1+\2", value.strip())
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_window(request):
+    """Parse the ``since``/``until`` parameters into ``updated_at`` filters.
+
+    ``since`` is exclusive so that the watermark of the previous export can be
+    passed in unchanged; ``until`` is inclusive. Returns ``(filters, error)``.
+    """
+    filters = {}
+    for param, lookup in (("since", "updated_at__gt"), ("until", "updated_at__lte")):
+        value = request.GET.get(param)
+        if not value:
+            continue
+        try:
+            filters[lookup] = parse_watermark(value)
+        except ValueError:
+            return None, HttpResponse(f"Ungültiger Zeitpunkt: {param}", status=400)
+    return filters, None
+
+
+def export_pseudonymizer(request):
+    """Return a :class:`Pseudonymizer` for research exports, else ``None``.
+
+    ``pseudonymize=1`` replaces pseudonyms and classroom names by hashed ids;
+    ``mask=1`` additionally masks the free-text answers.
+    """
+    mask_text = request.GET.get("mask") == "1"
+    if request.GET.get("pseudonymize") == "1" or mask_text:
+        return Pseudonymizer(mask_text=mask_text)
+    return None
+
+
+def _research_mode(pseudonymizer):
+    return pseudonymizer and ("research", pseudonymizer.mask_text)
+
+
+def bound_to_watermark(entries, filters):
+    """Limit ``entries`` to the current watermark.
+
+    Returns ``(entries, watermark, count)``. The watermark is the latest
+    ``updated_at`` within ``filters``; changes made while the export is
+    running are left for the next export.
+    """
+    entries = entries.filter(**filters)
+    version = entries.aggregate(count=Count("id"), watermark=Max("updated_at"))
+    watermark = version["watermark"]
+    if watermark is None:
+        return entries.none(), filters.get("updated_at__gt"), 0
+    return entries.filter(updated_at__lte=watermark), watermark, version["count"]
+
+
+def export_etag(*parts):
+    """Return a strong ETag for an export described by ``parts``.
+
+    The parts must identify the exported data, e.g. the student, the format,
+    the export window, the number of entries and their latest ``updated_at``.
+    """
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+def not_modified(request, etag):
+    """Return a 304 response if the client already has ``etag``."""
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    if etag in etags or "*" in etags:
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        return response
+    return None
+
+
+def format_watermark(watermark):
+    """Return ``watermark`` in UTC as ``...Z``, which is safe in query strings."""
+    utc = watermark.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return utc.isoformat() + "Z"
+
+
+def set_watermark(response, watermark):
+    if watermark is not None:
+        response[WATERMARK_HEADER] = format_watermark(watermark)
+    return response
+
+
+def classroom_students(classroom, entries=None, chunk_size=STUDENT_CHUNK_SIZE):
+    """Iterate the classroom's students with their entries prefetched.
+
+    ``entries`` restricts the prefetched entries, e.g. to an export window.
+    """
+    if entries is None:
+        entries = SRLEntry.objects.all()
+    entries = entries.order_by("session_date", "id")
+    return (
+        classroom.students.order_by("pseudonym", "id")
+        .prefetch_related(Prefetch("entries", queryset=entries))
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def classroom_source(
+    classroom,
+    entries=None,
+    skip_empty=False,
+    chunk_size=STUDENT_CHUNK_SIZE,
+    pseudonymizer=None,
+):
+    """Return an :class:`ExportSource` over the classroom's students."""
+    students = classroom_students(classroom, entries, chunk_size)
+    return ExportSource(
+        ((s, s.entries.all()) for s in students),
+        group_label(classroom),
+        skip_empty=skip_empty,
+        pseudonymizer=pseudonymizer,
+    )
+
+
+def classroom_rows(classroom, entries=None):
+    """Yield one flat row (a tuple in ``FIELDNAMES`` order) per entry."""
+    return classroom_source(classroom, entries).rows()
+
+
+class StudentSource(ExportSource):
+    """Export source of one student; full JSON comes from the diary cache."""
+
+    def __init__(self, student, entries, group_label, windowed, pseudonymizer=None):
+        super().__init__(
+            [(student, entries)],
+            group_label,
+            single=True,
+            pseudonymizer=pseudonymizer,
         )
+        self.student = student
+        self.windowed = windowed
+
+    def document_json(self, indent=None):
+        if self.windowed or self.pseudonymizer:
+            return super().document_json(indent)
+        header = student_header(self.student, self.group_label)
+        return diary_json(self.student, header, indent=indent)
+
 
-    def _exp(lst):
-        return "; ".join(
-            f"{item.get('goal')}{': ' + item.get('indicator') if item.get('indicator') else ''}"
-            for item in lst
+def export_response(exporter, source, filename):
+    """Serve ``source`` with ``exporter``.
+
+    Streaming writers are served while the entries are read; the others are
+    written to a temporary file first.
+    """
+    if exporter.streams:
+        response = StreamingHttpResponse(
+            exporter.chunks(source), content_type=exporter.content_type
+        )
+        response["Content-Disposition"] = (
+            f"attachment; filename={filename}.{exporter.extension}"
         )
+        return response
+    tmp = tempfile.TemporaryFile()
+    exporter.write(source, tmp)
+    tmp.seek(0)
+    return FileResponse(
+        tmp,
+        as_attachment=True,
+        filename=f"{filename}.{exporter.extension}",
+        content_type=exporter.content_type,
+    )
+
 
-    def _sc(lst):
-        parts = []
-        for item in lst:
-            txt = item.get("strategy", "")
-            if item.get("used") is not None:
-                txt += f" – {'genutzt' if item['used'] else 'nicht genutzt'}"
-            if item.get("useful") is not None:
-                txt += f", {'sinnvoll' if item['useful'] else 'nicht sinnvoll'}"
-            if item.get("adaptation"):
-                txt += f" – {item['adaptation']}"
-            parts.append(txt)
-        return "; ".join(parts)
-
-    def _ga(lst):
-        return "; ".join(
-            f"{item.get('goal')}: {item.get('achievement')}{' – ' + item.get('comment') if item.get('comment') else ''}"
-            for item in lst
+@login_required
+def export_classroom_data(request, classroom_id):
+    """Export the entries of all students of a classroom."""
+    classroom = get_object_or_404(Classroom, id=classroom_id, teacher=request.user)
+    fmt = request.GET.get("format", "json").lower()
+    exporter = get_exporter(fmt)
+    if exporter is None:
+        return HttpResponse(status=400)
+    window, error = export_window(request)
+    if error:
+        return error
+    pseudonymizer = export_pseudonymizer(request)
+    entries, watermark, count = bound_to_watermark(
+        SRLEntry.objects.filter(student__classroom=classroom), window
+    )
+    students = list(
+        classroom.students.order_by("id").values_list(
+            "id", "pseudonym", "overall_goal", "overall_goal_due_date"
         )
+    )
+    etag = export_etag(
+        "classroom",
+        classroom.id,
+        classroom.name,
+        classroom.group_type,
+        fmt,
+        sorted(window.items()),
+        count,
+        watermark,
+        students,
+        _research_mode(pseudonymizer),
+    )
+    response = not_modified(request, etag)
+    if response:
+        return set_watermark(response, watermark)
 
-    return {
-        "Datum": str(entry.session_date),
-        "Ziele": _join(entry.goals),
-        "Prioritäten": _join(entry.priorities),
-        "Strategien": _join(entry.strategies),
-        "Ressourcen": _join(entry.resources),
-        "Zeitplanung": _tp(entry.time_planning),
-        "Erwartungen": _exp(entry.expectations),
-        "Schritte": _join(entry.steps),
-        "Zeitnutzung": _tp(entry.time_usage),
-        "Strategie-Check": _sc(entry.strategy_check),
-        "Probleme": entry.problems,
-        "Emotionen": entry.emotions,
-        "Zielerreichung": _ga(entry.goal_achievement),
-        "Strategie-Bewertung": _join(entry.strategy_evaluation),
-        "Gelerntes (Inhaltlich)": entry.learned_subject,
-        "Gelerntes (Arbeitsweise)": entry.learned_work,
-        "War die Planung realistisch?": entry.planning_realistic,
-        "Abweichungen von der Planung": entry.planning_deviations,
-        "Motivation (Bewertung)": entry.motivation_rating,
-        "Motivation verbessern": entry.motivation_improve,
-        "Nächste Lernphase": entry.next_phase,
-        "Strategie-Ausblick": entry.strategy_outlook,
-    }
+    # A delta export only lists students with changed entries.
+    source = classroom_source(
+        classroom, entries, skip_empty=bool(window), pseudonymizer=pseudonymizer
+    )
+    if pseudonymizer:
+        filename = research_id("classroom", classroom.id)
+    else:
+        filename = slugify(classroom.name) or f"klasse-{classroom.id}"
+    response = export_response(exporter, source, filename)
+    response["ETag"] = etag
+    return set_watermark(response, watermark)
 
 
 @login_required
 def export_student_data(request, classroom_id, student_id):
+    """Export the entries of one student.
+
+    Single-student exports are small, so they are rendered completely and
+    kept in the ``exports`` cache under their ETag.
+    """
     classroom = get_object_or_404(Classroom, id=classroom_id, teacher=request.user)
     student = get_object_or_404(Student, id=student_id, classroom=classroom)
     fmt = request.GET.get("format", "json").lower()
-    group_label = (
-        "Kontrollgruppe"
-        if classroom.group_type == Classroom.GroupType.CONTROL
-        else "Experimentalgruppe"
+    exporter = get_exporter(fmt)
+    if exporter is None:
+        return HttpResponse(status=400)
+    window, error = export_window(request)
+    if error:
+        return error
+    pseudonymizer = export_pseudonymizer(request)
+    label = group_label(classroom)
+    entries, watermark, count = bound_to_watermark(student.entries.all(), window)
+    etag = export_etag(
+        "student",
+        student.id,
+        student_header(student, label),
+        fmt,
+        sorted(window.items()),
+        count,
+        watermark,
+        _research_mode(pseudonymizer),
     )
-    entries = student.entries.order_by("session_date")
-
-    if fmt == "json":
-        data = {
-            "Pseudonym": student.pseudonym,
-            "Gruppenzugehörigkeit": group_label,
-            "Gesamtziel": student.overall_goal,
-            "Fälligkeitsdatum des Gesamtziels": student.overall_goal_due_date.isoformat()
-            if student.overall_goal_due_date
-            else None,
-            "Einträge": [_entry_nested(e) for e in entries],
-        }
-        response = HttpResponse(
-            json.dumps(data, ensure_ascii=False, indent=2),
-            content_type="application/json",
-        )
-        response["Content-Disposition"] = (
-            f"attachment; filename={slugify(student.pseudonym)}.json"
-        )
-        return response
+    response = not_modified(request, etag)
+    if response:
+        return set_watermark(response, watermark)
 
-    fieldnames = [
-        "Pseudonym",
-        "Gruppenzugehörigkeit",
-        "Gesamtziel",
-        "Fälligkeitsdatum des Gesamtziels",
-        "Datum",
-        "Ziele",
-        "Prioritäten",
-        "Strategien",
-        "Ressourcen",
-        "Zeitplanung",
-        "Erwartungen",
-        "Schritte",
-        "Zeitnutzung",
-        "Strategie-Check",
-        "Probleme",
-        "Emotionen",
-        "Zielerreichung",
-        "Strategie-Bewertung",
-        "Gelerntes (Inhaltlich)",
-        "Gelerntes (Arbeitsweise)",
-        "War die Planung realistisch?",
-        "Abweichungen von der Planung",
-        "Motivation (Bewertung)",
-        "Motivation verbessern",
-        "Nächste Lernphase",
-        "Strategie-Ausblick",
-    ]
-
-    rows = []
-    for e in entries:
-        row = {
-            "Pseudonym": student.pseudonym,
-            "Gruppenzugehörigkeit": group_label,
-            "Gesamtziel": student.overall_goal or "",
-            "Fälligkeitsdatum des Gesamtziels": student.overall_goal_due_date or "",
-        }
-        row.update(_entry_flat(e))
-        rows.append(row)
-
-    if fmt == "csv":
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = (
-            f"attachment; filename={slugify(student.pseudonym)}.csv"
+    export_cache = caches["exports"]
+    cache_key = "export:" + etag.strip('"')
+    content = export_cache.get(cache_key)
+    if content is None:
+        source = StudentSource(
+            student,
+            entries.order_by("session_date").iterator(),
+            label,
+            windowed=bool(window),
+            pseudonymizer=pseudonymizer,
         )
-        writer = csv.DictWriter(response, fieldnames=fieldnames)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(row)
-        return response
-
-    if fmt == "xlsx":
-        wb = Workbook()
-        ws = wb.active
-        ws.append(fieldnames)
-        for row in rows:
-            ws.append([row.get(fn, "") for fn in fieldnames])
-        response = HttpResponse(
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-        response["Content-Disposition"] = (
-            f"attachment; filename={slugify(student.pseudonym)}.xlsx"
-        )
-        wb.save(response)
-        return response
-
-    return HttpResponse(status=400)
-
+        buffer = io.BytesIO()
+        exporter.write(source, buffer)
+        content = buffer.getvalue()
+        if len(content) <= settings.EXPORT_CACHE_MAX_BYTES:
+            export_cache.set(cache_key, content)
+    response = HttpResponse(content, content_type=exporter.content_type)
+    if pseudonymizer:
+        filename = research_id("student", student.id)
+    else:
+        filename = slugify(student.pseudonym)
+    response["Content-Disposition"] = (
+        f"attachment; filename={filename}.{exporter.extension}"
+    )
+    response["ETag"] = etag
+    return set_watermark(response, watermark)
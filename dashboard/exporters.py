@@ -0,0 +1,391 @@
+"""Export formats for SRL entries.
+
+Flat rows are built from the column spec :data:`ENTRY_COLUMNS` and nested
+JSON documents from :func:`entry_nested`. An :class:`ExportSource` reads the
+students and entries once and hands them to one of the writers registered in
+:data:`EXPORTERS`. Writers that can emit their output piece by piece declare
+``streams = True`` and are served with a ``StreamingHttpResponse``; the others
+write to a file first.
+"""
+
+import csv
+import json
+from operator import attrgetter
+
+from openpyxl import Workbook
+
+from .models import Classroom
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+PARQUET_CONTENT_TYPE = "application/vnd.apache.parquet"
+
+
+STUDENT_FIELDNAMES = [
+    "Pseudonym",
+    "Gruppenzugehörigkeit",
+    "Gesamtziel",
+    "Fälligkeitsdatum des Gesamtziels",
+]
+
+
+def _identity(value):
+    return value
+
+
+def _join(lst):
+    return "; ".join(lst) if lst else ""
+
+
+def _join_times(lst):
+    return "; ".join(f"{item.get('goal')} ({item.get('time')})" for item in lst)
+
+
+def _join_expectations(lst):
+    return "; ".join(
+        f"{item.get('goal')}{': ' + item.get('indicator') if item.get('indicator') else ''}"
+        for item in lst
+    )
+
+
+def _join_strategy_check(lst):
+    parts = []
+    for item in lst:
+        txt = item.get("strategy", "")
+        if item.get("used") is not None:
+            txt += f" – {'genutzt' if item['used'] else 'nicht genutzt'}"
+        if item.get("useful") is not None:
+            txt += f", {'sinnvoll' if item['useful'] else 'nicht sinnvoll'}"
+        if item.get("adaptation"):
+            txt += f" – {item['adaptation']}"
+        parts.append(txt)
+    return "; ".join(parts)
+
+
+def _join_goal_achievement(lst):
+    return "; ".join(
+        f"{item.get('goal')}: {item.get('achievement')}{' – ' + item.get('comment') if item.get('comment') else ''}"
+        for item in lst
+    )
+
+
+def _join_strategy_evaluation(lst):
+    # Items are {"strategy", "helpful", "reason", "reuse"} dicts, or plain
+    # strings in older entries.
+    parts = []
+    for item in lst:
+        if not isinstance(item, dict):
+            parts.append(str(item))
+            continue
+        txt = f"{item.get('strategy', '')}: {item.get('helpful', '')}"
+        comment = item.get("reason") or item.get("comment")
+        if comment:
+            txt += f" – {comment}"
+        if item.get("reuse"):
+            txt += f" (erneut: {item['reuse']})"
+        parts.append(txt)
+    return "; ".join(parts)
+
+
+# (column, SRLEntry attribute, formatter) of the flat CSV/XLSX rows.
+ENTRY_COLUMNS = [
+    ("Datum", "session_date", str),
+    ("Ziele", "goals", _join),
+    ("Prioritäten", "priorities", _join),
+    ("Strategien", "strategies", _join),
+    ("Ressourcen", "resources", _join),
+    ("Zeitplanung", "time_planning", _join_times),
+    ("Erwartungen", "expectations", _join_expectations),
+    ("Schritte", "steps", _join),
+    ("Zeitnutzung", "time_usage", _join_times),
+    ("Strategie-Check", "strategy_check", _join_strategy_check),
+    ("Probleme", "problems", _identity),
+    ("Emotionen", "emotions", _identity),
+    ("Zielerreichung", "goal_achievement", _join_goal_achievement),
+    ("Strategie-Bewertung", "strategy_evaluation", _join_strategy_evaluation),
+    ("Gelerntes (Inhaltlich)", "learned_subject", _identity),
+    ("Gelerntes (Arbeitsweise)", "learned_work", _identity),
+    ("War die Planung realistisch?", "planning_realistic", _identity),
+    ("Abweichungen von der Planung", "planning_deviations", _identity),
+    ("Motivation (Bewertung)", "motivation_rating", _identity),
+    ("Motivation verbessern", "motivation_improve", _identity),
+    ("Nächste Lernphase", "next_phase", _identity),
+    ("Strategie-Ausblick", "strategy_outlook", _identity),
+]
+
+FIELDNAMES = STUDENT_FIELDNAMES + [column for column, _, _ in ENTRY_COLUMNS]
+
+# Compiled once: one attrgetter call fetches all values of an entry.
+_entry_values = attrgetter(*(attr for _, attr, _ in ENTRY_COLUMNS))
+_entry_formatters = tuple(fmt for _, _, fmt in ENTRY_COLUMNS)
+
+
+def entry_row(entry):
+    """Return the flat export values of ``entry`` in ``ENTRY_COLUMNS`` order."""
+    return tuple(
+        [fmt(value) for fmt, value in zip(_entry_formatters, _entry_values(entry))]
+    )
+
+
+def group_label(classroom):
+    return (
+        "Kontrollgruppe"
+        if classroom.group_type == Classroom.GroupType.CONTROL
+        else "Experimentalgruppe"
+    )
+
+
+def student_header(student, group_label):
+    return {
+        "Pseudonym": student.pseudonym,
+        "Gruppenzugehörigkeit": group_label,
+        "Gesamtziel": student.overall_goal,
+        "Fälligkeitsdatum des Gesamtziels": (
+            student.overall_goal_due_date.isoformat()
+            if student.overall_goal_due_date
+            else None
+        ),
+    }
+
+
+def student_row(student, group_label):
+    """Return the student columns that prefix each of the student's rows."""
+    return (
+        student.pseudonym,
+        group_label,
+        student.overall_goal or "",
+        student.overall_goal_due_date or "",
+    )
+
+
+def _nested_times(lst):
+    return [{"Ziel": item.get("goal"), "Zeit": item.get("time")} for item in lst]
+
+
+def _nested_expectations(lst):
+    return [
+        {"Ziel": item.get("goal"), "Indikator": item.get("indicator")} for item in lst
+    ]
+
+
+def _nested_strategy_check(lst):
+    return [
+        {
+            "Strategie": item.get("strategy"),
+            "Genutzt": item.get("used"),
+            "Sinnvoll": item.get("useful"),
+            "Anpassung": item.get("adaptation"),
+        }
+        for item in lst
+    ]
+
+
+def _nested_goal_achievement(lst):
+    return [
+        {
+            "Ziel": item.get("goal"),
+            "Ergebnis": item.get("achievement"),
+            "Kommentar": item.get("comment"),
+        }
+        for item in lst
+    ]
+
+
+def entry_nested(entry):
+    return {
+        "Datum": str(entry.session_date),
+        "Planung": {
+            "Ziele": entry.goals,
+            "Prioritäten": entry.priorities,
+            "Strategien": entry.strategies,
+            "Ressourcen": entry.resources,
+            "Zeitplanung": _nested_times(entry.time_planning),
+            "Erwartungen": _nested_expectations(entry.expectations),
+        },
+        "Durchführung": {
+            "Schritte": entry.steps,
+            "Zeitnutzung": _nested_times(entry.time_usage),
+            "Strategie-Check": _nested_strategy_check(entry.strategy_check),
+            "Probleme": entry.problems,
+            "Emotionen": entry.emotions,
+        },
+        "Reflexion": {
+            "Zielerreichung": _nested_goal_achievement(entry.goal_achievement),
+            "Strategie-Bewertung": entry.strategy_evaluation,
+            "Gelerntes (Inhaltlich)": entry.learned_subject,
+            "Gelerntes (Arbeitsweise)": entry.learned_work,
+            "War die Planung realistisch?": entry.planning_realistic,
+            "Abweichungen von der Planung": entry.planning_deviations,
+            "Motivation (Bewertung)": entry.motivation_rating,
+            "Motivation verbessern": entry.motivation_improve,
+            "Nächste Lernphase": entry.next_phase,
+            "Strategie-Ausblick": entry.strategy_outlook,
+        },
+    }
+
+
+class ExportSource:
+    """Students and their entries, read once and shared by every writer.
+
+    ``students`` yields ``(student, entries)`` pairs. ``single`` marks the
+    export of one student, which JSON writes as one object instead of a list.
+    With ``skip_empty`` students without entries are left out of documents.
+    A :class:`~dashboard.pseudonymize.Pseudonymizer` replaces identifying
+    values while the pairs are read.
+    """
+
+    def __init__(
+        self,
+        students,
+        group_label,
+        single=False,
+        skip_empty=False,
+        pseudonymizer=None,
+    ):
+        self.students = students
+        self.group_label = group_label
+        self.single = single
+        self.skip_empty = skip_empty
+        self.pseudonymizer = pseudonymizer
+
+    def pairs(self):
+        if self.pseudonymizer:
+            return self.pseudonymizer.pairs(self.students)
+        return iter(self.students)
+
+    def rows(self):
+        """Yield one flat row (a tuple in ``FIELDNAMES`` order) per entry."""
+        for student, entries in self.pairs():
+            header = student_row(student, self.group_label)
+            for entry in entries:
+                yield header + entry_row(entry)
+
+    def documents(self):
+        """Yield one JSON document (student header plus entries) per student."""
+        for student, entries in self.pairs():
+            entries = [entry_nested(e) for e in entries]
+            if self.skip_empty and not entries:
+                continue
+            document = student_header(student, self.group_label)
+            document["Einträge"] = entries
+            yield document
+
+    def document_json(self, indent=None):
+        """Serialize the document of a single-student export."""
+        document = next(self.documents())
+        return json.dumps(document, ensure_ascii=False, indent=indent)
+
+
+EXPORTERS = {}
+
+
+def register(cls):
+    """Class decorator adding an exporter to :data:`EXPORTERS`."""
+    EXPORTERS[cls.format] = cls
+    return cls
+
+
+def get_exporter(fmt):
+    """Return an exporter for ``fmt`` or ``None`` if the format is unknown."""
+    cls = EXPORTERS.get(fmt)
+    return cls() if cls else None
+
+
+class Exporter:
+    """Base class of export writers.
+
+    Streaming writers implement :meth:`chunks`; the others override
+    :meth:`write` and set ``streams = False``.
+    """
+
+    format = None
+    extension = None
+    content_type = None
+    streams = True
+
+    def chunks(self, source):
+        raise NotImplementedError
+
+    def write(self, source, fileobj):
+        for chunk in self.chunks(source):
+            fileobj.write(chunk.encode("utf-8"))
+
+
+class _Echo:
+    """File-like object whose ``write`` returns the value, for ``csv.writer``."""
+
+    def write(self, value):
+        return value
+
+
+@register
+class CSVExporter(Exporter):
+    format = extension = "csv"
+    content_type = "text/csv"
+    delimiter = ","
+
+    def chunks(self, source):
+        writer = csv.writer(_Echo(), delimiter=self.delimiter)
+        yield writer.writerow(FIELDNAMES)
+        for row in source.rows():
+            yield writer.writerow(row)
+
+
+@register
+class TSVExporter(CSVExporter):
+    format = extension = "tsv"
+    content_type = "text/tab-separated-values"
+    delimiter = "\t"
+
+
+@register
+class JSONExporter(Exporter):
+    format = extension = "json"
+    content_type = "application/json"
+
+    def chunks(self, source):
+        if source.single:
+            yield source.document_json(indent=2)
+            return
+        yield "["
+        for i, document in enumerate(source.documents()):
+            yield ("\n" if i == 0 else ",\n") + json.dumps(document, ensure_ascii=False)
+        yield "\n]\n"
+
+
+@register
+class NDJSONExporter(Exporter):
+    format = extension = "ndjson"
+    content_type = "application/x-ndjson"
+
+    def chunks(self, source):
+        for document in source.documents():
+            yield json.dumps(document, ensure_ascii=False) + "\n"
+
+
+@register
+class XLSXExporter(Exporter):
+    """XLSX is a ZIP archive, so it is written in openpyxl's write-only mode."""
+
+    format = extension = "xlsx"
+    content_type = XLSX_CONTENT_TYPE
+    streams = False
+
+    def write(self, source, fileobj):
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(FIELDNAMES)
+        for row in source.rows():
+            ws.append(row)
+        wb.save(fileobj)
+
+
+@register
+class ParquetExporter(Exporter):
+    format = extension = "parquet"
+    content_type = PARQUET_CONTENT_TYPE
+    streams = False
+
+    def write(self, source, fileobj):
+        from .parquet_export import write_parquet
+
+        write_parquet(source.pairs(), fileobj)
@@ -0,0 +1,491 @@
+"""Prompt assembly and execution of AI feedback requests.
+
+Feedback can either be requested synchronously (:func:`request_completion`),
+streamed token by token (:func:`stream_completion`) or queued as a
+:class:`~dashboard.models.FeedbackJob` that is answered by a background
+thread or by the ``run_feedback_worker`` management command.
+"""
+
+import hashlib
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings as django_settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from . import jobs, openai_client, ratelimit
+from .diary import entry_json_parts, join_entry_parts, splice_entries
+from .models import (
+    AppSettings,
+    FeedbackConversation,
+    FeedbackJob,
+    FeedbackMessage,
+    total_minutes,
+)
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEYS = {
+    FeedbackJob.Kind.PLANNING: "planning_ai_conversation",
+    FeedbackJob.Kind.REFLECTION: "reflection_ai_conversation",
+}
+
+DRAFT_KEYS = {
+    FeedbackJob.Kind.PLANNING: "planning",
+    FeedbackJob.Kind.REFLECTION: "reflection",
+}
+
+CONNECTION_ERROR = "Fehler bei der Verbindung zur OpenAI API."
+JOB_ERROR = "Das Feedback konnte nicht erstellt werden. Bitte versuche es erneut."
+RATE_LIMIT_ERROR = (
+    "Die OpenAI API ist gerade ausgelastet. Bitte versuche es gleich noch einmal."
+)
+
+
+class FeedbackError(Exception):
+    """Raised when no reply could be obtained from the OpenAI API."""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+
+def _conversation(session, student, kind):
+    conversation_id = session.get(SESSION_KEYS[kind])
+    if not conversation_id:
+        return None
+    return FeedbackConversation.objects.filter(
+        id=conversation_id, student=student, kind=kind
+    ).first()
+
+
+def load_history(session, student, kind):
+    """Return the stored messages of the session's conversation of ``kind``."""
+    conversation = _conversation(session, student, kind)
+    if conversation is None:
+        return []
+    return [
+        {"role": role, "content": content}
+        for role, content in conversation.messages.values_list("role", "content")
+    ]
+
+
+def save_history(session, student, kind, messages):
+    """Store ``messages`` as the session's conversation of ``kind``.
+
+    ``messages`` extends the stored history, except that resubmitting an
+    unchanged draft may replace the last reply. Only the difference is
+    written. Conversations are trimmed to ``FEEDBACK_CONVERSATION_MAX_MESSAGES``
+    by dropping the oldest follow-up rounds; the opening prompt and first
+    reply are kept.
+    """
+    conversation = _conversation(session, student, kind)
+    if conversation is None:
+        conversation = FeedbackConversation.objects.create(student=student, kind=kind)
+        FeedbackConversation.objects.filter(student=student, kind=kind).exclude(
+            id=conversation.id
+        ).delete()
+        session[SESSION_KEYS[kind]] = conversation.id
+    stored_ids = list(conversation.messages.values_list("id", flat=True))
+    if stored_ids and len(messages) == len(stored_ids):
+        FeedbackMessage.objects.filter(id=stored_ids[-1]).update(
+            content=messages[-1]["content"]
+        )
+    FeedbackMessage.objects.bulk_create(
+        FeedbackMessage(conversation=conversation, **message)
+        for message in messages[len(stored_ids) :]
+    )
+    limit = django_settings.FEEDBACK_CONVERSATION_MAX_MESSAGES
+    total = max(len(messages), len(stored_ids))
+    if total > limit:
+        excess = total - limit
+        excess += excess % 2
+        drop = conversation.messages.values_list("id", flat=True)[2 : 2 + excess]
+        FeedbackMessage.objects.filter(id__in=list(drop)).delete()
+    conversation.save(update_fields=["updated_at"])
+
+
+def clear_history(session, kind):
+    conversation_id = session.pop(SESSION_KEYS[kind], None)
+    if conversation_id:
+        FeedbackConversation.objects.filter(id=conversation_id).delete()
+
+
+# Rough average for German prose and JSON; errs on the side of overcounting.
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _join(values):
+    return ", ".join(str(v) for v in values if v)
+
+
+def summarize_entry(entry):
+    """Condense an entry into a single line for the diary summary."""
+    parts = [str(entry.session_date)]
+    if entry.goals:
+        parts.append(f"Ziele: {_join(entry.goals)}")
+    if entry.strategies:
+        parts.append(f"Strategien: {_join(entry.strategies)}")
+    planned = total_minutes(entry.time_planning)
+    used = total_minutes(entry.time_usage)
+    if planned or used:
+        parts.append(f"Zeit geplant/genutzt: {planned}/{used} min")
+    useful = [c.get("strategy") for c in entry.strategy_check if c.get("useful")]
+    if useful:
+        parts.append(f"Hilfreich: {_join(useful)}")
+    if entry.goal_achievement:
+        parts.append(
+            "Zielerreichung: "
+            + _join(
+                f"{item.get('goal')}: {item.get('achievement')}"
+                for item in entry.goal_achievement
+            )
+        )
+    for label, text in (
+        ("Probleme", entry.problems),
+        ("Gelernt", entry.learned_work),
+        ("Vorsatz", entry.next_phase),
+    ):
+        if text:
+            text = " ".join(text.split())
+            parts.append(f"{label}: {text[:120]}")
+    return " | ".join(parts)
+
+
+def _summary_lines(student, entry_ids):
+    """Return summary lines for ``entry_ids``, computing missing ones once.
+
+    Lines are persisted on :attr:`Student.diary_summary` and dropped again by
+    the ``SRLEntry`` signals when the entry changes.
+    """
+    summary = student.diary_summary
+    missing = [i for i in entry_ids if str(i) not in summary]
+    if missing:
+        for entry in student.entries.filter(id__in=missing):
+            summary[str(entry.id)] = summarize_entry(entry)
+        student.save(update_fields=["diary_summary"])
+    return [summary[str(i)] for i in entry_ids if str(i) in summary]
+
+
+def _budgeted_prompt(kind, student, draft):
+    """Build the first prompt of a conversation within the token budget.
+
+    The most recent ``prompt_recent_entries`` entries are embedded verbatim and
+    older ones as summary lines. While the prompt exceeds
+    ``prompt_token_budget``, fewer entries are kept verbatim and finally the
+    oldest summary lines are dropped.
+    """
+    settings = AppSettings.cached()
+    template = (
+        _planning_prompt if kind == FeedbackJob.Kind.PLANNING else _reflection_prompt
+    )
+    parts = entry_json_parts(student)
+    keep = min(settings.prompt_recent_entries, len(parts))
+    skip_lines = 0
+    while True:
+        split = len(parts) - keep
+        lines = _summary_lines(student, [i for i, _ in parts[:split]])[skip_lines:]
+        header = {
+            "Gesamtziel": student.overall_goal,
+            "Fälligkeitsdatum des Gesamtziels": (
+                student.overall_goal_due_date.isoformat()
+                if student.overall_goal_due_date
+                else None
+            ),
+        }
+        if lines:
+            header["Zusammenfassung früherer Einträge"] = "\n".join(lines)
+        diary = splice_entries(header, join_entry_parts(p for _, p in parts[split:]))
+        prompt = template(diary, draft)
+        if estimate_tokens(prompt) <= settings.prompt_token_budget:
+            return prompt
+        if keep:
+            keep -= 1
+        elif lines:
+            skip_lines += 1
+        else:
+            return prompt
+
+
+def _planning_prompt(diary, planning):
+    return (
+        "Rolle des KI-Assistenten:\n"
+        "Du bist ein Lerncoach, der einen Schüler während einer mehrwöchigen Projektarbeit unterstützt. "
+        "Der Schüler führt ein selbstreguliertes Lerntagebuch, in dem er seine Lernprozesse dokumentiert. "
+        "Deine Aufgabe ist es, konstruktives, wissenschaftlich fundiertes Feedback zu seiner aktuellen Planung zu geben, "
+        "um ihn bei der Entwicklung von Selbstregulationsfähigkeiten zu unterstützen.\n"
+        "Eingabedaten:\n"
+        f"-> Das derzeitige SRL Tagebuch: {diary}\n"
+        f"-> Der aktuelle Planungsentwurf des Schülers {json.dumps(planning, ensure_ascii=False)}\n"
+        "Hinweise:\n"
+        "Das Lerntagebuch kann auch leer sein (falls dies der erste Eintrag ist).\n"
+        "Die Planung enthält Ziele, Prioritäten (Reihenfolge der Ziele in der sie bearbeitet werden sollen + Markierung besonders wichtiger Ziele), Strategien, Ressourcen, Zeitplanung (wie viel Zeit pro Ziel eingeplant wurde) und Erwartungen (Erwartungen geben an, woran der Schüler festlegt dass das Ziel erreicht wurde).\n"
+        "Aufgabe des KI-Assistenten\n"
+        "Analysiere alle vorliegenden Informationen:\n"
+        "Projektkontext (Gesamtziel + Frist)\n"
+        "Vergangene Lerntagebuch-Einträge (falls vorhanden → Rückbezug auf Erfahrungen, erfolgreiche oder problematische Strategien)\n"
+        "Aktuelle Planung (Ziele, Prioritäten, Strategien, Ressourcen, Zeitplanung, Erfolgskriterien)\n"
+        "Regeln für dein Feedback (wissenschaftlich gestützt)\n"
+        "Autonomie-Support (Selbstbestimmungstheorie)\n"
+        "Gib keine fertigen Lösungen vor.\n"
+        "Stelle reflektierende Fragen („Wie realistisch ist dein Zeitplan im Vergleich zu früher?“) und biete Optionen statt Anweisungen.\n"
+        "Informativ, nicht wertend\n"
+        "Kein einfaches „gut“ oder „schlecht“.\n"
+        "Stattdessen sachliche Rückmeldung mit Verbesserungsvorschlägen („Dein Ziel ist klar formuliert – vielleicht könntest du noch konkretisieren, wie du den Fortschritt überprüfst“).\n"
+        "Ressourcen- und Stärkenorientierung\n"
+        "Betone positive Elemente („Du hast dir mehrere Strategien notiert – das zeigt, dass du vorbereitet bist“).\n"
+        "Gib Hinweise, wie vorhandene Ressourcen sinnvoller eingesetzt werden können.\n"
+        "Metakognition anregen\n"
+        "Stelle Fragen, die den Schüler zum Nachdenken über seine eigenen Entscheidungen bringen („Welche dieser Strategien hat dir in der Vergangenheit am meisten geholfen?“).\n"
+        "Realistische Planung prüfen\n"
+        "Prüfe, ob Zeitaufwand und Strategien im Verhältnis zum Gesamtziel stehen.\n"
+        "Hebe Widersprüche oder Überlastung hervor („Du hast 3 Tage für Recherche eingeplant, aber noch 4 Wochen bis zur Abgabe – wäre eine Verteilung sinnvoll?“).\n"
+        "Verknüpfung mit der Vergangenheit\n"
+        "Falls es Tagebuch-Einträge gibt: beziehe dich aktiv auf sie („Beim letzten Mal hast du geschrieben, dass dich Ablenkungen gestört haben – wie berücksichtigst du das diesmal in deiner Planung?“).\n"
+        "Förderung von Reflexion und Anpassung\n"
+        "Fordere den Schüler am Ende des Feedbacks auf, seine Planung bei Bedarf selbstständig zu überarbeiten.\n"
+        "Erwartete Ausgabe\n"
+        "Formuliere dein Feedback als klar verständlichen Fließtext mit folgenden Komponenten:\n"
+        "Kurze positive Würdigung der aktuellen Planung.\n"
+        "Konkret-informative Rückmeldungen zu den Bereichen Ziele, Strategien, Ressourcen, Zeitplanung und Erfolgskriterien.\n"
+        "Reflektierende Fragen, die den Schüler zum Überarbeiten anregen.\n"
+        "Abschließende Bestärkung, dass der Schüler durch kleine Anpassungen noch besser sein Ziel erreichen kann."
+    )
+
+
+def _reflection_prompt(diary, reflection):
+    return (
+        "Rolle des KI-Assistenten:\n"
+        "Du bist ein Lerncoach, der einen Schüler während einer mehrwöchigen Projektarbeit unterstützt. "
+        "Der Schüler führt ein selbstreguliertes Lerntagebuch, in dem er seine Lernprozesse dokumentiert. "
+        "Jetzt bewertet der Schüler seine Reflexion zur abgeschlossenen Arbeitsphase. "
+        "Deine Aufgabe ist es, konstruktives, wissenschaftlich fundiertes Feedback zu dieser Reflexion zu geben, "
+        "um den Schüler bei der Entwicklung seiner Selbstregulationsfähigkeiten zu unterstützen.\n"
+        "Eingabedaten:\n"
+        f"-> Das derzeitige SRL Tagebuch: {diary}\n"
+        f"-> Die aktuelle Reflexion des Schülers {json.dumps(reflection, ensure_ascii=False)}\n"
+        "Aufgabe des KI-Assistenten\n"
+        "Analysiere alle vorliegenden Informationen:\n"
+        "Projektkontext (Gesamtziel + Frist)\n"
+        "Bisherige Tagebuch-Einträge und Planung (inkl. geplante Ziele, Strategien, Zeitmanagement)\n"
+        "Aktuelle Reflexion (Zielerreichung, Strategien, Lernen, Zeitmanagement, Motivation, Ausblick)\n"
+        "Beachte besonders: Widersprüche und Inkonsistenzen (z. B. „Zeitplan war realistisch“ vs. „große Abweichungen in der Umsetzung“).\n"
+        "Regeln für dein Feedback (wissenschaftlich gestützt)\n"
+        "Autonomie-Support (Selbstbestimmungstheorie)\n"
+        "Stelle offene, reflektierende Fragen, die den Schüler zum eigenen Nachdenken und Anpassen anregen.\n"
+        "Keine Anweisungen, sondern Impulse: „Wie erklärst du dir…?“, „Welche Alternativen siehst du…?“\n"
+        "Informativ, nicht wertend\n"
+        "Kein einfaches „gut/schlecht“.\n"
+        "Stattdessen sachliche Rückmeldungen mit konkreten Hinweisen: „Du hast deine Motivation als schwankend beschrieben – welche Strategien haben dir trotzdem geholfen, dranzubleiben?“\n"
+        "Ressourcen- und Stärkenorientierung\n"
+        "Anerkenne positive Entwicklungen („Du hast erkannt, dass dir Brainstorming geholfen hat – das zeigt, dass du deine Strategien gut reflektierst“).\n"
+        "Hebe Fortschritte hervor (z. B. verbesserte Planung im Vergleich zum Vorherigen).\n"
+        "Metakognition anregen\n"
+        "Stelle Fragen, die den Schüler dazu bringen, über eigene Denk- und Lernprozesse nachzudenken: „Was bedeutet es für dich, dass eine Strategie teilweise geholfen hat?“\n"
+        "Inkonsistenzen ansprechen\n"
+        "Identifiziere mögliche Widersprüche zwischen Planung, Umsetzung und Reflexion (z. B. „Du hast deine Planung als realistisch eingeschätzt, aber schreibst gleichzeitig, dass du stark vom Plan abgewichen bist – wie passt das für dich zusammen?“).\n"
+        "Stelle Nachfragen, ohne belehrend zu wirken.\n"
+        "Ausblick unterstützen\n"
+        "Hilf dem Schüler, aus seiner Reflexion konkrete nächste Schritte abzuleiten.\n"
+        "Stelle Fragen wie: „Welche deiner beschriebenen Strategien würdest du jetzt priorisieren?“ oder „Wie kannst du deine Motivation gezielt stärken?“\n"
+        "Erwartete Ausgabe\n"
+        "Formuliere dein Feedback als klar verständlichen Fließtext mit den folgenden Abschnitten:\n"
+        "Positives (Würdigung von Fortschritten und gelungenen Reflexionselementen)\n"
+        "Konkret-informative Hinweise (Ziele, Strategien, Zeitmanagement, Motivation, Konsistenz)\n"
+        "Reflektierende Fragen (die den Schüler zum Weiterdenken und Anpassen anregen)\n"
+        "Bestärkung (ermutigendes Fazit: kleine Anpassungen führen zu mehr Selbstregulation)"
+    )
+
+
+def _followup(kind, draft):
+    subject = "Planung" if kind == FeedbackJob.Kind.PLANNING else "Reflexion"
+    return (
+        "Der Schüler hat nun einen zweiten Entwurf eingereicht "
+        f"{json.dumps(draft, ensure_ascii=False)} "
+        "gebe erneut Feedback nach den gleichen Richtlinien wie zuvor. "
+        f"Hebe dabei positive Veränderungen der {subject} seit der letzten Version hervor."
+    )
+
+
+def build_messages(kind, student, draft, history=None):
+    """Return the message list for the next feedback round.
+
+    The diary prompt is only built for the first round; follow-up rounds
+    append the new draft to the stored ``history``. Resubmitting an unchanged
+    draft repeats the previous request, which is then answered by the reply
+    cache.
+    """
+    if not history:
+        return [{"role": "user", "content": _budgeted_prompt(kind, student, draft)}]
+    followup = _followup(kind, draft)
+    previous = history[-2]["content"] if len(history) >= 2 else None
+    if previous == followup or (
+        len(history) == 2 and previous == _budgeted_prompt(kind, student, draft)
+    ):
+        return list(history[:-1])
+    messages = list(history)
+    messages.append({"role": "user", "content": followup})
+    return messages
+
+
+def _feedback_error(exc):
+    if exc.status == 429:
+        return FeedbackError(RATE_LIMIT_ERROR, status=503)
+    return FeedbackError(CONNECTION_ERROR)
+
+
+def _reply_cache_key(model, messages):
+    payload = json.dumps([model, messages], ensure_ascii=False, sort_keys=True)
+    return "reply:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _count(name):
+    # The counters are kept with the rate limits in the shared ``ratelimit``
+    # cache, so the settings page shows the numbers of all worker processes.
+    key = f"dashboard:feedback_cache:{name}"
+    try:
+        ratelimit.cache.incr(key)
+    except ValueError:
+        ratelimit.cache.set(key, 1, None)
+
+
+def cached_reply(model, messages):
+    """Return a stored reply for the exact same request, or ``None``."""
+    reply = caches["feedback"].get(_reply_cache_key(model, messages))
+    _count("hits" if reply is not None else "misses")
+    return reply
+
+
+def store_reply(model, messages, reply):
+    caches["feedback"].set(_reply_cache_key(model, messages), reply)
+
+
+def cache_stats():
+    counts = ratelimit.cache.get_many(
+        ["dashboard:feedback_cache:hits", "dashboard:feedback_cache:misses"]
+    )
+    hits = counts.get("dashboard:feedback_cache:hits", 0)
+    misses = counts.get("dashboard:feedback_cache:misses", 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(100 * hits / total) if total else 0,
+    }
+
+
+def request_completion(messages):
+    """Return the reply to ``messages``, from the cache or the API."""
+    settings = AppSettings.cached()
+    reply = cached_reply(settings.openai_model, messages)
+    if reply is not None:
+        return reply
+    try:
+        reply = openai_client.chat_completion(
+            settings.openai_api_key, settings.openai_model, messages
+        )
+    except openai_client.OpenAIError as exc:
+        raise _feedback_error(exc) from exc
+    store_reply(settings.openai_model, messages, reply)
+    return reply
+
+
+async def stream_completion(messages, settings):
+    """Yield the reply to ``messages`` token by token as it is generated.
+
+    ``settings`` is the loaded :class:`~dashboard.models.AppSettings`; it is
+    passed in because this coroutine runs outside of a synchronous context.
+    A cached reply is yielded in one piece.
+    """
+    reply = await sync_to_async(cached_reply)(settings.openai_model, messages)
+    if reply is not None:
+        yield reply
+        return
+    parts = []
+    try:
+        async for content in openai_client.stream_chat_completion(
+            settings.openai_api_key, settings.openai_model, messages
+        ):
+            parts.append(content)
+            yield content
+    except openai_client.OpenAIError as exc:
+        raise _feedback_error(exc) from exc
+    await sync_to_async(store_reply)(settings.openai_model, messages, "".join(parts))
+
+
+def enqueue_job(student, kind, messages):
+    """Store a new feedback job and hand it to the configured backend.
+
+    ``FEEDBACK_JOB_BACKEND`` selects how jobs are processed: ``"thread"`` runs
+    them in a process-local thread pool, ``"worker"`` leaves them for the
+    ``run_feedback_worker`` command and ``"eager"`` answers them immediately.
+    Requests with a cached reply are stored as finished right away.
+
+    The caller holds a concurrency slot of the student's classroom
+    (:func:`~dashboard.ratelimit.acquire_slot`); it is released when the job
+    is finished.
+    """
+    reply = cached_reply(AppSettings.cached().openai_model, messages)
+    if reply is not None:
+        ratelimit.release_slot(student.classroom)
+        now = timezone.now()
+        return FeedbackJob.objects.create(
+            student=student,
+            kind=kind,
+            messages=messages,
+            reply=reply,
+            status=FeedbackJob.Status.DONE,
+            started_at=now,
+            finished_at=now,
+        )
+    job = FeedbackJob.objects.create(student=student, kind=kind, messages=messages)
+    return _runner.start(job, django_settings.FEEDBACK_JOB_BACKEND)
+
+
+def claim_job(job_id):
+    return jobs.claim(FeedbackJob, job_id)
+
+
+def run_job(job_id):
+    if not claim_job(job_id):
+        return
+    job = FeedbackJob.objects.select_related("student__classroom").get(id=job_id)
+    try:
+        job.reply = request_completion(job.messages)
+        job.status = FeedbackJob.Status.DONE
+    except FeedbackError as exc:
+        job.error = str(exc)
+        job.status = FeedbackJob.Status.FAILED
+    except Exception:
+        # The thread pool would swallow the traceback, and the job would stay
+        # RUNNING until it is reaped.
+        logger.exception("Feedback job %s failed", job_id)
+        job.error = JOB_ERROR
+        job.status = FeedbackJob.Status.FAILED
+    finally:
+        ratelimit.release_slot(job.student.classroom)
+    job.finished_at = timezone.now()
+    job.save(update_fields=["reply", "error", "status", "finished_at"])
+
+
+def reap_stale_jobs(timeout=None):
+    """Fail jobs running for longer than ``FEEDBACK_JOB_TIMEOUT`` seconds.
+
+    Their classroom slots are released, as the dead run cannot do it anymore.
+    """
+    timeout = timeout or django_settings.FEEDBACK_JOB_TIMEOUT
+    ids = jobs.reap_stale(FeedbackJob, timeout, JOB_ERROR)
+    for job in FeedbackJob.objects.filter(id__in=ids).select_related(
+        "student__classroom"
+    ):
+        ratelimit.release_slot(job.student.classroom)
+    return len(ids)
+
+
+_runner = jobs.JobRunner(run_job, "feedback-job", workers="FEEDBACK_JOB_WORKERS")
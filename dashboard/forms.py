@@ -68,7 +68,7 @@ class PseudoForm(forms.Form):
         widget=forms.TextInput(
             attrs={
                 "class": "block w-full rounded-lg border-gray-300 focus:border-blue-500 focus:ring-blue-500 p-2.5",
-                "placeholder": "Pseudonym",
+                "placeholder": "Pseudonym oder Zugangscode",
             }
         )
     )
@@ -172,6 +172,36 @@ class ClassEntryLimitForm(forms.ModelForm):
         }
 
 
+class ClassFeedbackLimitForm(forms.ModelForm):
+    class Meta:
+        model = Classroom
+        fields = [
+            "max_feedback_per_student_hour",
+            "max_feedback_per_class_minute",
+            "max_concurrent_feedback",
+        ]
+        widgets = {
+            "max_feedback_per_student_hour": forms.NumberInput(
+                attrs={
+                    "class": "block w-full rounded-lg border-gray-300 focus:border-blue-500 focus:ring-blue-500 p-2.5",
+                    "min": 0,
+                }
+            ),
+            "max_feedback_per_class_minute": forms.NumberInput(
+                attrs={
+                    "class": "block w-full rounded-lg border-gray-300 focus:border-blue-500 focus:ring-blue-500 p-2.5",
+                    "min": 0,
+                }
+            ),
+            "max_concurrent_feedback": forms.NumberInput(
+                attrs={
+                    "class": "block w-full rounded-lg border-gray-300 focus:border-blue-500 focus:ring-blue-500 p-2.5",
+                    "min": 0,
+                }
+            ),
+        }
+
+
 class ClassTimeLimitForm(forms.ModelForm):
     class Meta:
         model = Classroom
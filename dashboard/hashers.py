@@ -0,0 +1,33 @@
+"""Password hashing of student accounts.
+
+Students log in at the start of every lesson, often a whole class within a
+minute, while their accounts guard much less than a teacher's. Their
+passwords therefore use a separately configured, cheaper hasher
+(``STUDENT_PASSWORD_HASHER``); teacher accounts keep ``PASSWORD_HASHERS``.
+Hashes made with other settings are upgraded on the next successful login.
+"""
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.utils.module_loading import import_string
+
+
+class StudentPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with ``STUDENT_PASSWORD_ITERATIONS`` iterations.
+
+    The hashes use the standard ``pbkdf2_sha256`` format, so they are verified
+    by Django's own hasher whatever the iteration count.
+    """
+
+    @property
+    def iterations(self):
+        return settings.STUDENT_PASSWORD_ITERATIONS
+
+
+def student_hasher():
+    """Return the configured hasher for student passwords.
+
+    Its algorithm must also be listed in ``PASSWORD_HASHERS`` so that the
+    stored hashes can be identified.
+    """
+    return import_string(settings.STUDENT_PASSWORD_HASHER)()
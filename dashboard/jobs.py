@@ -0,0 +1,87 @@
+"""Background execution of queued jobs (AI feedback, study-wide exports).
+
+A job is a model row with a ``Status`` of ``PENDING``, ``RUNNING``, ``DONE``
+or ``FAILED``. Whoever runs a job first claims it with :func:`claim`, so a job
+is processed once even if a thread pool and a worker command both pick it up.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+
+def claim(model, job_id):
+    """Mark a pending job as running; return ``False`` if it was taken already."""
+    return (
+        model.objects.filter(id=job_id, status=model.Status.PENDING).update(
+            status=model.Status.RUNNING, started_at=timezone.now()
+        )
+        == 1
+    )
+
+
+def reap_stale(model, timeout, error, pending=False):
+    """Fail jobs that have been running for more than ``timeout`` seconds.
+
+    A job stays ``RUNNING`` forever if the process running it died. With
+    ``pending`` jobs that were created more than ``timeout`` seconds ago and
+    never started are failed as well. Returns the reaped jobs' ids.
+    """
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    stale = Q(status=model.Status.RUNNING, started_at__lt=cutoff)
+    if pending:
+        stale |= Q(status=model.Status.PENDING, created_at__lt=cutoff)
+    ids = list(model.objects.filter(stale).values_list("id", flat=True))
+    model.objects.filter(
+        id__in=ids, status__in=[model.Status.PENDING, model.Status.RUNNING]
+    ).update(status=model.Status.FAILED, error=error, finished_at=timezone.now())
+    return ids
+
+
+class JobRunner:
+    """Hand jobs to ``run(job_id)`` according to a backend setting.
+
+    ``"eager"`` runs the job inside the request, ``"thread"`` in a
+    process-local thread pool of ``workers`` threads (an int or the name of a
+    setting) once the current transaction is committed. Any other backend
+    leaves the job in the database for a worker command.
+    """
+
+    def __init__(self, run, name, workers=1):
+        self.run = run
+        self.name = name
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                workers = self.workers
+                if isinstance(workers, str):
+                    workers = getattr(settings, workers)
+                self._executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix=self.name
+                )
+        return self._executor
+
+    def _run_in_thread(self, job_id):
+        try:
+            self.run(job_id)
+        finally:
+            connection.close()
+
+    def start(self, job, backend):
+        if backend == "eager":
+            self.run(job.id)
+            job.refresh_from_db()
+        elif backend == "thread":
+            transaction.on_commit(
+                lambda: self._get_executor().submit(self._run_in_thread, job.id)
+            )
+        return job
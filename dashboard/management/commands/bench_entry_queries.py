@@ -0,0 +1,110 @@
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from dashboard.benchutils import synthetic_entries
+from dashboard.models import Classroom, SRLEntry, Student
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the student dashboard and entry-limit queries with and "
+        "without the SRLEntry composite indexes. Both variants are measured "
+        "alternately over several rounds and the median is reported. The "
+        "synthetic data is created in a transaction that is rolled back "
+        "afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=500)
+        parser.add_argument("--entries", type=int, default=200)
+        parser.add_argument(
+            "--queries", type=int, default=200, help="Queries per measurement."
+        )
+        parser.add_argument("--rounds", type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            students = self._fixture(options["students"], options["entries"])
+            sample = random.Random(0).choices(students, k=options["queries"])
+            runs = {"before": [], "after": []}
+            for round_ in range(options["rounds"]):
+                # Swap the order every round so neither variant always runs
+                # on the colder cache.
+                if round_ % 2:
+                    runs["after"].append(self._measure(sample))
+                    self._drop_indexes()
+                    runs["before"].append(self._measure(sample))
+                    self._create_indexes()
+                else:
+                    self._drop_indexes()
+                    runs["before"].append(self._measure(sample))
+                    self._create_indexes()
+                    runs["after"].append(self._measure(sample))
+            transaction.set_rollback(True)
+        for label, timings in runs.items():
+            self.stdout.write(
+                f"{label:>6}: "
+                + ", ".join(
+                    f"{name} {statistics.median(t[name] for t in timings):.2f} ms"
+                    for name in timings[0]
+                )
+            )
+
+    def _fixture(self, student_count, entry_count):
+        self.stdout.write(
+            f"Creating {student_count} students with {entry_count} entries each..."
+        )
+        teacher = User.objects.create(username="bench-entry-queries")
+        classroom = Classroom.objects.create(
+            teacher=teacher, name="Benchmark", group_type="CONTROL"
+        )
+        students = Student.objects.bulk_create(
+            Student(classroom=classroom, pseudonym=f"S{i}")
+            for i in range(student_count)
+        )
+        # Spread each diary over the days up to today, like a running study.
+        today = date.today()
+        for student in students:
+            entries = synthetic_entries(entry_count)
+            for i, entry in enumerate(entries):
+                entry.student = student
+                entry.session_date = today - timedelta(days=i)
+            SRLEntry.objects.bulk_create(entries, batch_size=1000)
+        return students
+
+    def _drop_indexes(self):
+        editor = connection.schema_editor(collect_sql=True)
+        with connection.cursor() as cursor:
+            for index in SRLEntry._meta.indexes:
+                cursor.execute(str(index.remove_sql(SRLEntry, editor)))
+
+    def _create_indexes(self):
+        editor = connection.schema_editor(collect_sql=True)
+        with connection.cursor() as cursor:
+            for index in SRLEntry._meta.indexes:
+                cursor.execute(str(index.create_sql(SRLEntry, editor)))
+
+    def _measure(self, students):
+        queries = {
+            "dashboard": lambda s: list(s.entries.order_by("-session_date")),
+            # The same lookup and sort without loading the JSON fields.
+            "dashboard ids": lambda s: list(
+                s.entries.order_by("-session_date").values_list("id", flat=True)
+            ),
+            "limit check": lambda s: s.entry_counts(),
+        }
+        timings = {}
+        for name, query in queries.items():
+            for student in students[:10]:
+                query(student)
+            started = time.perf_counter()
+            for student in students:
+                query(student)
+            timings[name] = 1000 * (time.perf_counter() - started) / len(students)
+        return timings
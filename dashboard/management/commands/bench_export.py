@@ -0,0 +1,49 @@
+import csv
+import io
+import time
+
+from django.core.management.base import BaseCommand
+
+from dashboard.benchutils import legacy_rows, synthetic_entries
+from dashboard.exporters import FIELDNAMES, entry_row, student_row
+from dashboard.models import Student
+
+
+def _legacy(student, group_label, entries):
+    writer = csv.DictWriter(io.StringIO(), fieldnames=FIELDNAMES)
+    writer.writeheader()
+    for row in legacy_rows(student, group_label, entries):
+        writer.writerow(row)
+
+
+def _current(student, group_label, entries):
+    writer = csv.writer(io.StringIO())
+    writer.writerow(FIELDNAMES)
+    header = student_row(student, group_label)
+    writer.writerows(header + entry_row(e) for e in entries)
+
+
+class Command(BaseCommand):
+    help = "Benchmark flat export rows (CSV) for synthetic entries, before/after."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entries", type=int, default=100_000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        count = options["entries"]
+        student = Student(pseudonym="Bench", overall_goal="Abitur")
+        entries = synthetic_entries(count)
+        for label, func in (("before", _legacy), ("after", _current)):
+            best = min(
+                self._time(func, student, entries) for _ in range(options["repeat"])
+            )
+            self.stdout.write(
+                f"{label:>6}: {best:.2f}s for {count} entries, "
+                f"{count / best:,.0f} rows/s"
+            )
+
+    def _time(self, func, student, entries):
+        started = time.perf_counter()
+        func(student, "Experimentalgruppe", entries)
+        return time.perf_counter() - started
@@ -0,0 +1,214 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.text import slugify
+
+from dashboard.export_views import (
+    STUDENT_CHUNK_SIZE,
+    bound_to_watermark,
+    classroom_source,
+    format_watermark,
+    parse_watermark,
+)
+from dashboard.exporters import EXPORTERS, get_exporter
+from dashboard.models import Classroom, SRLEntry
+from dashboard.pseudonymize import Pseudonymizer, research_id
+
+
+def export_classroom(
+    classroom_id,
+    fmt,
+    directory,
+    filters,
+    student_id,
+    chunk_size,
+    skip_empty=False,
+    pseudonymize=False,
+    mask_text=False,
+):
+    """Write one classroom's export file; return ``(path, entries)``.
+
+    ``filters`` must bound ``updated_at`` from above, so that all classrooms
+    are exported up to the same watermark.
+    """
+    classroom = Classroom.objects.get(id=classroom_id)
+    entries = SRLEntry.objects.filter(student__classroom=classroom, **filters)
+    if student_id:
+        entries = entries.filter(student_id=student_id)
+    count = entries.count()
+    exporter = get_exporter(fmt)
+    pseudonymizer = None
+    if pseudonymize or mask_text:
+        pseudonymizer = Pseudonymizer(mask_text=mask_text)
+    source = classroom_source(
+        classroom,
+        entries,
+        skip_empty=skip_empty,
+        chunk_size=chunk_size,
+        pseudonymizer=pseudonymizer,
+    )
+    if pseudonymizer:
+        name = research_id("classroom", classroom.id)
+    else:
+        name = f"{slugify(classroom.name) or 'klasse'}-{classroom.id}"
+    path = Path(directory) / f"{name}.{exporter.extension}"
+    with open(path, "wb") as fileobj:
+        exporter.write(source, fileobj)
+    return str(path), count
+
+
+def _init_worker():
+    # Spawned workers start without Django; forked ones must not share the
+    # parent's database connections.
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Export SRL entries to one file per classroom, optionally in parallel "
+        "worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format", default="csv", choices=sorted(EXPORTERS), dest="fmt"
+        )
+        parser.add_argument(
+            "--output", default=".", help="Directory for the export files."
+        )
+        parser.add_argument("--teacher", help="Username of the teacher.")
+        parser.add_argument(
+            "--classroom", type=int, action="append", help="Classroom id (repeatable)."
+        )
+        parser.add_argument("--student", type=int, help="Student id.")
+        parser.add_argument(
+            "--since", help="Only entries updated after this date/time."
+        )
+        parser.add_argument(
+            "--until", help="Only entries updated up to this date/time."
+        )
+        parser.add_argument("--date-from", help="First session date (YYYY-MM-DD).")
+        parser.add_argument("--date-to", help="Last session date (YYYY-MM-DD).")
+        parser.add_argument(
+            "--pseudonymize",
+            action="store_true",
+            help="Replace pseudonyms and classroom names by hashed ids.",
+        )
+        parser.add_argument(
+            "--mask",
+            action="store_true",
+            help="Also mask free-text answers (implies --pseudonymize).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=min(4, os.cpu_count() or 1),
+            help="Number of worker processes; 1 exports in this process.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=STUDENT_CHUNK_SIZE,
+            help="Students fetched (with their entries) per database round trip.",
+        )
+
+    def handle(self, *args, **options):
+        filters = self._filters(options)
+        classrooms = Classroom.objects.order_by("id")
+        if options["teacher"]:
+            classrooms = classrooms.filter(teacher__username=options["teacher"])
+        if options["classroom"]:
+            classrooms = classrooms.filter(id__in=options["classroom"])
+        if options["student"]:
+            classrooms = classrooms.filter(students__id=options["student"])
+        classroom_ids = list(classrooms.values_list("id", flat=True))
+        if not classroom_ids:
+            raise CommandError("No classrooms match the given filters.")
+
+        # Students without entries are only left out of filtered exports.
+        skip_empty = bool(filters or options["student"])
+        # One watermark for all classrooms, taken before any of them is read:
+        # entries changed during the export are left for the next one, and no
+        # classroom is exported up to a later point than the printed value.
+        entries = SRLEntry.objects.filter(student__classroom__in=classroom_ids)
+        if options["student"]:
+            entries = entries.filter(student_id=options["student"])
+        _, watermark, _ = bound_to_watermark(entries, filters)
+        filters["updated_at__lte"] = watermark or timezone.now()
+
+        directory = Path(options["output"])
+        directory.mkdir(parents=True, exist_ok=True)
+        jobs = [
+            (
+                classroom_id,
+                options["fmt"],
+                str(directory),
+                filters,
+                options["student"],
+                options["chunk_size"],
+                skip_empty,
+                options["pseudonymize"],
+                options["mask"],
+            )
+            for classroom_id in classroom_ids
+        ]
+        total_entries = 0
+        for done, (path, count) in enumerate(
+            self._run(jobs, options["workers"]), start=1
+        ):
+            total_entries += count
+            self.stdout.write(f"[{done}/{len(jobs)}] {path}: {count} entries")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Exported {total_entries} entries from {len(jobs)} classroom(s)."
+            )
+        )
+        if watermark:
+            self.stdout.write(f"Next watermark: {format_watermark(watermark)}")
+
+    def _filters(self, options):
+        filters = {}
+        try:
+            if options["since"]:
+                filters["updated_at__gt"] = parse_watermark(options["since"])
+            if options["until"]:
+                filters["updated_at__lte"] = parse_watermark(options["until"])
+        except ValueError as exc:
+            raise CommandError(f"Invalid date/time: {exc}")
+        for option, lookup in (
+            ("date_from", "session_date__gte"),
+            ("date_to", "session_date__lte"),
+        ):
+            if not options[option]:
+                continue
+            try:
+                day = parse_date(options[option])
+            except ValueError:
+                day = None
+            if day is None:
+                raise CommandError(f"Invalid date: {options[option]}")
+            filters[lookup] = day
+        return filters
+
+    def _run(self, jobs, workers):
+        if workers <= 1 or len(jobs) == 1:
+            for job in jobs:
+                yield export_classroom(*job)
+            return
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(jobs)),
+            mp_context=multiprocessing.get_context(),
+            initializer=_init_worker,
+        ) as pool:
+            futures = [pool.submit(export_classroom, *job) for job in jobs]
+            for future in as_completed(futures):
+                yield future.result()
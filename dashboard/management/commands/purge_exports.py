@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from dashboard import bulk_export
+
+
+class Command(BaseCommand):
+    help = "Delete study-wide export jobs and their archives older than the retention period."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.EXPORT_RETENTION_DAYS,
+            help="Retention period in days (default: EXPORT_RETENTION_DAYS).",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        deleted = bulk_export.purge_exports(cutoff)
+        self.stdout.write(f"Deleted {deleted} export job(s) and their archives.")
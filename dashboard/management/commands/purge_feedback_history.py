@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from dashboard.models import FeedbackConversation, FeedbackJob
+
+
+class Command(BaseCommand):
+    help = "Delete AI conversations and feedback jobs older than the retention period."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.FEEDBACK_RETENTION_DAYS,
+            help="Retention period in days (default: FEEDBACK_RETENTION_DAYS).",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        conversations, _ = FeedbackConversation.objects.filter(
+            updated_at__lt=cutoff
+        ).delete()
+        jobs, _ = FeedbackJob.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(
+            f"Deleted {conversations} conversation row(s) and {jobs} job row(s)."
+        )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from dashboard.class_stats import rebuild
+from dashboard.models import Classroom
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-day classroom statistics from the entries, e.g. after "
+        "bulk updates that bypass the model signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--classroom", type=int, action="append", help="Classroom id (repeatable)."
+        )
+
+    def handle(self, *args, **options):
+        classrooms = None
+        if options["classroom"]:
+            classrooms = Classroom.objects.filter(id__in=options["classroom"])
+        rebuild(classrooms)
+        self.stdout.write("Classroom statistics rebuilt.")
@@ -0,0 +1,53 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from dashboard import bulk_export
+from dashboard.models import ExportJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued study-wide exports (EXPORT_JOB_BACKEND = 'worker') and fail "
+        "exports that were lost with their process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process the currently pending exports and exit.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5.0,
+            help="Seconds to sleep when the queue is empty.",
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=settings.EXPORT_JOB_TIMEOUT,
+            help="Fail exports unfinished after this many seconds "
+            "(default: EXPORT_JOB_TIMEOUT).",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            reaped = bulk_export.reap_stale_exports(options["stale_after"])
+            if reaped:
+                self.stdout.write(f"Failed {reaped} stale export(s).")
+            pending = list(
+                ExportJob.objects.filter(status=ExportJob.Status.PENDING)
+                .order_by("created_at")
+                .values_list("id", flat=True)
+            )
+            for job_id in pending:
+                bulk_export.run_export(job_id)
+            if pending:
+                self.stdout.write(f"Processed {len(pending)} export(s).")
+            if options["once"]:
+                break
+            if not pending:
+                time.sleep(options["interval"])
@@ -0,0 +1,50 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from dashboard import feedback
+from dashboard.models import FeedbackJob
+
+
+class Command(BaseCommand):
+    help = "Answer queued AI feedback jobs (FEEDBACK_JOB_BACKEND = 'worker')."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process the currently pending jobs and exit.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to sleep when the queue is empty.",
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=settings.FEEDBACK_JOB_TIMEOUT,
+            help="Fail jobs running for longer than this many seconds "
+            "(default: FEEDBACK_JOB_TIMEOUT).",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            reaped = feedback.reap_stale_jobs(options["stale_after"])
+            if reaped:
+                self.stdout.write(f"Failed {reaped} stale feedback job(s).")
+            pending = list(
+                FeedbackJob.objects.filter(status=FeedbackJob.Status.PENDING)
+                .order_by("created_at")
+                .values_list("id", flat=True)
+            )
+            for job_id in pending:
+                feedback.run_job(job_id)
+            if pending:
+                self.stdout.write(f"Processed {len(pending)} feedback job(s).")
+            if options["once"]:
+                break
+            if not pending:
+                time.sleep(options["interval"])
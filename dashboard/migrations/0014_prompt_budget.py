@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dashboard", "0013_feedbackjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="appsettings",
+            name="prompt_recent_entries",
+            field=models.PositiveSmallIntegerField(default=5),
+        ),
+        migrations.AddField(
+            model_name="appsettings",
+            name="prompt_token_budget",
+            field=models.PositiveIntegerField(default=8000),
+        ),
+        migrations.AddField(
+            model_name="student",
+            name="diary_summary",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dashboard", "0015_feedbackconversation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="classroom",
+            name="max_concurrent_feedback",
+            field=models.PositiveSmallIntegerField(default=5),
+        ),
+        migrations.AddField(
+            model_name="classroom",
+            name="max_feedback_per_class_minute",
+            field=models.PositiveSmallIntegerField(default=10),
+        ),
+        migrations.AddField(
+            model_name="classroom",
+            name="max_feedback_per_student_hour",
+            field=models.PositiveSmallIntegerField(default=20),
+        ),
+    ]
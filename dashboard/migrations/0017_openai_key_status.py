@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dashboard", "0016_classroom_feedback_limits"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="appsettings",
+            name="openai_key_checked_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="appsettings",
+            name="openai_key_valid",
+            field=models.BooleanField(blank=True, null=True),
+        ),
+    ]
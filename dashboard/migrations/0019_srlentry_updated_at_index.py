@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dashboard", "0018_exportjob"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="srlentry",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_stats(apps, schema_editor):
+    from collections import defaultdict
+
+    from dashboard.class_stats import STAT_FIELDS, entry_stats
+
+    SRLEntry = apps.get_model("dashboard", "SRLEntry")
+    ClassroomDayStats = apps.get_model("dashboard", "ClassroomDayStats")
+    totals = defaultdict(lambda: dict.fromkeys(STAT_FIELDS, 0))
+    for entry in SRLEntry.objects.select_related("student").iterator(chunk_size=2000):
+        day = totals[(entry.student.classroom_id, entry.session_date)]
+        for field, value in entry_stats(entry).items():
+            day[field] += value
+    ClassroomDayStats.objects.bulk_create(
+        ClassroomDayStats(classroom_id=classroom_id, date=day, **stats)
+        for (classroom_id, day), stats in totals.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dashboard", "0019_srlentry_updated_at_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ClassroomDayStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("entries", models.IntegerField(default=0)),
+                ("planned_minutes", models.IntegerField(default=0)),
+                ("used_minutes", models.IntegerField(default=0)),
+                ("strategies_checked", models.IntegerField(default=0)),
+                ("strategies_used", models.IntegerField(default=0)),
+                ("strategies_useful", models.IntegerField(default=0)),
+                ("goals_full", models.IntegerField(default=0)),
+                ("goals_partial", models.IntegerField(default=0)),
+                ("goals_missed", models.IntegerField(default=0)),
+                (
+                    "classroom",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="day_stats",
+                        to="dashboard.classroom",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="classroomdaystats",
+            constraint=models.UniqueConstraint(
+                fields=("classroom", "date"), name="unique_classroom_day_stats"
+            ),
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
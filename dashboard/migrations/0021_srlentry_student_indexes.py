@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dashboard", "0020_classroomdaystats"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="srlentry",
+            index=models.Index(
+                fields=["student", "session_date"], name="srlentry_student_date"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="srlentry",
+            index=models.Index(
+                fields=["student", "updated_at"], name="srlentry_student_updated"
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def assign_login_codes(apps, schema_editor):
+    from dashboard.models import generate_login_code
+
+    Student = apps.get_model("dashboard", "Student")
+    used = set(
+        Student.objects.exclude(login_code="").values_list("login_code", flat=True)
+    )
+    for student in Student.objects.filter(login_code="").only("id"):
+        code = generate_login_code()
+        while code in used:
+            code = generate_login_code()
+        used.add(code)
+        Student.objects.filter(id=student.id).update(login_code=code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dashboard", "0021_srlentry_student_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_login_codes, migrations.RunPython.noop),
+    ]
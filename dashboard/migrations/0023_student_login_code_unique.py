@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dashboard", "0022_student_assign_login_codes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="student",
+            index=models.Index(fields=["pseudonym"], name="student_pseudonym"),
+        ),
+        migrations.AddConstraint(
+            model_name="student",
+            constraint=models.UniqueConstraint(
+                fields=("login_code",), name="unique_student_login_code"
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:07
+
+import dashboard.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dashboard", "0024_ratelimit_cache_table"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="student",
+            name="login_code",
+            field=models.CharField(
+                blank=True, default=dashboard.models.generate_login_code, max_length=20
+            ),
+        ),
+    ]
@@ -1,10 +1,31 @@
-from django.db import models
+import time
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, Q
 from django.utils import timezone
+from django.utils.crypto import get_random_string
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password, check_password as auth_check_password
+from .hashers import student_hasher
 from datetime import timedelta
 
 
+def total_minutes(items):
+    """Sum the ``"HH:MM"`` times of a ``time_planning``/``time_usage`` list."""
+    total = 0
+    for item in items:
+        t = item.get("time")
+        if not t:
+            continue
+        try:
+            hours, minutes = [int(x) for x in t.split(":")]
+            total += hours * 60 + minutes
+        except (ValueError, AttributeError):
+            continue
+    return total
+
+
 class Classroom(models.Model):
     class GroupType(models.TextChoices):
         CONTROL = "CONTROL", "Control"
@@ -23,6 +44,10 @@ class Classroom(models.Model):
     max_entries_per_week = models.PositiveSmallIntegerField(
         default=1, choices=[(i, i) for i in range(1, 8)]
     )
+    # AI feedback limits; 0 disables the respective limit.
+    max_feedback_per_student_hour = models.PositiveSmallIntegerField(default=20)
+    max_feedback_per_class_minute = models.PositiveSmallIntegerField(default=10)
+    max_concurrent_feedback = models.PositiveSmallIntegerField(default=5)
     max_planning_execution_minutes = models.PositiveSmallIntegerField(default=90)
 
     class Meta:
@@ -36,50 +61,120 @@ class Classroom(models.Model):
         return self.name
 
 
+# Login codes avoid characters that are easily confused (0/O, 1/I/L).
+LOGIN_CODE_ALPHABET = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"
+LOGIN_CODE_LENGTH = 8
+
+
+def generate_login_code():
+    return get_random_string(LOGIN_CODE_LENGTH, LOGIN_CODE_ALPHABET)
+
+
 class Student(models.Model):
     classroom = models.ForeignKey(
         Classroom, related_name="students", on_delete=models.CASCADE
     )
 
     pseudonym = models.CharField(max_length=50)
-    login_code = models.CharField(max_length=20, blank=True)
+    # Unique across all classrooms; students log in with it. The default also
+    # covers bulk_create(), which bypasses save().
+    login_code = models.CharField(
+        max_length=20, blank=True, default=generate_login_code
+    )
     password = models.CharField(max_length=128, blank=True, default="")
     overall_goal = models.TextField(blank=True, null=True)
     overall_goal_due_date = models.DateField(blank=True, null=True)
+    # One compact line per entry id that has aged out of the AI prompt window.
+    diary_summary = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ("classroom", "pseudonym")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["login_code"], name="unique_student_login_code"
+            )
+        ]
+        # Pseudonym logins of students that do not use their code yet.
+        indexes = [models.Index(fields=["pseudonym"], name="student_pseudonym")]
 
     def __str__(self):
         return f"{self.pseudonym} ({self.classroom.name})"
 
+    def save(self, *args, **kwargs):
+        if not self.login_code:
+            self.login_code = generate_login_code()
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "login_code"}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def for_login(cls, identifier):
+        """Return the student logging in with ``identifier``.
+
+        ``identifier`` is a login code, found with one lookup on its unique
+        index, or a pseudonym. Pseudonyms are only unique per classroom, so
+        they are accepted only if no other classroom uses the same one.
+        Raises ``Student.DoesNotExist`` or ``Student.MultipleObjectsReturned``.
+        """
+        identifier = identifier.strip()
+        student = cls.objects.filter(login_code=identifier.upper()).first()
+        if student:
+            return student
+        return cls.objects.get(pseudonym=identifier)
+
     def set_password(self, raw_password: str):
         if raw_password:
-            self.password = make_password(raw_password)
+            self.password = make_password(raw_password, hasher=student_hasher())
         else:
             self.password = ""
         self.save(update_fields=["password"])
 
     def check_password(self, raw_password: str) -> bool:
+        """Check ``raw_password``; rehash it if the student hasher changed."""
         if not self.password:
             return False
-        return auth_check_password(raw_password, self.password)
+        return auth_check_password(
+            raw_password,
+            self.password,
+            setter=self.set_password,
+            preferred=student_hasher(),
+        )
 
-    def can_create_entry(self):
+    def entry_counts(self):
+        """Return the number of entries of today and of this week in one query."""
         today = timezone.now().date()
         week_start = today - timedelta(days=today.weekday())
         week_end = week_start + timedelta(days=6)
-        daily_count = self.entries.filter(session_date=today).count()
-        weekly_count = self.entries.filter(
+        counts = self.entries.filter(
             session_date__range=(week_start, week_end)
-        ).count()
+        ).aggregate(day=Count("id", filter=Q(session_date=today)), week=Count("id"))
+        return counts["day"], counts["week"]
+
+    def can_create_entry(self):
+        daily_count, weekly_count = self.entry_counts()
         return (
             daily_count < self.classroom.max_entries_per_day
             and weekly_count < self.classroom.max_entries_per_week
         )
 
+    def add_entry(self, entry):
+        """Save the new ``entry`` unless the entry limits are reached.
+
+        The student's row is locked while the limits are checked, so
+        concurrent submissions cannot exceed them. Returns ``False`` if the
+        entry was not saved.
+        """
+        with transaction.atomic():
+            locked = Student.objects.select_for_update().filter(pk=self.pk)
+            locked.values_list("pk").get()
+            if not self.can_create_entry():
+                return False
+            entry.student = self
+            entry.save()
+        return True
+
 
 class LearningGoal(models.Model):
     student = models.ForeignKey(Student, related_name="goals", on_delete=models.CASCADE)
@@ -123,17 +218,176 @@ class SRLEntry(models.Model):
     next_phase = models.TextField(blank=True)
     strategy_outlook = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    # Indexed for delta exports (``since``/``until``).
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # A student's diary by date: dashboards, entry limits, exports.
+            models.Index(
+                fields=["student", "session_date"], name="srlentry_student_date"
+            ),
+            # Per-student versions (count/latest change) for caches and ETags.
+            models.Index(
+                fields=["student", "updated_at"], name="srlentry_student_updated"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.student.pseudonym}: {self.session_date}"
 
 
+class ClassroomDayStats(models.Model):
+    """Totals of a classroom's entries per session date for the analytics page.
+
+    Kept up to date by the ``SRLEntry`` signals (see ``class_stats``), so the
+    page does not need to read and parse the entries themselves.
+    """
+
+    classroom = models.ForeignKey(
+        Classroom, related_name="day_stats", on_delete=models.CASCADE
+    )
+    date = models.DateField()
+    entries = models.IntegerField(default=0)
+    planned_minutes = models.IntegerField(default=0)
+    used_minutes = models.IntegerField(default=0)
+    # Items of ``strategy_check`` and how many were marked used/useful.
+    strategies_checked = models.IntegerField(default=0)
+    strategies_used = models.IntegerField(default=0)
+    strategies_useful = models.IntegerField(default=0)
+    # Items of ``goal_achievement`` by their answer.
+    goals_full = models.IntegerField(default=0)
+    goals_partial = models.IntegerField(default=0)
+    goals_missed = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["classroom", "date"], name="unique_classroom_day_stats"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.classroom.name}: {self.date}"
+
+
+class FeedbackJob(models.Model):
+    """Queued AI feedback request that is answered outside the request cycle."""
+
+    class Kind(models.TextChoices):
+        PLANNING = "PLANNING", "Planning"
+        REFLECTION = "REFLECTION", "Reflection"
+
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "Pending"
+        RUNNING = "RUNNING", "Running"
+        DONE = "DONE", "Done"
+        FAILED = "FAILED", "Failed"
+
+    student = models.ForeignKey(
+        Student, related_name="feedback_jobs", on_delete=models.CASCADE
+    )
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    status = models.CharField(
+        max_length=7, choices=Status.choices, default=Status.PENDING
+    )
+    messages = models.JSONField(default=list)
+    reply = models.TextField(blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    # Set once the reply has been added to the student's conversation.
+    history_saved = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    def __str__(self):
+        return f"{self.student.pseudonym}: {self.kind} ({self.status})"
+
+
+class FeedbackConversation(models.Model):
+    """AI feedback conversation; the session only stores its id."""
+
+    student = models.ForeignKey(
+        Student, related_name="feedback_conversations", on_delete=models.CASCADE
+    )
+    kind = models.CharField(max_length=10, choices=FeedbackJob.Kind.choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.student.pseudonym}: {self.kind}"
+
+
+class FeedbackMessage(models.Model):
+    conversation = models.ForeignKey(
+        FeedbackConversation, related_name="messages", on_delete=models.CASCADE
+    )
+    role = models.CharField(max_length=10)
+    content = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"{self.conversation}: {self.role}"
+
+
+class ExportJob(models.Model):
+    """Study-wide export of all classrooms of a teacher into a ZIP archive."""
+
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "Pending"
+        RUNNING = "RUNNING", "Running"
+        DONE = "DONE", "Done"
+        FAILED = "FAILED", "Failed"
+
+    teacher = models.ForeignKey(
+        User, related_name="export_jobs", on_delete=models.CASCADE
+    )
+    status = models.CharField(
+        max_length=7, choices=Status.choices, default=Status.PENDING
+    )
+    classrooms_total = models.PositiveIntegerField(default=0)
+    classrooms_done = models.PositiveIntegerField(default=0)
+    entries_done = models.PositiveIntegerField(default=0)
+    # Path of the finished archive, relative to EXPORT_ROOT.
+    file = models.CharField(max_length=255, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    @property
+    def progress(self):
+        """Finished share of the classrooms in percent."""
+        if self.status == self.Status.DONE:
+            return 100
+        if not self.classrooms_total:
+            return 0
+        return round(100 * self.classrooms_done / self.classrooms_total)
+
+    def __str__(self):
+        return f"{self.teacher.username}: export ({self.status})"
+
+
+# (instance, expires_at) of the process-local AppSettings cache.
+_app_settings_cache = (None, 0.0)
+
+
 class AppSettings(models.Model):
     """Singleton model to store application wide configuration."""
 
     openai_api_key = models.CharField(max_length=255, blank=True, default="")
     openai_model = models.CharField(max_length=100, default="gpt-4o-mini")
+    prompt_token_budget = models.PositiveIntegerField(default=8000)
+    prompt_recent_entries = models.PositiveSmallIntegerField(default=5)
+    # Result of the last check of ``openai_api_key`` against the API.
+    openai_key_valid = models.BooleanField(null=True, blank=True)
+    openai_key_checked_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     @classmethod
@@ -144,5 +398,27 @@ class AppSettings(models.Model):
             obj.save(update_fields=["openai_model"])
         return obj
 
+    @classmethod
+    def cached(cls):
+        """Return the settings from a process-local cache.
+
+        Saving the settings clears the cache of the saving process; other
+        processes pick up the change after ``APP_SETTINGS_CACHE_TIMEOUT``
+        seconds. The instance is shared, so treat it as read-only and use
+        :meth:`load` to change settings.
+        """
+        global _app_settings_cache
+        obj, expires_at = _app_settings_cache
+        now = time.monotonic()
+        if obj is None or now >= expires_at:
+            obj = cls.load()
+            _app_settings_cache = (obj, now + settings.APP_SETTINGS_CACHE_TIMEOUT)
+        return obj
+
+    @classmethod
+    def clear_cache(cls):
+        global _app_settings_cache
+        _app_settings_cache = (None, 0.0)
+
     def __str__(self):
         return "App Settings"
@@ -0,0 +1,284 @@
+"""Shared HTTP client for every call to the OpenAI API.
+
+Connections are pooled and kept alive between requests, the number of
+concurrent upstream calls per process is bounded, and rate limits (429) and
+server errors (5xx) are retried with exponential backoff that honours
+``Retry-After``. Every call is timed and aggregated in :data:`metrics`.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class OpenAIError(Exception):
+    """Raised when the OpenAI API could not be reached or kept failing."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class CallMetrics:
+    """Thread-safe call counters and timings, grouped by operation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def record(self, operation, duration, attempts, ok):
+        with self._lock:
+            data = self._data.setdefault(
+                operation,
+                {
+                    "calls": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "total_seconds": 0.0,
+                    "max_seconds": 0.0,
+                },
+            )
+            data["calls"] += 1
+            data["errors"] += 0 if ok else 1
+            data["retries"] += max(attempts - 1, 0)
+            data["total_seconds"] += duration
+            data["max_seconds"] = max(data["max_seconds"], duration)
+        logger.info(
+            "openai %s: %.3fs, %d attempt(s), %s",
+            operation,
+            duration,
+            attempts,
+            "ok" if ok else "failed",
+        )
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for operation, data in self._data.items():
+                result[operation] = dict(
+                    data, avg_seconds=data["total_seconds"] / data["calls"]
+                )
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+
+metrics = CallMetrics()
+
+
+def _retry_delay(attempt, retry_after=None):
+    """Seconds to wait before retrying after ``attempt`` failed attempts.
+
+    Returns ``None`` when the server asks us to wait longer than
+    ``OPENAI_BACKOFF_MAX``; holding a worker that long is worse than failing.
+    """
+    backoff_max = settings.OPENAI_BACKOFF_MAX
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            delay = max(delay, 0.0)
+            return delay if delay <= backoff_max else None
+    return min(backoff_max, settings.OPENAI_BACKOFF_BASE * 2 ** (attempt - 1))
+
+
+def _headers(api_key):
+    return {"Authorization": f"Bearer {api_key}"}
+
+
+_session = None
+_semaphore = None
+_sync_lock = threading.Lock()
+
+
+def _get_session():
+    global _session, _semaphore
+    with _sync_lock:
+        if _session is None:
+            pool_size = settings.OPENAI_MAX_CONCURRENCY
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            _session = requests.Session()
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _semaphore = threading.BoundedSemaphore(pool_size)
+    return _session, _semaphore
+
+
+def _request(operation, method, path, api_key, timeout, max_retries, **kwargs):
+    session, semaphore = _get_session()
+    url = f"{settings.OPENAI_API_BASE}{path}"
+    started = time.monotonic()
+    attempts = 0
+    ok = False
+    try:
+        while True:
+            attempts += 1
+            if not semaphore.acquire(timeout=timeout):
+                raise OpenAIError("Too many concurrent OpenAI requests.")
+            try:
+                response = session.request(
+                    method, url, headers=_headers(api_key), timeout=timeout, **kwargs
+                )
+            except requests.RequestException as exc:
+                if attempts > max_retries:
+                    raise OpenAIError(str(exc)) from exc
+                delay = _retry_delay(attempts)
+            else:
+                delay = None
+                if response.status_code in RETRY_STATUSES and attempts <= max_retries:
+                    delay = _retry_delay(attempts, response.headers.get("Retry-After"))
+                if delay is None:
+                    ok = response.ok
+                    return response
+            finally:
+                semaphore.release()
+            time.sleep(delay)
+    finally:
+        metrics.record(operation, time.monotonic() - started, attempts, ok)
+
+
+def chat_completion(api_key, model, messages):
+    """Return the assistant reply for ``messages``."""
+    response = _request(
+        "chat",
+        "POST",
+        "/chat/completions",
+        api_key,
+        timeout=settings.OPENAI_TIMEOUT,
+        max_retries=settings.OPENAI_MAX_RETRIES,
+        json={"model": model, "messages": messages},
+    )
+    if not response.ok:
+        raise OpenAIError(
+            f"OpenAI API returned {response.status_code}", response.status_code
+        )
+    try:
+        return response.json()["choices"][0]["message"]["content"]
+    except (ValueError, KeyError, IndexError, TypeError) as exc:
+        raise OpenAIError("Unexpected response from OpenAI API.") from exc
+
+
+def key_is_valid(api_key):
+    """Check ``api_key`` against the models endpoint, without retries."""
+    if not api_key:
+        return False
+    try:
+        response = _request(
+            "models", "GET", "/models", api_key, timeout=5, max_retries=0
+        )
+    except OpenAIError:
+        return False
+    return response.status_code == 200
+
+
+class _AsyncState:
+    def __init__(self):
+        pool_size = settings.OPENAI_MAX_CONCURRENCY
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            )
+        )
+        self.semaphore = asyncio.Semaphore(pool_size)
+
+
+# httpx clients and asyncio semaphores are bound to the event loop they are
+# first used on, so keep one per running loop.
+_async_states = weakref.WeakKeyDictionary()
+
+
+def _get_async_state():
+    loop = asyncio.get_running_loop()
+    state = _async_states.get(loop)
+    if state is None:
+        state = _async_states[loop] = _AsyncState()
+    return state
+
+
+async def _iter_stream_content(response):
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:") :].strip()
+        if data == "[DONE]":
+            break
+        for choice in json.loads(data).get("choices", []):
+            content = choice.get("delta", {}).get("content")
+            if content:
+                yield content
+
+
+async def stream_chat_completion(api_key, model, messages):
+    """Yield the assistant reply for ``messages`` piece by piece.
+
+    Failed attempts are only retried before the first piece was yielded.
+    """
+    state = _get_async_state()
+    url = f"{settings.OPENAI_API_BASE}/chat/completions"
+    max_retries = settings.OPENAI_MAX_RETRIES
+    started = time.monotonic()
+    attempts = 0
+    streamed = False
+    ok = False
+    try:
+        while True:
+            attempts += 1
+            delay = None
+            async with state.semaphore:
+                try:
+                    async with state.client.stream(
+                        "POST",
+                        url,
+                        headers=_headers(api_key),
+                        json={"model": model, "messages": messages, "stream": True},
+                        timeout=settings.OPENAI_TIMEOUT,
+                    ) as response:
+                        if (
+                            response.status_code in RETRY_STATUSES
+                            and attempts <= max_retries
+                        ):
+                            delay = _retry_delay(
+                                attempts, response.headers.get("Retry-After")
+                            )
+                        if delay is None:
+                            if response.is_error:
+                                raise OpenAIError(
+                                    f"OpenAI API returned {response.status_code}",
+                                    response.status_code,
+                                )
+                            async for content in _iter_stream_content(response):
+                                streamed = True
+                                yield content
+                            ok = True
+                            return
+                except httpx.TransportError as exc:
+                    if streamed or attempts > max_retries:
+                        raise OpenAIError(str(exc)) from exc
+                    delay = _retry_delay(attempts)
+                except (ValueError, AttributeError) as exc:
+                    raise OpenAIError("Unexpected response from OpenAI API.") from exc
+            await asyncio.sleep(delay)
+    finally:
+        metrics.record("chat_stream", time.monotonic() - started, attempts, ok)
@@ -0,0 +1,175 @@
+"""Columnar (Parquet) export of SRL entries for analysis.
+
+Unlike the CSV export, list fields stay lists and structured items stay
+structs, so they can be analysed without re-parsing the ``;``-joined text.
+Columns use the model field names. Minute totals of the time planning and
+usage are precomputed. Rows are written in row groups while the entries are
+read, so memory use is bounded by ``ROW_GROUP_SIZE``.
+"""
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .models import total_minutes
+
+ROW_GROUP_SIZE = 5000
+
+_TIME_ITEM = pa.struct(
+    [("goal", pa.string()), ("time", pa.string()), ("minutes", pa.int32())]
+)
+
+SCHEMA = pa.schema(
+    [
+        ("classroom", pa.string()),
+        ("group_type", pa.string()),
+        ("pseudonym", pa.string()),
+        ("overall_goal", pa.string()),
+        ("overall_goal_due_date", pa.date32()),
+        ("entry_id", pa.int64()),
+        ("session_date", pa.date32()),
+        ("goals", pa.list_(pa.string())),
+        ("priorities", pa.list_(pa.string())),
+        ("strategies", pa.list_(pa.string())),
+        ("resources", pa.list_(pa.string())),
+        ("time_planning", pa.list_(_TIME_ITEM)),
+        (
+            "expectations",
+            pa.list_(pa.struct([("goal", pa.string()), ("indicator", pa.string())])),
+        ),
+        ("steps", pa.list_(pa.string())),
+        ("time_usage", pa.list_(_TIME_ITEM)),
+        (
+            "strategy_check",
+            pa.list_(
+                pa.struct(
+                    [
+                        ("strategy", pa.string()),
+                        ("used", pa.bool_()),
+                        ("useful", pa.bool_()),
+                        ("adaptation", pa.string()),
+                    ]
+                )
+            ),
+        ),
+        ("problems", pa.string()),
+        ("emotions", pa.string()),
+        (
+            "goal_achievement",
+            pa.list_(
+                pa.struct(
+                    [
+                        ("goal", pa.string()),
+                        ("achievement", pa.string()),
+                        ("comment", pa.string()),
+                    ]
+                )
+            ),
+        ),
+        ("strategy_evaluation", pa.list_(pa.string())),
+        ("learned_subject", pa.string()),
+        ("learned_work", pa.string()),
+        ("planning_realistic", pa.string()),
+        ("planning_deviations", pa.string()),
+        ("motivation_rating", pa.string()),
+        ("motivation_improve", pa.string()),
+        ("next_phase", pa.string()),
+        ("strategy_outlook", pa.string()),
+        ("planned_minutes", pa.int32()),
+        ("used_minutes", pa.int32()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        ("updated_at", pa.timestamp("us", tz="UTC")),
+    ]
+)
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def _flag(value):
+    return None if value is None else bool(value)
+
+
+def _texts(lst):
+    return [_text(item) for item in lst or []]
+
+
+def _times(lst):
+    return [
+        {
+            "goal": _text(item.get("goal")),
+            "time": _text(item.get("time")),
+            "minutes": total_minutes([item]),
+        }
+        for item in lst or []
+    ]
+
+
+def _items(lst, fields, convert=None):
+    convert = convert or {}
+    return [
+        {field: convert.get(field, _text)(item.get(field)) for field in fields}
+        for item in lst or []
+    ]
+
+
+def entry_record(student, entry):
+    """Return the Parquet row of ``entry`` as a dict matching :data:`SCHEMA`."""
+    classroom = student.classroom
+    return {
+        "classroom": classroom.name,
+        "group_type": classroom.group_type,
+        "pseudonym": student.pseudonym,
+        "overall_goal": student.overall_goal,
+        "overall_goal_due_date": student.overall_goal_due_date,
+        "entry_id": entry.id,
+        "session_date": entry.session_date,
+        "goals": _texts(entry.goals),
+        "priorities": _texts(entry.priorities),
+        "strategies": _texts(entry.strategies),
+        "resources": _texts(entry.resources),
+        "time_planning": _times(entry.time_planning),
+        "expectations": _items(entry.expectations, ("goal", "indicator")),
+        "steps": _texts(entry.steps),
+        "time_usage": _times(entry.time_usage),
+        "strategy_check": _items(
+            entry.strategy_check,
+            ("strategy", "used", "useful", "adaptation"),
+            {"used": _flag, "useful": _flag},
+        ),
+        "problems": entry.problems,
+        "emotions": entry.emotions,
+        "goal_achievement": _items(
+            entry.goal_achievement, ("goal", "achievement", "comment")
+        ),
+        "strategy_evaluation": _texts(entry.strategy_evaluation),
+        "learned_subject": entry.learned_subject,
+        "learned_work": entry.learned_work,
+        "planning_realistic": entry.planning_realistic,
+        "planning_deviations": entry.planning_deviations,
+        "motivation_rating": entry.motivation_rating,
+        "motivation_improve": entry.motivation_improve,
+        "next_phase": entry.next_phase,
+        "strategy_outlook": entry.strategy_outlook,
+        "planned_minutes": total_minutes(entry.time_planning or []),
+        "used_minutes": total_minutes(entry.time_usage or []),
+        "created_at": entry.created_at,
+        "updated_at": entry.updated_at,
+    }
+
+
+def write_parquet(students, fileobj, row_group_size=ROW_GROUP_SIZE):
+    """Write the entries of ``students`` to ``fileobj`` as Parquet.
+
+    ``students`` yields ``(student, entries)`` pairs.
+    """
+    with pq.ParquetWriter(fileobj, SCHEMA, compression="zstd") as writer:
+        batch = []
+        for student, entries in students:
+            for entry in entries:
+                batch.append(entry_record(student, entry))
+                if len(batch) >= row_group_size:
+                    writer.write_table(pa.Table.from_pylist(batch, schema=SCHEMA))
+                    batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=SCHEMA))
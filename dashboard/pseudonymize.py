@@ -0,0 +1,111 @@
+"""Pseudonymized research exports.
+
+Student pseudonyms and classroom names (which often contain the teacher's
+name) are replaced by keyed hashes of their database ids. The same student
+gets the same identifier in every export, but without ``RESEARCH_EXPORT_KEY``
+the identifiers cannot be linked back to the dashboard. Optionally the
+free-text answers are masked as well.
+
+Students and entries are replaced one by one while the export is read, so a
+research export needs no second pass and no more memory than a normal one.
+"""
+
+import copy
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+
+MASK = "[entfernt]"
+
+# Free-text answers of an entry that may identify the student or others.
+FREE_TEXT_FIELDS = (
+    "problems",
+    "emotions",
+    "learned_subject",
+    "learned_work",
+    "planning_realistic",
+    "planning_deviations",
+    "motivation_rating",
+    "motivation_improve",
+    "next_phase",
+    "strategy_outlook",
+)
+
+# Free-text keys of the items of JSON list fields. Older strategy evaluations
+# are plain strings, which are masked as a whole.
+FREE_TEXT_ITEM_KEYS = {
+    "strategy_check": ("adaptation",),
+    "goal_achievement": ("comment",),
+    "strategy_evaluation": ("comment", "reason"),
+}
+
+
+def research_id(kind, pk):
+    """Return the stable keyed-hash identifier of a ``kind`` object ``pk``."""
+    digest = salted_hmac(
+        f"dashboard.research.{kind}",
+        str(pk),
+        secret=settings.RESEARCH_EXPORT_KEY,
+        algorithm="sha256",
+    ).hexdigest()
+    return f"{kind[0].upper()}-{digest[:16]}"
+
+
+def _mask(value):
+    return MASK if value else value
+
+
+def _mask_items(items, keys):
+    masked = []
+    for item in items or []:
+        if isinstance(item, dict):
+            item = {k: _mask(v) if k in keys else v for k, v in item.items()}
+        else:
+            item = _mask(item)
+        masked.append(item)
+    return masked
+
+
+class Pseudonymizer:
+    """Replace identifying values of students and entries in an export.
+
+    :meth:`pairs` wraps the ``(student, entries)`` pairs of an
+    :class:`~dashboard.exporters.ExportSource`. Copies are modified, never the
+    instances passed in.
+    """
+
+    def __init__(self, mask_text=False):
+        self.mask_text = mask_text
+        self._classrooms = {}
+
+    def classroom(self, classroom):
+        if classroom.id not in self._classrooms:
+            masked = copy.copy(classroom)
+            masked.name = research_id("classroom", classroom.id)
+            self._classrooms[classroom.id] = masked
+        return self._classrooms[classroom.id]
+
+    def student(self, student):
+        masked = copy.copy(student)
+        masked.pseudonym = research_id("student", student.id)
+        masked.classroom = self.classroom(student.classroom)
+        if self.mask_text:
+            masked.overall_goal = _mask(student.overall_goal)
+        return masked
+
+    def entry(self, entry):
+        if not self.mask_text:
+            return entry
+        masked = copy.copy(entry)
+        for field in FREE_TEXT_FIELDS:
+            setattr(masked, field, _mask(getattr(entry, field)))
+        for field, keys in FREE_TEXT_ITEM_KEYS.items():
+            setattr(masked, field, _mask_items(getattr(entry, field), keys))
+        return masked
+
+    def entries(self, entries):
+        return (self.entry(entry) for entry in entries)
+
+    def pairs(self, pairs):
+        for student, entries in pairs:
+            yield self.student(student), self.entries(entries)
@@ -0,0 +1,205 @@
+"""Token bucket limits for AI feedback requests and student login throttling.
+
+Buckets, concurrency and login failure counters are kept in the ``ratelimit``
+cache, a database cache by default, so that all worker processes (and the
+``run_feedback_worker`` command) enforce the same limits.
+"""
+
+import math
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+cache = ConnectionProxy(caches, "ratelimit")
+
+LOCK_TIMEOUT = 2
+# Counters expire so that slots leaked by aborted streams are freed again.
+SLOT_TIMEOUT = 5 * 60
+# Suggested wait when all of a classroom's feedback slots are in use.
+SLOT_RETRY_AFTER = 5
+
+
+@contextmanager
+def _locked(keys):
+    """Hold cache-based locks on ``keys`` for a read-modify-write cycle.
+
+    Locks are taken in sorted order. If one cannot be taken within a second
+    (e.g. a crashed holder), the update proceeds without it rather than
+    blocking the request.
+    """
+    acquired = []
+    try:
+        for key in sorted(keys):
+            lock_key = f"{key}:lock"
+            deadline = time.monotonic() + 1
+            while not cache.add(lock_key, 1, LOCK_TIMEOUT):
+                if time.monotonic() > deadline:
+                    break
+                time.sleep(0.005)
+            else:
+                acquired.append(lock_key)
+        yield
+    finally:
+        cache.delete_many(acquired)
+
+
+def _refilled(state, capacity, period, now):
+    tokens, stamp = state or (capacity, now)
+    return min(capacity, tokens + (now - stamp) * capacity / period)
+
+
+def take(buckets):
+    """Take one token from each of ``buckets`` or from none of them.
+
+    ``buckets`` is a list of ``(key, capacity, period_seconds)``; a bucket
+    refills ``capacity`` tokens per ``period_seconds``. Buckets with a capacity
+    of 0 are unlimited. Returns 0 on success, otherwise the number of seconds
+    until every bucket has a token again.
+    """
+    buckets = [b for b in buckets if b[1]]
+    now = time.time()
+    with _locked([key for key, _, _ in buckets]):
+        states = cache.get_many([key for key, _, _ in buckets])
+        updated = {}
+        retry_after = 0
+        for key, capacity, period in buckets:
+            tokens = _refilled(states.get(key), capacity, period, now)
+            if tokens < 1:
+                retry_after = max(retry_after, (1 - tokens) * period / capacity)
+            updated[key] = (tokens - 1, now)
+        if retry_after:
+            return retry_after
+        for key, capacity, period in buckets:
+            cache.set(key, updated[key], period)
+        return 0
+
+
+def refund(buckets):
+    """Put back the token a successful :func:`take` took from each bucket."""
+    buckets = [b for b in buckets if b[1]]
+    now = time.time()
+    with _locked([key for key, _, _ in buckets]):
+        states = cache.get_many([key for key, _, _ in buckets])
+        for key, capacity, period in buckets:
+            if key in states:
+                tokens = _refilled(states[key], capacity, period, now)
+                cache.set(key, (min(capacity, tokens + 1), now), period)
+
+
+def feedback_buckets(student):
+    classroom = student.classroom
+    return [
+        (
+            f"ratelimit:feedback:student:{student.id}",
+            classroom.max_feedback_per_student_hour,
+            60 * 60,
+        ),
+        (
+            f"ratelimit:feedback:classroom:{classroom.id}",
+            classroom.max_feedback_per_class_minute,
+            60,
+        ),
+        ("ratelimit:feedback:global", settings.FEEDBACK_GLOBAL_PER_MINUTE, 60),
+    ]
+
+
+def check_feedback(student):
+    """Consume a feedback request for ``student``; see :func:`take`."""
+    return take(feedback_buckets(student))
+
+
+def refund_feedback(student):
+    """Give back a request counted by :func:`check_feedback` that was refused."""
+    refund(feedback_buckets(student))
+
+
+def _slot_key(classroom):
+    return f"ratelimit:feedback:running:{classroom.id}"
+
+
+def acquire_slot(classroom):
+    """Reserve one of the classroom's concurrent feedback slots."""
+    if not classroom.max_concurrent_feedback:
+        return True
+    key = _slot_key(classroom)
+    # Not every backend increments atomically (the database cache does not).
+    with _locked([key]):
+        running = cache.get(key, 0)
+        if running >= classroom.max_concurrent_feedback:
+            return False
+        cache.set(key, running + 1, SLOT_TIMEOUT)
+    return True
+
+
+def release_slot(classroom):
+    if not classroom.max_concurrent_feedback:
+        return
+    key = _slot_key(classroom)
+    with _locked([key]):
+        running = cache.get(key, 0)
+        if running > 0:
+            cache.set(key, running - 1, SLOT_TIMEOUT)
+
+
+def _login_ip_bucket(ip):
+    return [
+        (
+            f"ratelimit:login:ip:{ip}",
+            settings.LOGIN_FAILURES_PER_IP,
+            settings.LOGIN_FAILURE_WINDOW,
+        )
+    ]
+
+
+def _account_key(login_code):
+    return f"ratelimit:login:account:{login_code}"
+
+
+def account_retry_after(login_code):
+    """Return the seconds the account is locked out for, else 0.
+
+    Call it before hashing a password, so locked-out attempts cost no CPU.
+    """
+    _, locked_until = cache.get(_account_key(login_code), (0, 0))
+    return max(0, locked_until - time.time())
+
+
+def login_failed(ip, login_code=None):
+    """Record a failed login of the IP and, if known, of the account.
+
+    Every failure takes a token from the IP's bucket, which holds
+    ``LOGIN_FAILURES_PER_IP`` tokens and refills them over
+    ``LOGIN_FAILURE_WINDOW`` seconds. Returns the seconds until the IP may
+    fail again if the bucket was already empty, else 0.
+
+    From ``LOGIN_FAILURES_PER_ACCOUNT`` failures of an account on, every
+    further failure locks it for twice as long, starting at
+    ``LOGIN_LOCKOUT_SECONDS`` and up to ``LOGIN_LOCKOUT_MAX_SECONDS``. Account
+    failures are forgotten after ``LOGIN_FAILURE_WINDOW`` seconds without one.
+    """
+    retry_after = take(_login_ip_bucket(ip))
+    if not login_code:
+        return retry_after
+    key = _account_key(login_code)
+    limit = settings.LOGIN_FAILURES_PER_ACCOUNT
+    now = time.time()
+    with _locked([key]):
+        failures, locked_until = cache.get(key, (0, 0))
+        failures += 1
+        if limit and failures >= limit:
+            lockout = min(
+                settings.LOGIN_LOCKOUT_SECONDS * 2 ** (failures - limit),
+                settings.LOGIN_LOCKOUT_MAX_SECONDS,
+            )
+            locked_until = now + lockout
+        timeout = settings.LOGIN_FAILURE_WINDOW + max(0, locked_until - now)
+        cache.set(key, (failures, locked_until), math.ceil(timeout))
+    return retry_after
+
+
+def login_succeeded(login_code):
+    """Reset the account's failures; the IP's bucket is left as it is."""
+    cache.delete(_account_key(login_code))
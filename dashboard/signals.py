@@ -0,0 +1,60 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import class_stats
+from .diary import invalidate_diary_cache
+from .models import AppSettings, SRLEntry, Student
+
+
+@receiver(post_save, sender=SRLEntry)
+@receiver(post_delete, sender=SRLEntry)
+def srl_entry_changed(sender, instance, created=False, **kwargs):
+    invalidate_diary_cache(instance.student_id)
+    if created:
+        return
+    key = str(instance.id)
+    student = Student.objects.filter(
+        id=instance.student_id, diary_summary__has_key=key
+    ).first()
+    if student:
+        student.diary_summary.pop(key)
+        student.save(update_fields=["diary_summary"])
+
+
+@receiver(pre_save, sender=SRLEntry)
+def srl_entry_saving(sender, instance, update_fields=None, **kwargs):
+    # The stored values are needed to take the entry out of the stats again.
+    instance._stats_before = None
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not (
+        {"session_date", *class_stats.SOURCE_FIELDS} & set(update_fields)
+    ):
+        instance._stats_before = False
+        return
+    instance._stats_before = class_stats.snapshot(instance)
+
+
+@receiver(post_save, sender=SRLEntry)
+def srl_entry_stats(sender, instance, **kwargs):
+    before = getattr(instance, "_stats_before", None)
+    if before is not False:
+        class_stats.entry_changed(instance, before)
+
+
+@receiver(post_delete, sender=SRLEntry)
+def srl_entry_deleted_stats(sender, instance, **kwargs):
+    classroom_id = (
+        Student.objects.filter(id=instance.student_id)
+        .values_list("classroom_id", flat=True)
+        .first()
+    )
+    if classroom_id is not None:
+        before = (classroom_id, instance.session_date, class_stats.entry_stats(instance))
+        class_stats.entry_changed(instance, before, deleted=True)
+
+
+@receiver(post_save, sender=AppSettings)
+@receiver(post_delete, sender=AppSettings)
+def app_settings_changed(sender, **kwargs):
+    AppSettings.clear_cache()
@@ -34,6 +34,16 @@ urlpatterns = [
         student_views.planning_feedback,
         name="planning_feedback",
     ),
+    path(
+        "api/planning/feedback/jobs/",
+        student_views.planning_feedback_job,
+        name="planning_feedback_job",
+    ),
+    path(
+        "api/planning/feedback/stream/",
+        student_views.planning_feedback_stream,
+        name="planning_feedback_stream",
+    ),
     path(
         "api/planning/feedback/reset/",
         student_views.reset_planning_feedback,
@@ -44,9 +54,24 @@ urlpatterns = [
         student_views.reflection_feedback,
         name="reflection_feedback",
     ),
+    path(
+        "api/reflection/feedback/jobs/",
+        student_views.reflection_feedback_job,
+        name="reflection_feedback_job",
+    ),
+    path(
+        "api/reflection/feedback/stream/",
+        student_views.reflection_feedback_stream,
+        name="reflection_feedback_stream",
+    ),
     path(
         "api/reflection/feedback/reset/",
         student_views.reset_reflection_feedback,
         name="reflection_feedback_reset",
     ),
+    path(
+        "api/feedback/jobs/<int:job_id>/",
+        student_views.feedback_job_status,
+        name="feedback_job_status",
+    ),
 ]
@@ -1,13 +1,20 @@
 from functools import wraps
+from django.conf import settings as django_settings
 from django.contrib import messages
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import Student, SRLEntry, AppSettings
-from django.http import HttpResponse, JsonResponse
-from django.views.decorators.http import require_POST
+from .models import Student, SRLEntry, AppSettings, FeedbackJob, total_minutes
+from asgiref.sync import sync_to_async
+from django.http import (
+    HttpResponse,
+    HttpResponseNotAllowed,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.views.decorators.http import require_GET, require_POST
 import json
+import math
 from django.urls import reverse
-import requests
-from .export_views import _entry_nested
+from . import feedback, ratelimit
 from .forms import (
     PseudoForm,
     PasswordLoginForm,
@@ -18,89 +25,171 @@ from .forms import (
 )
 
 
-def _total_minutes(items):
-    total = 0
-    for item in items:
-        t = item.get("time")
-        if not t:
-            continue
-        try:
-            hours, minutes = [int(x) for x in t.split(":")]
-            total += hours * 60 + minutes
-        except (ValueError, AttributeError):
-            continue
-    return total
-
-
 def student_login(request):
     form = PseudoForm()
     return render(request, "dashboard/student_login.html", {"form": form})
 
 
+def _login_student(request):
+    """Return the student of the login code posted by the password steps."""
+    code = request.POST.get("login_code", "")
+    if not code:
+        return None
+    return Student.objects.filter(login_code=code).first()
+
+
+def _logged_in(request, student):
+    request.session["student_id"] = student.id
+    response = HttpResponse(status=204)
+    response["HX-Redirect"] = reverse("student_dashboard")
+    return response
+
+
+def _locked_out(response, retry_after):
+    """Turn a rendered login step into a 429 response with ``Retry-After``."""
+    response.status_code = 429
+    response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+ENTRY_LIMIT_MESSAGE = "Du hast die maximale Anzahl an Einträgen für heute oder diese Woche erreicht."
+
+
+def _lockout_message(retry_after):
+    seconds = max(1, math.ceil(retry_after))
+    return f"Zu viele Fehlversuche. Bitte warte {seconds} Sekunden."
+
+
+def _client_ip(request):
+    """Return the client's address for login throttling.
+
+    Behind a reverse proxy, ``LOGIN_CLIENT_IP_HEADER`` names the ``META`` key
+    the proxy sets. Of a comma-separated list (``X-Forwarded-For``) the last
+    address is used, as that is the one added by the trusted proxy.
+    """
+    header = django_settings.LOGIN_CLIENT_IP_HEADER
+    if header:
+        addresses = [a.strip() for a in request.META.get(header, "").split(",")]
+        if addresses[-1]:
+            return addresses[-1]
+    return request.META.get("REMOTE_ADDR", "")
+
+
 def student_login_step(request):
+    """Handle one step of the student login.
+
+    Known accounts are only stopped by their own lockout, so a class sharing
+    one school IP can log in while someone is guessing. Requests for unknown
+    accounts count against the client IP and get a 429 once its failure
+    budget is used up.
+    """
     if request.method != "POST":
         return HttpResponse(status=405)
+    ip = _client_ip(request)
 
     if "password1" in request.POST:
         form = SetPasswordForm(request.POST)
-        pseudonym = request.POST.get("pseudonym", "")
+        student = _login_student(request)
+        # Only a student without password may choose one here. A double
+        # submit or the back button leads here once the password is set.
+        if student is not None and student.password:
+            return render(
+                request,
+                "dashboard/partials/password_enter_form.html",
+                {
+                    "form": PasswordLoginForm(),
+                    "login_code": student.login_code,
+                    "message": "Dein Passwort ist bereits gesetzt. "
+                    "Bitte melde dich damit an.",
+                },
+            )
+        if student is None:
+            retry_after = ratelimit.login_failed(ip)
+            if retry_after:
+                form.add_error(None, _lockout_message(retry_after))
+            else:
+                form.add_error(None, "Unbekanntes Pseudonym")
+            response = render(
+                request,
+                "dashboard/partials/password_set_form.html",
+                {"form": form, "login_code": request.POST.get("login_code", "")},
+            )
+            return _locked_out(response, retry_after) if retry_after else response
         if form.is_valid():
-            student = get_object_or_404(Student, pseudonym=pseudonym)
             student.set_password(form.cleaned_data["password1"])
-            request.session["student_id"] = student.id
-            response = HttpResponse(status=204)
-            response["HX-Redirect"] = reverse("student_dashboard")
-            return response
+            return _logged_in(request, student)
         return render(
             request,
             "dashboard/partials/password_set_form.html",
-            {"form": form, "pseudonym": pseudonym},
+            {"form": form, "login_code": student.login_code},
         )
 
     if "password" in request.POST:
         form = PasswordLoginForm(request.POST)
-        pseudonym = request.POST.get("pseudonym", "")
+        student = _login_student(request)
+        retry_after = 0
         if form.is_valid():
-            try:
-                student = Student.objects.get(pseudonym=pseudonym)
-                if student.check_password(form.cleaned_data["password"]):
-                    request.session["student_id"] = student.id
-                    response = HttpResponse(status=204)
-                    response["HX-Redirect"] = reverse("student_dashboard")
-                    return response
-                form.add_error("password", "Falsches Passwort")
-            except Student.DoesNotExist:
-                form.add_error(None, "Unbekanntes Pseudonym")
-        return render(
+            if student is None:
+                retry_after = ratelimit.login_failed(ip)
+                if not retry_after:
+                    form.add_error(None, "Unbekanntes Pseudonym")
+            else:
+                # Checked before the password is hashed, so that locked-out
+                # attempts cost no CPU.
+                retry_after = ratelimit.account_retry_after(student.login_code)
+                if not retry_after:
+                    if student.check_password(form.cleaned_data["password"]):
+                        ratelimit.login_succeeded(student.login_code)
+                        return _logged_in(request, student)
+                    ratelimit.login_failed(ip, student.login_code)
+                    form.add_error("password", "Falsches Passwort")
+            if retry_after:
+                form.add_error(None, _lockout_message(retry_after))
+        response = render(
             request,
             "dashboard/partials/password_enter_form.html",
-            {"form": form, "pseudonym": pseudonym},
+            {"form": form, "login_code": request.POST.get("login_code", "")},
         )
+        return _locked_out(response, retry_after) if retry_after else response
 
     form = PseudoForm(request.POST)
     if form.is_valid():
-        pseudonym = form.cleaned_data["pseudonym"]
         try:
-            student = Student.objects.get(pseudonym=pseudonym)
-            if student.password:
-                form_pass = PasswordLoginForm()
-                return render(
+            student = Student.for_login(form.cleaned_data["pseudonym"])
+        except Student.DoesNotExist:
+            retry_after = ratelimit.login_failed(ip)
+            if retry_after:
+                response = render(
                     request,
-                    "dashboard/partials/password_enter_form.html",
-                    {"form": form_pass, "pseudonym": pseudonym},
+                    "dashboard/partials/pseudonym_error.html",
+                    {"error": _lockout_message(retry_after)},
                 )
-            form_set = SetPasswordForm()
+                return _locked_out(response, retry_after)
             return render(
                 request,
-                "dashboard/partials/password_set_form.html",
-                {"form": form_set, "pseudonym": pseudonym},
+                "dashboard/partials/pseudonym_error.html",
+                {"error": "Unbekanntes Pseudonym"},
             )
-        except Student.DoesNotExist:
+        except Student.MultipleObjectsReturned:
             return render(
                 request,
                 "dashboard/partials/pseudonym_error.html",
-                {"error": "Unbekanntes Pseudonym"},
+                {
+                    "error": "Dieses Pseudonym gibt es mehrfach. "
+                    "Bitte melde dich mit deinem Zugangscode an."
+                },
+            )
+        if student.password:
+            return render(
+                request,
+                "dashboard/partials/password_enter_form.html",
+                {"form": PasswordLoginForm(), "login_code": student.login_code},
             )
+        return render(
+            request,
+            "dashboard/partials/password_set_form.html",
+            {"form": SetPasswordForm(), "login_code": student.login_code},
+        )
     return render(
         request,
         "dashboard/partials/pseudonym_error.html",
@@ -125,7 +214,9 @@ def student_required(view_func):
 
 @student_required
 def student_dashboard(request):
-    student = Student.objects.get(id=request.session["student_id"])
+    student = Student.objects.select_related("classroom").get(
+        id=request.session["student_id"]
+    )
     entries = student.entries.order_by("-session_date")
     template = (
         "dashboard/control_student_dashboard.html"
@@ -145,13 +236,17 @@ def student_dashboard(request):
 
 @student_required
 def create_entry(request):
-    student = Student.objects.get(id=request.session["student_id"])
+    student = Student.objects.select_related("classroom").get(
+        id=request.session["student_id"]
+    )
+    # Checked again under a lock when the entry is saved (Student.add_entry).
     if not student.can_create_entry():
+        messages.error(request, ENTRY_LIMIT_MESSAGE)
         return redirect("student_dashboard")
     if request.method == "POST":
         form = PlanningForm(request.POST)
         if form.is_valid():
-            planning_minutes = _total_minutes(
+            planning_minutes = total_minutes(
                 form.cleaned_data.get("time_planning", [])
             )
             limit = student.classroom.max_planning_execution_minutes
@@ -160,11 +255,10 @@ def create_entry(request):
                     request,
                     f"Die Gesamtzeit darf {limit} Minuten nicht überschreiten.",
                 )
+            elif student.add_entry(form.save(commit=False)):
+                feedback.clear_history(request.session, FeedbackJob.Kind.PLANNING)
             else:
-                entry = form.save(commit=False)
-                entry.student = student
-                entry.save()
-                request.session.pop("planning_ai_messages", None)
+                messages.error(request, ENTRY_LIMIT_MESSAGE)
     return redirect("student_dashboard")
 
 
@@ -175,7 +269,7 @@ def add_execution(request, entry_id):
     if request.method == "POST":
         form = ExecutionForm(request.POST, instance=entry)
         if form.is_valid():
-            usage_minutes = _total_minutes(form.cleaned_data.get("time_usage", []))
+            usage_minutes = total_minutes(form.cleaned_data.get("time_usage", []))
             limit = student.classroom.max_planning_execution_minutes
             if usage_minutes > limit:
                 messages.error(
@@ -213,7 +307,9 @@ def create_entry_json(request):
       "expectations": [{"goal": "str", "indicator": "str"}, ...]
     }
     """
-    student = Student.objects.get(id=request.session["student_id"])
+    student = Student.objects.select_related("classroom").get(
+        id=request.session["student_id"]
+    )
     if not student.can_create_entry():
         return JsonResponse({"error": "Entry limit reached"}, status=403)
     try:
@@ -234,7 +330,7 @@ def create_entry_json(request):
     }
     form = PlanningForm(form_data)
     if form.is_valid():
-        planning_minutes = _total_minutes(form.cleaned_data.get("time_planning", []))
+        planning_minutes = total_minutes(form.cleaned_data.get("time_planning", []))
         limit = student.classroom.max_planning_execution_minutes
         if planning_minutes > limit:
             return JsonResponse(
@@ -242,9 +338,9 @@ def create_entry_json(request):
                 status=400,
             )
         entry = form.save(commit=False)
-        entry.student = student
-        entry.save()
-        request.session.pop("planning_ai_messages", None)
+        if not student.add_entry(entry):
+            return JsonResponse({"error": "Entry limit reached"}, status=403)
+        feedback.clear_history(request.session, FeedbackJob.Kind.PLANNING)
         return JsonResponse({"entry_id": entry.id})
     return JsonResponse({"errors": form.errors}, status=400)
 
@@ -279,7 +375,7 @@ def add_execution_json(request, entry_id):
     }
     form = ExecutionForm(form_data, instance=entry)
     if form.is_valid():
-        usage_minutes = _total_minutes(form.cleaned_data.get("time_usage", []))
+        usage_minutes = total_minutes(form.cleaned_data.get("time_usage", []))
         limit = student.classroom.max_planning_execution_minutes
         if usage_minutes > limit:
             return JsonResponse(
@@ -336,203 +432,235 @@ def add_reflection_json(request, entry_id):
     return JsonResponse({"errors": form.errors}, status=400)
 
 
-@student_required
-@require_POST
-def planning_feedback(request):
+def _too_many_requests(retry_after):
+    seconds = max(1, math.ceil(retry_after))
+    response = JsonResponse(
+        {
+            "error": f"Zu viele Feedback-Anfragen. Bitte warte {seconds} Sekunden.",
+            "retry_after": seconds,
+        },
+        status=429,
+    )
+    response["Retry-After"] = str(seconds)
+    return response
+
+
+def _no_slot(student):
+    """Refuse a request for which no feedback slot is free.
+
+    The request did not reach the API, so it does not count against the
+    student's, classroom's or global quota.
+    """
+    ratelimit.refund_feedback(student)
+    return _too_many_requests(ratelimit.SLOT_RETRY_AFTER)
+
+
+def _feedback_messages(request, kind):
+    """Build the next message list for a feedback request.
+
+    Returns ``(student, messages, None)`` or ``(None, None, error_response)``.
+    """
     student = Student.objects.get(id=request.session["student_id"])
     try:
         payload = json.loads(request.body.decode("utf-8"))
     except json.JSONDecodeError:
-        return JsonResponse({"error": "Invalid JSON"}, status=400)
+        return None, None, JsonResponse({"error": "Invalid JSON"}, status=400)
 
-    planning = payload.get("planning", {})
-    entries = student.entries.order_by("session_date")
-    diary = {
-        "Gesamtziel": student.overall_goal,
-        "Fälligkeitsdatum des Gesamtziels": student.overall_goal_due_date.isoformat()
-        if student.overall_goal_due_date
-        else None,
-        "Einträge": [_entry_nested(e) for e in entries],
-    }
+    settings = AppSettings.cached()
+    if not settings.openai_api_key:
+        return (
+            None,
+            None,
+            JsonResponse({"error": "Kein OpenAI API Key hinterlegt."}, status=400),
+        )
 
-    base_prompt = (
-        "Rolle des KI-Assistenten:\n"
-        "Du bist ein Lerncoach, der einen Schüler während einer mehrwöchigen Projektarbeit unterstützt. "
-        "Der Schüler führt ein selbstreguliertes Lerntagebuch, in dem er seine Lernprozesse dokumentiert. "
-        "Deine Aufgabe ist es, konstruktives, wissenschaftlich fundiertes Feedback zu seiner aktuellen Planung zu geben, "
-        "um ihn bei der Entwicklung von Selbstregulationsfähigkeiten zu unterstützen.\n"
-        "Eingabedaten:\n"
-        f"-> Das derzeitige SRL Tagebuch: {json.dumps(diary, ensure_ascii=False)}\n"
-        f"-> Der aktuelle Planungsentwurf des Schülers {json.dumps(planning, ensure_ascii=False)}\n"
-        "Hinweise:\n"
-        "Das Lerntagebuch kann auch leer sein (falls dies der erste Eintrag ist).\n"
-        "Die Planung enthält Ziele, Prioritäten (Reihenfolge der Ziele in der sie bearbeitet werden sollen + Markierung besonders wichtiger Ziele), Strategien, Ressourcen, Zeitplanung (wie viel Zeit pro Ziel eingeplant wurde) und Erwartungen (Erwartungen geben an, woran der Schüler festlegt dass das Ziel erreicht wurde).\n"
-        "Aufgabe des KI-Assistenten\n"
-        "Analysiere alle vorliegenden Informationen:\n"
-        "Projektkontext (Gesamtziel + Frist)\n"
-        "Vergangene Lerntagebuch-Einträge (falls vorhanden → Rückbezug auf Erfahrungen, erfolgreiche oder problematische Strategien)\n"
-        "Aktuelle Planung (Ziele, Prioritäten, Strategien, Ressourcen, Zeitplanung, Erfolgskriterien)\n"
-        "Regeln für dein Feedback (wissenschaftlich gestützt)\n"
-        "Autonomie-Support (Selbstbestimmungstheorie)\n"
-        "Gib keine fertigen Lösungen vor.\n"
-        "Stelle reflektierende Fragen („Wie realistisch ist dein Zeitplan im Vergleich zu früher?“) und biete Optionen statt Anweisungen.\n"
-        "Informativ, nicht wertend\n"
-        "Kein einfaches „gut“ oder „schlecht“.\n"
-        "Stattdessen sachliche Rückmeldung mit Verbesserungsvorschlägen („Dein Ziel ist klar formuliert – vielleicht könntest du noch konkretisieren, wie du den Fortschritt überprüfst“).\n"
-        "Ressourcen- und Stärkenorientierung\n"
-        "Betone positive Elemente („Du hast dir mehrere Strategien notiert – das zeigt, dass du vorbereitet bist“).\n"
-        "Gib Hinweise, wie vorhandene Ressourcen sinnvoller eingesetzt werden können.\n"
-        "Metakognition anregen\n"
-        "Stelle Fragen, die den Schüler zum Nachdenken über seine eigenen Entscheidungen bringen („Welche dieser Strategien hat dir in der Vergangenheit am meisten geholfen?“).\n"
-        "Realistische Planung prüfen\n"
-        "Prüfe, ob Zeitaufwand und Strategien im Verhältnis zum Gesamtziel stehen.\n"
-        "Hebe Widersprüche oder Überlastung hervor („Du hast 3 Tage für Recherche eingeplant, aber noch 4 Wochen bis zur Abgabe – wäre eine Verteilung sinnvoll?“).\n"
-        "Verknüpfung mit der Vergangenheit\n"
-        "Falls es Tagebuch-Einträge gibt: beziehe dich aktiv auf sie („Beim letzten Mal hast du geschrieben, dass dich Ablenkungen gestört haben – wie berücksichtigst du das diesmal in deiner Planung?“).\n"
-        "Förderung von Reflexion und Anpassung\n"
-        "Fordere den Schüler am Ende des Feedbacks auf, seine Planung bei Bedarf selbstständig zu überarbeiten.\n"
-        "Erwartete Ausgabe\n"
-        "Formuliere dein Feedback als klar verständlichen Fließtext mit folgenden Komponenten:\n"
-        "Kurze positive Würdigung der aktuellen Planung.\n"
-        "Konkret-informative Rückmeldungen zu den Bereichen Ziele, Strategien, Ressourcen, Zeitplanung und Erfolgskriterien.\n"
-        "Reflektierende Fragen, die den Schüler zum Überarbeiten anregen.\n"
-        "Abschließende Bestärkung, dass der Schüler durch kleine Anpassungen noch besser sein Ziel erreichen kann."
-    )
+    retry_after = ratelimit.check_feedback(student)
+    if retry_after:
+        return None, None, _too_many_requests(retry_after)
 
-    messages = request.session.get("planning_ai_messages")
-    if not messages:
-        messages = [{"role": "user", "content": base_prompt}]
-    else:
-        followup = (
-            "Der Schüler hat nun einen zweiten Entwurf eingereicht "
-            f"{json.dumps(planning, ensure_ascii=False)} "
-            "gebe erneut Feedback nach den gleichen Richtlinien wie zuvor. Hebe dabei positive Veränderungen der Planung seit der letzten Version hervor."
-        )
-        messages.append({"role": "user", "content": followup})
+    messages = feedback.build_messages(
+        kind,
+        student,
+        payload.get(feedback.DRAFT_KEYS[kind], {}),
+        feedback.load_history(request.session, student, kind),
+    )
+    return student, messages, None
 
-    settings = AppSettings.load()
-    if not settings.openai_api_key:
-        return JsonResponse({"error": "Kein OpenAI API Key hinterlegt."}, status=400)
 
+def _sync_feedback(request, kind):
+    student, messages, error = _feedback_messages(request, kind)
+    if error:
+        return error
+    classroom = student.classroom
+    if not ratelimit.acquire_slot(classroom):
+        return _no_slot(student)
     try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={"Authorization": f"Bearer {settings.openai_api_key}"},
-            json={"model": settings.openai_model, "messages": messages},
-            timeout=30,
-        )
-        response.raise_for_status()
-        reply = response.json()["choices"][0]["message"]["content"]
-    except requests.RequestException:
-        return JsonResponse({"error": "Fehler bei der Verbindung zur OpenAI API."}, status=500)
+        reply = feedback.request_completion(messages)
+    except feedback.FeedbackError as exc:
+        return JsonResponse({"error": str(exc)}, status=exc.status)
+    finally:
+        ratelimit.release_slot(classroom)
 
     messages.append({"role": "assistant", "content": reply})
-    request.session["planning_ai_messages"] = messages
+    feedback.save_history(request.session, student, kind, messages)
     return JsonResponse({"feedback": reply})
 
 
+def _enqueue_feedback(request, kind):
+    student, messages, error = _feedback_messages(request, kind)
+    if error:
+        return error
+    # The job releases the slot once it is finished.
+    if not ratelimit.acquire_slot(student.classroom):
+        return _no_slot(student)
+    try:
+        job = feedback.enqueue_job(student, kind, messages)
+    except Exception:
+        ratelimit.release_slot(student.classroom)
+        raise
+    return JsonResponse(
+        {
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": reverse("feedback_job_status", args=[job.id]),
+        },
+        status=202,
+    )
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _store_feedback_history(request, student, kind, messages):
+    feedback.save_history(request.session, student, kind, messages)
+    # The session middleware has already saved the session by the time the
+    # streamed body finishes, so persist a new conversation id explicitly.
+    if request.session.modified:
+        request.session.save()
+
+
+async def _stream_feedback(request, kind):
+    """Stream the feedback reply as server-sent events.
+
+    Emits ``token`` events while the reply is generated, followed by a single
+    ``done`` event with the complete text, or an ``error`` event.
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    if not await sync_to_async(request.session.get)("student_id"):
+        return JsonResponse({"error": "Nicht angemeldet."}, status=403)
+    student, messages, error = await sync_to_async(_feedback_messages)(
+        request, kind
+    )
+    if error:
+        return error
+    classroom = await sync_to_async(lambda: student.classroom)()
+    if not await sync_to_async(ratelimit.acquire_slot)(classroom):
+        return await sync_to_async(_no_slot)(student)
+    settings = await sync_to_async(AppSettings.cached)()
+
+    async def events():
+        parts = []
+        try:
+            async for token in feedback.stream_completion(messages, settings):
+                parts.append(token)
+                yield _sse("token", {"content": token})
+        except feedback.FeedbackError as exc:
+            yield _sse("error", {"error": str(exc)})
+            return
+        finally:
+            await sync_to_async(ratelimit.release_slot)(classroom)
+        reply = "".join(parts)
+        messages.append({"role": "assistant", "content": reply})
+        await sync_to_async(_store_feedback_history)(
+            request, student, kind, messages
+        )
+        yield _sse("done", {"feedback": reply})
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@student_required
+@require_POST
+def planning_feedback(request):
+    return _sync_feedback(request, FeedbackJob.Kind.PLANNING)
+
+
+@student_required
+@require_POST
+def planning_feedback_job(request):
+    return _enqueue_feedback(request, FeedbackJob.Kind.PLANNING)
+
+
+async def planning_feedback_stream(request):
+    return await _stream_feedback(request, FeedbackJob.Kind.PLANNING)
+
+
 @student_required
 @require_POST
 def reset_planning_feedback(request):
-    request.session.pop("planning_ai_messages", None)
+    feedback.clear_history(request.session, FeedbackJob.Kind.PLANNING)
     return JsonResponse({"status": "ok"})
 
 
 @student_required
 @require_POST
 def reflection_feedback(request):
-    student = Student.objects.get(id=request.session["student_id"])
-    try:
-        payload = json.loads(request.body.decode("utf-8"))
-    except json.JSONDecodeError:
-        return JsonResponse({"error": "Invalid JSON"}, status=400)
-
-    reflection = payload.get("reflection", {})
-    entries = student.entries.order_by("session_date")
-    diary = {
-        "Gesamtziel": student.overall_goal,
-        "Fälligkeitsdatum des Gesamtziels": student.overall_goal_due_date.isoformat()
-        if student.overall_goal_due_date
-        else None,
-        "Einträge": [_entry_nested(e) for e in entries],
-    }
-
-    base_prompt = (
-        "Rolle des KI-Assistenten:\n"
-        "Du bist ein Lerncoach, der einen Schüler während einer mehrwöchigen Projektarbeit unterstützt. "
-        "Der Schüler führt ein selbstreguliertes Lerntagebuch, in dem er seine Lernprozesse dokumentiert. "
-        "Jetzt bewertet der Schüler seine Reflexion zur abgeschlossenen Arbeitsphase. "
-        "Deine Aufgabe ist es, konstruktives, wissenschaftlich fundiertes Feedback zu dieser Reflexion zu geben, "
-        "um den Schüler bei der Entwicklung seiner Selbstregulationsfähigkeiten zu unterstützen.\n"
-        "Eingabedaten:\n"
-        f"-> Das derzeitige SRL Tagebuch: {json.dumps(diary, ensure_ascii=False)}\n"
-        f"-> Die aktuelle Reflexion des Schülers {json.dumps(reflection, ensure_ascii=False)}\n"
-        "Aufgabe des KI-Assistenten\n"
-        "Analysiere alle vorliegenden Informationen:\n"
-        "Projektkontext (Gesamtziel + Frist)\n"
-        "Bisherige Tagebuch-Einträge und Planung (inkl. geplante Ziele, Strategien, Zeitmanagement)\n"
-        "Aktuelle Reflexion (Zielerreichung, Strategien, Lernen, Zeitmanagement, Motivation, Ausblick)\n"
-        "Beachte besonders: Widersprüche und Inkonsistenzen (z. B. „Zeitplan war realistisch“ vs. „große Abweichungen in der Umsetzung“).\n"
-        "Regeln für dein Feedback (wissenschaftlich gestützt)\n"
-        "Autonomie-Support (Selbstbestimmungstheorie)\n"
-        "Stelle offene, reflektierende Fragen, die den Schüler zum eigenen Nachdenken und Anpassen anregen.\n"
-        "Keine Anweisungen, sondern Impulse: „Wie erklärst du dir…?“, „Welche Alternativen siehst du…?“\n"
-        "Informativ, nicht wertend\n"
-        "Kein einfaches „gut/schlecht“.\n"
-        "Stattdessen sachliche Rückmeldungen mit konkreten Hinweisen: „Du hast deine Motivation als schwankend beschrieben – welche Strategien haben dir trotzdem geholfen, dranzubleiben?“\n"
-        "Ressourcen- und Stärkenorientierung\n"
-        "Anerkenne positive Entwicklungen („Du hast erkannt, dass dir Brainstorming geholfen hat – das zeigt, dass du deine Strategien gut reflektierst“).\n"
-        "Hebe Fortschritte hervor (z. B. verbesserte Planung im Vergleich zum Vorherigen).\n"
-        "Metakognition anregen\n"
-        "Stelle Fragen, die den Schüler dazu bringen, über eigene Denk- und Lernprozesse nachzudenken: „Was bedeutet es für dich, dass eine Strategie teilweise geholfen hat?“\n"
-        "Inkonsistenzen ansprechen\n"
-        "Identifiziere mögliche Widersprüche zwischen Planung, Umsetzung und Reflexion (z. B. „Du hast deine Planung als realistisch eingeschätzt, aber schreibst gleichzeitig, dass du stark vom Plan abgewichen bist – wie passt das für dich zusammen?“).\n"
-        "Stelle Nachfragen, ohne belehrend zu wirken.\n"
-        "Ausblick unterstützen\n"
-        "Hilf dem Schüler, aus seiner Reflexion konkrete nächste Schritte abzuleiten.\n"
-        "Stelle Fragen wie: „Welche deiner beschriebenen Strategien würdest du jetzt priorisieren?“ oder „Wie kannst du deine Motivation gezielt stärken?“\n"
-        "Erwartete Ausgabe\n"
-        "Formuliere dein Feedback als klar verständlichen Fließtext mit den folgenden Abschnitten:\n"
-        "Positives (Würdigung von Fortschritten und gelungenen Reflexionselementen)\n"
-        "Konkret-informative Hinweise (Ziele, Strategien, Zeitmanagement, Motivation, Konsistenz)\n"
-        "Reflektierende Fragen (die den Schüler zum Weiterdenken und Anpassen anregen)\n"
-        "Bestärkung (ermutigendes Fazit: kleine Anpassungen führen zu mehr Selbstregulation)"
-    )
+    return _sync_feedback(request, FeedbackJob.Kind.REFLECTION)
 
-    messages = request.session.get("reflection_ai_messages")
-    if not messages:
-        messages = [{"role": "user", "content": base_prompt}]
-    else:
-        followup = (
-            "Der Schüler hat nun einen zweiten Entwurf eingereicht "
-            f"{json.dumps(reflection, ensure_ascii=False)} "
-            "gebe erneut Feedback nach den gleichen Richtlinien wie zuvor. Hebe dabei positive Veränderungen der Reflexion seit der letzten Version hervor."
-        )
-        messages.append({"role": "user", "content": followup})
 
-    settings = AppSettings.load()
-    if not settings.openai_api_key:
-        return JsonResponse({"error": "Kein OpenAI API Key hinterlegt."}, status=400)
+@student_required
+@require_POST
+def reflection_feedback_job(request):
+    return _enqueue_feedback(request, FeedbackJob.Kind.REFLECTION)
 
-    try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={"Authorization": f"Bearer {settings.openai_api_key}"},
-            json={"model": settings.openai_model, "messages": messages},
-            timeout=30,
-        )
-        response.raise_for_status()
-        reply = response.json()["choices"][0]["message"]["content"]
-    except requests.RequestException:
-        return JsonResponse({"error": "Fehler bei der Verbindung zur OpenAI API."}, status=500)
 
-    messages.append({"role": "assistant", "content": reply})
-    request.session["reflection_ai_messages"] = messages
-    return JsonResponse({"feedback": reply})
+async def reflection_feedback_stream(request):
+    return await _stream_feedback(request, FeedbackJob.Kind.REFLECTION)
 
 
 @student_required
 @require_POST
 def reset_reflection_feedback(request):
-    request.session.pop("reflection_ai_messages", None)
+    feedback.clear_history(request.session, FeedbackJob.Kind.REFLECTION)
     return JsonResponse({"status": "ok"})
+
+
+# Suggested delay between two status requests of a pending feedback job.
+FEEDBACK_JOB_POLL_INTERVAL = 1
+
+
+@student_required
+@require_GET
+def feedback_job_status(request, job_id):
+    """Report the state of a feedback job.
+
+    The view answers at once, so no worker is held while the job runs; the
+    client polls again after ``Retry-After`` seconds while the job is pending.
+    Once the job is done, its conversation is stored so follow-up rounds
+    continue it.
+    """
+    job = get_object_or_404(
+        FeedbackJob, id=job_id, student_id=request.session["student_id"]
+    )
+    data = {"job_id": job.id, "status": job.status}
+    if job.status == FeedbackJob.Status.DONE:
+        unsaved = FeedbackJob.objects.filter(id=job.id, history_saved=False)
+        if unsaved.update(history_saved=True):
+            feedback.save_history(
+                request.session,
+                job.student,
+                job.kind,
+                job.messages + [{"role": "assistant", "content": job.reply}],
+            )
+        data["feedback"] = job.reply
+    elif job.status == FeedbackJob.Status.FAILED:
+        data["error"] = job.error
+    response = JsonResponse(data)
+    if job.status in (FeedbackJob.Status.PENDING, FeedbackJob.Status.RUNNING):
+        response["Retry-After"] = str(FEEDBACK_JOB_POLL_INTERVAL)
+    return response
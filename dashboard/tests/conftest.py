@@ -0,0 +1,131 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+
+from dashboard import openai_client
+from dashboard.models import AppSettings
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """Minimal stand-in for the OpenAI HTTP API.
+
+    Every request is recorded in ``requests``. Chat completions are answered
+    with ``reply`` unless a ``(status, headers)`` tuple has been queued in
+    ``errors``, which are returned first.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.requests = []
+        self.clients = set()
+        self.errors = []
+        self.reply = "Stub-Feedback"
+        self.valid_key = "sk-test"
+
+    @property
+    def base_url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}/v1"
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, reply):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for word in reply.split(" "):
+            chunk = {"choices": [{"delta": {"content": word + " "}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def do_GET(self):
+        self.server.clients.add(self.client_address)
+        if self.path != "/v1/models":
+            self._send_json(404, {})
+            return
+        valid = self.headers.get("Authorization") == f"Bearer {self.server.valid_key}"
+        self._send_json(200 if valid else 401, {"data": []})
+
+    def do_POST(self):
+        self.server.clients.add(self.client_address)
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        self.server.requests.append(payload)
+        if self.path != "/v1/chat/completions":
+            self._send_json(404, {})
+            return
+        if self.server.errors:
+            status, headers = self.server.errors.pop(0)
+            self._send_json(status, {"error": {"message": "stub"}}, headers)
+            return
+        if payload.get("stream"):
+            self._send_stream(self.server.reply)
+            return
+        self._send_json(
+            200,
+            {
+                "choices": [
+                    {"message": {"role": "assistant", "content": self.server.reply}}
+                ]
+            },
+        )
+
+
+def _clear_caches():
+    for cache in caches.all():
+        # Database caches are rolled back with the test's transaction.
+        if not isinstance(cache, DatabaseCache):
+            cache.clear()
+    AppSettings.clear_cache()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    _clear_caches()
+    yield
+    _clear_caches()
+
+
+@pytest.fixture
+def llm_server(settings):
+    server = StubLLMServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    settings.OPENAI_API_BASE = server.base_url
+    settings.OPENAI_BACKOFF_BASE = 0
+    openai_client.metrics.reset()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def openai_key(db):
+    app_settings = AppSettings.load()
+    app_settings.openai_api_key = "sk-test"
+    app_settings.save()
+    return app_settings
@@ -0,0 +1,99 @@
+import pytest
+from django.contrib.auth.models import User
+from django.forms.models import model_to_dict
+from django.urls import reverse
+
+from dashboard.class_stats import STAT_FIELDS, rebuild
+from dashboard.models import Classroom, ClassroomDayStats, SRLEntry, Student
+
+
+@pytest.fixture
+def classroom(db):
+    user = User.objects.create_user(username="t1", password="pass")
+    return Classroom.objects.create(
+        teacher=user, name="Klasse A", group_type="EXPERIMENTAL"
+    )
+
+
+def _entry(student, day, **kwargs):
+    defaults = {
+        "time_planning": [{"goal": "Z", "time": "01:00"}],
+        "time_usage": [{"goal": "Z", "time": "00:45"}],
+        "strategy_check": [
+            {"strategy": "A", "used": True, "useful": True},
+            {"strategy": "B", "used": True, "useful": False},
+        ],
+        "goal_achievement": [{"goal": "Z", "achievement": "teilweise"}],
+    }
+    defaults.update(kwargs)
+    return SRLEntry.objects.create(student=student, session_date=day, **defaults)
+
+
+def _stats():
+    return {
+        (row.classroom_id, row.date.isoformat()): {
+            f: v for f, v in model_to_dict(row).items() if f in STAT_FIELDS
+        }
+        for row in ClassroomDayStats.objects.all()
+        if row.entries
+    }
+
+
+def test_stats_follow_entry_changes(classroom):
+    s1 = Student.objects.create(classroom=classroom, pseudonym="S1")
+    s2 = Student.objects.create(classroom=classroom, pseudonym="S2")
+    first = _entry(s1, "2024-01-01")
+    _entry(s2, "2024-01-01", goal_achievement=[{"goal": "Z", "achievement": "nicht"}])
+
+    day = ClassroomDayStats.objects.get(classroom=classroom, date="2024-01-01")
+    assert (day.entries, day.planned_minutes, day.used_minutes) == (2, 120, 90)
+    assert (day.strategies_checked, day.strategies_used, day.strategies_useful) == (
+        4,
+        4,
+        2,
+    )
+    assert (day.goals_full, day.goals_partial, day.goals_missed) == (0, 1, 1)
+
+    first.session_date = "2024-01-08"
+    first.goal_achievement = [{"goal": "Z", "achievement": "vollständig"}]
+    first.save()
+    first.delete()
+    _entry(s1, "2024-01-09", time_usage=[])
+    s2.delete()
+
+    incremental = _stats()
+    rebuild()
+    assert incremental == _stats()
+    assert list(incremental) == [(classroom.id, "2024-01-09")]
+
+
+def test_visualization_renders_from_aggregates(
+    client, classroom, django_assert_max_num_queries
+):
+    student = Student.objects.create(classroom=classroom, pseudonym="S1")
+    _entry(student, "2024-01-01")
+    _entry(student, "2024-01-03")
+    _entry(student, "2024-01-08")
+    client.login(username="t1", password="pass")
+    url = reverse("classroom_visualization", args=[classroom.id])
+    # session, user, classroom and the day rows; no entries are read
+    with django_assert_max_num_queries(4):
+        response = client.get(url)
+    assert response.status_code == 200
+    weeks = response.context["weeks"]
+    assert [(w["start"].isoformat(), w["entries"]) for w in weeks] == [
+        ("2024-01-01", 2),
+        ("2024-01-08", 1),
+    ]
+    totals = response.context["totals"]
+    assert totals["used_rate"] == 75
+    assert totals["strategies_useful_rate"] == 50
+    assert ("teilweise", 3, 100) in totals["goals_distribution"]
+    assert "Auswertung: Klasse A" in response.content.decode()
+
+
+def test_visualization_is_scoped_to_teacher(client, classroom):
+    User.objects.create_user(username="t2", password="pass")
+    client.login(username="t2", password="pass")
+    response = client.get(reverse("classroom_visualization", args=[classroom.id]))
+    assert response.status_code == 404
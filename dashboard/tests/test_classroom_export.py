@@ -0,0 +1,448 @@
+import csv
+import io
+import json
+import zipfile
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from dashboard import bulk_export
+from dashboard.export_views import format_watermark, parse_watermark
+from dashboard.exporters import FIELDNAMES
+from dashboard.models import Classroom, ExportJob, SRLEntry, Student
+from dashboard.pseudonymize import research_id
+
+
+@pytest.fixture
+def classroom(db):
+    user = User.objects.create_user(username="t1", password="pass")
+    classroom = Classroom.objects.create(
+        teacher=user, name="Klasse A", group_type="EXPERIMENTAL"
+    )
+    for pseudonym in ("S2", "S1", "S3"):
+        student = Student.objects.create(classroom=classroom, pseudonym=pseudonym)
+        if pseudonym == "S3":
+            continue
+        for day in (2, 1):
+            SRLEntry.objects.create(
+                student=student,
+                session_date=f"2024-01-0{day}",
+                goals=[f"{pseudonym}-Z{day}"],
+                time_planning=[{"goal": "Z", "time": "00:30"}],
+            )
+    return classroom
+
+
+def _get(client, classroom, fmt):
+    client.login(username="t1", password="pass")
+    url = reverse("classroom_export", args=[classroom.id])
+    return client.get(url, {"format": fmt})
+
+
+def test_classroom_export_csv_streams_all_entries(client, classroom):
+    response = _get(client, classroom, "csv")
+    assert response.status_code == 200
+    assert response.streaming
+    content = b"".join(response.streaming_content).decode("utf-8")
+    rows = list(csv.reader(io.StringIO(content)))
+    assert rows[0] == FIELDNAMES
+    assert [(r[0], r[5]) for r in rows[1:]] == [
+        ("S1", "S1-Z1"),
+        ("S1", "S1-Z2"),
+        ("S2", "S2-Z1"),
+        ("S2", "S2-Z2"),
+    ]
+    assert "klasse-a.csv" in response["Content-Disposition"]
+
+
+def test_classroom_export_json_and_ndjson(client, classroom):
+    response = _get(client, classroom, "json")
+    data = json.loads(b"".join(response.streaming_content))
+    assert [d["Pseudonym"] for d in data] == ["S1", "S2", "S3"]
+    assert data[0]["Gruppenzugehörigkeit"] == "Experimentalgruppe"
+    assert data[0]["Einträge"][1]["Planung"]["Ziele"] == ["S1-Z2"]
+    assert data[2]["Einträge"] == []
+
+    response = _get(client, classroom, "ndjson")
+    lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == data
+
+
+def test_classroom_export_xlsx(client, classroom):
+    response = _get(client, classroom, "xlsx")
+    assert response.status_code == 200
+    workbook = load_workbook(io.BytesIO(b"".join(response.streaming_content)))
+    rows = list(workbook.active.values)
+    assert list(rows[0]) == FIELDNAMES
+    assert len(rows) == 5
+
+
+def test_classroom_export_query_count(client, classroom, django_assert_num_queries):
+    client.login(username="t1", password="pass")
+    url = reverse("classroom_export", args=[classroom.id])
+    response = client.get(url, {"format": "csv"})
+    # students and their prefetched entries
+    with django_assert_num_queries(2):
+        b"".join(response.streaming_content)
+
+
+def test_classroom_export_is_scoped_to_teacher(client, classroom):
+    User.objects.create_user(username="t2", password="pass")
+    client.login(username="t2", password="pass")
+    response = client.get(reverse("classroom_export", args=[classroom.id]))
+    assert response.status_code == 404
+
+
+def test_study_export_job_writes_archive(client, classroom, settings, tmp_path):
+    settings.EXPORT_ROOT = tmp_path
+    settings.EXPORT_JOB_BACKEND = "eager"
+    Classroom.objects.create(
+        teacher=classroom.teacher, name="Kontrolle", group_type="CONTROL"
+    )
+    client.login(username="t1", password="pass")
+    response = client.post(reverse("study_export_start"), HTTP_HX_REQUEST="true")
+    assert b"Herunterladen" in response.content
+
+    job = ExportJob.objects.get()
+    assert job.status == ExportJob.Status.DONE
+    assert (job.classrooms_total, job.classrooms_done, job.entries_done) == (2, 2, 4)
+
+    response = client.get(reverse("study_export_download", args=[job.id]))
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+    name = f"klasse-a-{classroom.id}"
+    assert f"{name}.csv" in archive.namelist()
+    assert f"{name}.xlsx" in archive.namelist()
+    combined = archive.read("alle-klassen.csv").decode("utf-8").splitlines()
+    assert combined[0].startswith("Klasse,Pseudonym")
+    assert len(combined) == 5
+    assert "alle-klassen.xlsx" in archive.namelist()
+    assert list(tmp_path.iterdir()) == [tmp_path / job.file]
+
+
+def test_study_export_is_scoped_to_teacher(client, classroom, settings, tmp_path):
+    settings.EXPORT_ROOT = tmp_path
+    settings.EXPORT_JOB_BACKEND = "eager"
+    client.login(username="t1", password="pass")
+    client.post(reverse("study_export_start"))
+    job = ExportJob.objects.get()
+    User.objects.create_user(username="t2", password="pass")
+    client.login(username="t2", password="pass")
+    assert client.get(reverse("study_export_status", args=[job.id])).status_code == 404
+    response = client.get(reverse("study_export_download", args=[job.id]))
+    assert response.status_code == 404
+
+
+def test_study_export_runs_after_commit(
+    client, classroom, django_capture_on_commit_callbacks
+):
+    client.login(username="t1", password="pass")
+    with django_capture_on_commit_callbacks() as callbacks:
+        response = client.post(reverse("study_export_start"), HTTP_HX_REQUEST="true")
+    assert len(callbacks) == 1
+    assert b'hx-trigger="every 2s"' in response.content
+    assert ExportJob.objects.get().status == ExportJob.Status.PENDING
+
+
+def test_study_export_worker_and_stale_jobs(client, classroom, settings, tmp_path):
+    settings.EXPORT_ROOT = tmp_path
+    settings.EXPORT_JOB_BACKEND = "worker"
+    client.login(username="t1", password="pass")
+    client.post(reverse("study_export_start"))
+    lost = ExportJob.objects.create(teacher=classroom.teacher)
+    ExportJob.objects.filter(id=lost.id).update(
+        created_at=timezone.now() - timedelta(hours=2)
+    )
+
+    out = io.StringIO()
+    call_command("run_export_worker", "--once", stdout=out)
+    assert "Failed 1 stale export(s)." in out.getvalue()
+    assert "Processed 1 export(s)." in out.getvalue()
+    lost.refresh_from_db()
+    assert lost.status == ExportJob.Status.FAILED
+    assert ExportJob.objects.exclude(id=lost.id).get().status == ExportJob.Status.DONE
+
+    # A job lost while running stops the status polling once it is stale.
+    running = ExportJob.objects.create(
+        teacher=classroom.teacher,
+        status=ExportJob.Status.RUNNING,
+        started_at=timezone.now() - timedelta(hours=2),
+    )
+    ExportJob.objects.filter(id=running.id).update(
+        created_at=timezone.now() - timedelta(hours=2)
+    )
+    response = client.get(reverse("study_export_status", args=[running.id]))
+    assert b"hx-trigger" not in response.content
+    assert "Der Export wurde abgebrochen" in response.content.decode()
+
+
+def test_purge_exports_deletes_old_jobs_and_archives(classroom, settings, tmp_path):
+    settings.EXPORT_ROOT = tmp_path
+    settings.EXPORT_JOB_BACKEND = "eager"
+    old = bulk_export.enqueue_export(classroom.teacher)
+    new = bulk_export.enqueue_export(classroom.teacher)
+    ExportJob.objects.filter(id=old.id).update(
+        created_at=timezone.now() - timedelta(days=8)
+    )
+    assert bulk_export.export_path(old).exists()
+
+    call_command("purge_exports", "--days=7", stdout=io.StringIO())
+    assert list(ExportJob.objects.values_list("id", flat=True)) == [new.id]
+    assert not bulk_export.export_path(old).exists()
+    assert bulk_export.export_path(new).exists()
+
+
+def test_classroom_export_parquet_keeps_structure(client, classroom):
+    pq = pytest.importorskip("pyarrow.parquet")
+    response = _get(client, classroom, "parquet")
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(b"".join(response.streaming_content)))
+    assert table.num_rows == 4
+    row = table.to_pylist()[0]
+    assert row["pseudonym"] == "S1"
+    assert row["group_type"] == "EXPERIMENTAL"
+    assert row["goals"] == ["S1-Z1"]
+    assert row["time_planning"] == [{"goal": "Z", "time": "00:30", "minutes": 30}]
+    assert row["planned_minutes"] == 30
+    assert str(row["session_date"]) == "2024-01-01"
+
+
+def test_parquet_is_written_in_row_groups(classroom):
+    pq = pytest.importorskip("pyarrow.parquet")
+    from dashboard.export_views import classroom_students
+    from dashboard.parquet_export import write_parquet
+
+    buffer = io.BytesIO()
+    write_parquet(
+        ((s, s.entries.all()) for s in classroom_students(classroom)),
+        buffer,
+        row_group_size=3,
+    )
+    buffer.seek(0)
+    metadata = pq.ParquetFile(buffer).metadata
+    assert (metadata.num_rows, metadata.num_row_groups) == (4, 2)
+
+
+def test_classroom_delta_export(client, classroom):
+    response = _get(client, classroom, "ndjson")
+    b"".join(response.streaming_content)
+    watermark = response["X-Next-Watermark"]
+
+    entry = SRLEntry.objects.get(goals=["S2-Z1"])
+    entry.goals = ["S2-neu"]
+    entry.save()
+    client.login(username="t1", password="pass")
+    url = reverse("classroom_export", args=[classroom.id])
+    response = client.get(url, {"format": "ndjson", "since": watermark})
+    lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+    documents = [json.loads(line) for line in lines]
+    assert [d["Pseudonym"] for d in documents] == ["S2"]
+    assert [e["Planung"]["Ziele"] for e in documents[0]["Einträge"]] == [["S2-neu"]]
+    assert response["X-Next-Watermark"] == format_watermark(entry.updated_at)
+
+    response = client.get(url, {"format": "csv", "since": response["X-Next-Watermark"]})
+    assert len(b"".join(response.streaming_content).splitlines()) == 1
+
+
+def test_watermark_survives_an_unescaped_query_string(client, classroom):
+    response = _get(client, classroom, "csv")
+    b"".join(response.streaming_content)
+    watermark = response["X-Next-Watermark"]
+    assert watermark.endswith("Z")
+    url = reverse("classroom_export", args=[classroom.id])
+    response = client.get(f"{url}?format=csv&since={watermark}")
+    assert len(b"".join(response.streaming_content).splitlines()) == 1
+
+    moment = parse_watermark(watermark)
+    # "+00:00" arrives as " 00:00" when the client does not escape the "+".
+    assert parse_watermark(moment.isoformat().replace("+", " ")) == moment
+    assert parse_watermark("2024-01-01 10:00") == parse_watermark("2024-01-01T10:00")
+
+
+def test_classroom_delta_export_rejects_invalid_since(client, classroom):
+    client.login(username="t1", password="pass")
+    url = reverse("classroom_export", args=[classroom.id])
+    assert client.get(url, {"since": "gestern"}).status_code == 400
+
+
+def test_classroom_export_etag(client, classroom):
+    response = _get(client, classroom, "csv")
+    etag = response["ETag"]
+    url = reverse("classroom_export", args=[classroom.id])
+    response = client.get(url, {"format": "csv"}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    classroom.students.update(overall_goal="Neu")
+    response = client.get(url, {"format": "csv"}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+
+
+def test_exporter_registry():
+    from dashboard.exporters import EXPORTERS, get_exporter
+
+    assert {"csv", "tsv", "json", "ndjson", "xlsx", "parquet"} <= set(EXPORTERS)
+    assert get_exporter("csv").streams
+    assert not get_exporter("xlsx").streams
+    assert get_exporter("pdf") is None
+
+
+def test_classroom_export_tsv(client, classroom):
+    response = _get(client, classroom, "tsv")
+    assert response.streaming
+    assert response["Content-Type"] == "text/tab-separated-values"
+    lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+    assert lines[0].split("\t") == FIELDNAMES
+    assert len(lines) == 5
+    assert _get(client, classroom, "pdf").status_code == 400
+
+
+def test_export_srl_command_writes_file_per_classroom(classroom, tmp_path):
+    other = Classroom.objects.create(
+        teacher=classroom.teacher, name="Kontrolle", group_type="CONTROL"
+    )
+    out = io.StringIO()
+    call_command(
+        "export_srl",
+        "--teacher=t1",
+        "--workers=1",
+        f"--output={tmp_path}",
+        stdout=out,
+    )
+    path = tmp_path / f"klasse-a-{classroom.id}.csv"
+    rows = list(csv.reader(io.StringIO(path.read_text(encoding="utf-8"))))
+    assert rows[0] == FIELDNAMES
+    assert len(rows) == 5
+    assert (tmp_path / f"kontrolle-{other.id}.csv").exists()
+    assert "Exported 4 entries from 2 classroom(s)." in out.getvalue()
+    latest = SRLEntry.objects.latest("updated_at").updated_at
+    assert f"Next watermark: {format_watermark(latest)}" in out.getvalue()
+
+
+def test_export_srl_command_filters(classroom, tmp_path):
+    student = classroom.students.get(pseudonym="S1")
+    call_command(
+        "export_srl",
+        f"--classroom={classroom.id}",
+        f"--student={student.id}",
+        "--date-from=2024-01-02",
+        "--format=ndjson",
+        "--workers=1",
+        f"--output={tmp_path}",
+        stdout=io.StringIO(),
+    )
+    path = tmp_path / f"klasse-a-{classroom.id}.ndjson"
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [d["Pseudonym"] for d in lines] == ["S1"]
+    assert len(lines[0]["Einträge"]) == 1
+
+
+@pytest.mark.parametrize("value", ["2024-13-01", "gestern"])
+def test_export_srl_command_rejects_invalid_dates(classroom, tmp_path, value):
+    with pytest.raises(CommandError, match="Invalid date"):
+        call_command("export_srl", f"--date-from={value}", f"--output={tmp_path}")
+
+
+def test_classroom_research_export_hashes_ids(client, classroom):
+    student = classroom.students.get(pseudonym="S1")
+    SRLEntry.objects.filter(student=student).update(problems="Streit mit Max")
+    client.login(username="t1", password="pass")
+    url = reverse("classroom_export", args=[classroom.id])
+
+    response = client.get(url, {"format": "csv", "pseudonymize": "1"})
+    content = b"".join(response.streaming_content).decode("utf-8")
+    rows = list(csv.reader(io.StringIO(content)))[1:]
+    hashed = research_id("student", student.id)
+    assert hashed.startswith("S-")
+    assert hashed in {r[0] for r in rows}
+    assert not {"S1", "S2"} & {r[0] for r in rows}
+    assert "Streit mit Max" in content
+    assert research_id("classroom", classroom.id) in response["Content-Disposition"]
+    # Stable across exports; the streamed instances are not modified.
+    assert student.pseudonym == "S1"
+    again = client.get(url, {"format": "csv", "pseudonymize": "1"})
+    assert b"".join(again.streaming_content).decode("utf-8") == content
+    assert again["ETag"] != _get(client, classroom, "csv")["ETag"]
+
+    pq = pytest.importorskip("pyarrow.parquet")
+    response = client.get(url, {"format": "parquet", "mask": "1"})
+    table = pq.read_table(io.BytesIO(b"".join(response.streaming_content)))
+    assert set(table.column("pseudonym").to_pylist()) == {
+        hashed,
+        research_id("student", classroom.students.get(pseudonym="S2").id),
+    }
+    assert set(table.column("classroom").to_pylist()) == {
+        research_id("classroom", classroom.id)
+    }
+    assert "[entfernt]" in table.column("problems").to_pylist()
+
+
+def test_student_research_export_masks_free_text(client, classroom):
+    student = classroom.students.get(pseudonym="S1")
+    student.overall_goal = "Abitur mit Anna"
+    student.save()
+    SRLEntry.objects.filter(student=student).update(emotions="wütend auf Max")
+    client.login(username="t1", password="pass")
+    url = reverse("student_export", args=[classroom.id, student.id])
+
+    data = client.get(url, {"format": "json", "mask": "1"}).json()
+    assert data["Pseudonym"] == research_id("student", student.id)
+    assert data["Gesamtziel"] == "[entfernt]"
+    assert data["Einträge"][0]["Durchführung"]["Emotionen"] == "[entfernt]"
+    assert data["Einträge"][0]["Planung"]["Ziele"] == ["S1-Z1"]
+
+    data = client.get(url, {"format": "json"}).json()
+    assert data["Pseudonym"] == "S1"
+    assert data["Einträge"][0]["Durchführung"]["Emotionen"] == "wütend auf Max"
+
+
+def test_masked_exports_contain_no_free_text(client, classroom):
+    from dashboard.pseudonymize import FREE_TEXT_FIELDS
+
+    student = classroom.students.get(pseudonym="S1")
+    secrets = {field: f"Geheim {field} Max" for field in FREE_TEXT_FIELDS}
+    SRLEntry.objects.filter(student=student).update(
+        **secrets,
+        strategy_check=[
+            {"strategy": "Karteikarten", "used": True, "adaptation": "Lehrer Müller half"}
+        ],
+        goal_achievement=[
+            {"goal": "Z", "achievement": "teilweise", "comment": "Mein Name ist Max"}
+        ],
+        strategy_evaluation=[
+            {"strategy": "Karteikarten", "helpful": "ja", "reason": "Mit Anna geübt", "reuse": "ja"},
+            {"strategy": "Mindmap", "helpful": "nein", "comment": "Anna aus 7b", "reuse": "nein"},
+            "Oma hat geholfen",
+        ],
+    )
+    texts = [
+        *secrets.values(),
+        "Lehrer Müller half",
+        "Mein Name ist Max",
+        "Mit Anna geübt",
+        "Anna aus 7b",
+        "Oma hat geholfen",
+    ]
+    assert set(FREE_TEXT_FIELDS) >= {"planning_realistic", "motivation_rating"}
+    client.login(username="t1", password="pass")
+
+    unmasked = client.get(
+        reverse("student_export", args=[classroom.id, student.id]), {"format": "json"}
+    ).content.decode("utf-8")
+    assert all(json.dumps(text, ensure_ascii=False) in unmasked for text in texts)
+
+    url = reverse("classroom_export", args=[classroom.id])
+    for fmt in ("csv", "json"):
+        response = client.get(url, {"format": fmt, "mask": "1"})
+        content = b"".join(response.streaming_content).decode("utf-8")
+        assert "[entfernt]" in content
+        assert not [text for text in texts if text in content], fmt
+    response = client.get(
+        reverse("student_export", args=[classroom.id, student.id]),
+        {"format": "json", "mask": "1"},
+    )
+    content = response.content.decode("utf-8")
+    assert not [text for text in texts if text in content]
+    assert "Karteikarten" in content
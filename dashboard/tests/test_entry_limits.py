@@ -5,7 +5,9 @@ import pytest
 from django.utils import timezone
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
 from dashboard.models import Classroom, Student, SRLEntry
+from dashboard.student_views import ENTRY_LIMIT_MESSAGE
 
 
 @pytest.mark.django_db
@@ -67,3 +69,85 @@ def test_create_entry_respects_limits(client):
     assert SRLEntry.objects.filter(student=student).count() == 1
     client.post(reverse("student_entry_create"), data)
     assert SRLEntry.objects.filter(student=student).count() == 1
+
+
+@pytest.mark.django_db
+def test_can_create_entry_uses_one_query(django_assert_num_queries):
+    teacher = User.objects.create(username="t1")
+    classroom = Classroom.objects.create(
+        teacher=teacher,
+        name="Klasse A",
+        group_type="CONTROL",
+        max_entries_per_day=2,
+        max_entries_per_week=3,
+    )
+    student = Student.objects.create(classroom=classroom, pseudonym="S1")
+    today = timezone.now().date()
+    SRLEntry.objects.create(student=student, session_date=today)
+    SRLEntry.objects.create(student=student, session_date=today - timedelta(days=7))
+    student = Student.objects.select_related("classroom").get(id=student.id)
+    with django_assert_num_queries(1):
+        assert student.entry_counts() == (1, 1)
+    with django_assert_num_queries(1):
+        assert student.can_create_entry() is True
+
+
+@pytest.mark.django_db
+def test_add_entry_rechecks_limits(client):
+    teacher = User.objects.create(username="t1")
+    classroom = Classroom.objects.create(
+        teacher=teacher,
+        name="Klasse A",
+        group_type="CONTROL",
+        max_entries_per_day=1,
+        max_entries_per_week=1,
+    )
+    student = Student.objects.create(classroom=classroom, pseudonym="S1")
+    today = timezone.now().date()
+    assert student.add_entry(SRLEntry(session_date=today)) is True
+    assert student.add_entry(SRLEntry(session_date=today)) is False
+    assert student.entries.count() == 1
+
+    session = client.session
+    session["student_id"] = student.id
+    session.save()
+    response = client.post(
+        reverse("student_entry_create_json"),
+        json.dumps({"goals": ["a"], "time_planning": []}),
+        content_type="application/json",
+    )
+    assert response.status_code == 403
+    assert student.entries.count() == 1
+
+
+@pytest.mark.django_db
+def test_create_entry_reports_limit(client, monkeypatch):
+    teacher = User.objects.create(username="t1")
+    classroom = Classroom.objects.create(
+        teacher=teacher,
+        name="Klasse A",
+        group_type="CONTROL",
+        max_entries_per_day=1,
+        max_entries_per_week=1,
+    )
+    student = Student.objects.create(classroom=classroom, pseudonym="S1")
+    SRLEntry.objects.create(student=student, session_date=timezone.now().date())
+    session = client.session
+    session["student_id"] = student.id
+    session.save()
+    data = {
+        "goals": json.dumps(["a"]),
+        "time_planning": json.dumps([{"goal": "a", "time": "00:30"}]),
+    }
+    response = client.post(reverse("student_entry_create"), data)
+    assert [str(m) for m in get_messages(response.wsgi_request)] == [
+        ENTRY_LIMIT_MESSAGE
+    ]
+
+    # Another request created the entry between the check and the save.
+    monkeypatch.setattr(Student, "can_create_entry", lambda self: True)
+    response = client.post(reverse("student_entry_create"), data)
+    assert [str(m) for m in get_messages(response.wsgi_request)] == [
+        ENTRY_LIMIT_MESSAGE
+    ]
+    assert student.entries.count() == 1
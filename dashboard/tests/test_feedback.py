@@ -0,0 +1,440 @@
+import io
+import json
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.cache.backends.db import DatabaseCache
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+
+from dashboard import feedback, ratelimit
+from dashboard.models import (
+    Classroom,
+    FeedbackConversation,
+    FeedbackJob,
+    SRLEntry,
+    Student,
+)
+
+
+@pytest.fixture
+def student_client(client, db):
+    teacher = User.objects.create(username="t1")
+    classroom = Classroom.objects.create(
+        teacher=teacher, name="Klasse A", group_type="EXPERIMENTAL"
+    )
+    student = Student.objects.create(classroom=classroom, pseudonym="S1")
+    session = client.session
+    session["student_id"] = student.id
+    session.save()
+    client.student = student
+    return client
+
+
+def _history(client, kind):
+    return feedback.load_history(client.session, client.student, kind)
+
+
+def _post(client, name, data):
+    return client.post(
+        reverse(name), data=json.dumps(data), content_type="application/json"
+    )
+
+
+@pytest.mark.django_db
+def test_planning_feedback_sync(student_client, llm_server, openai_key):
+    response = _post(
+        student_client, "planning_feedback", {"planning": {"goals": ["Z1"]}}
+    )
+    assert response.status_code == 200
+    assert response.json()["feedback"] == "Stub-Feedback"
+    assert "Z1" in llm_server.requests[0]["messages"][0]["content"]
+    assert len(_history(student_client, FeedbackJob.Kind.PLANNING)) == 2
+
+
+@pytest.mark.django_db
+def test_feedback_requires_api_key(student_client, llm_server):
+    response = _post(student_client, "planning_feedback_job", {"planning": {}})
+    assert response.status_code == 400
+    assert not FeedbackJob.objects.exists()
+
+
+@pytest.mark.django_db
+def test_feedback_job_eager(student_client, llm_server, openai_key, settings):
+    settings.FEEDBACK_JOB_BACKEND = "eager"
+    response = _post(
+        student_client, "reflection_feedback_job", {"reflection": {"learned": "x"}}
+    )
+    assert response.status_code == 202
+    status_url = response.json()["status_url"]
+
+    data = student_client.get(status_url).json()
+    assert data["status"] == FeedbackJob.Status.DONE
+    assert data["feedback"] == "Stub-Feedback"
+    messages = _history(student_client, FeedbackJob.Kind.REFLECTION)
+    assert messages[-1] == {"role": "assistant", "content": "Stub-Feedback"}
+
+    _post(student_client, "reflection_feedback_job", {"reflection": {"learned": "y"}})
+    assert len(llm_server.requests[-1]["messages"]) == 3
+
+
+@pytest.mark.django_db
+def test_feedback_job_worker_backend(student_client, llm_server, openai_key, settings):
+    settings.FEEDBACK_JOB_BACKEND = "worker"
+    response = _post(student_client, "planning_feedback_job", {"planning": {}})
+    job = FeedbackJob.objects.get(id=response.json()["job_id"])
+    assert job.status == FeedbackJob.Status.PENDING
+    status = student_client.get(response.json()["status_url"])
+    assert status.json()["status"] == "PENDING"
+    assert status["Retry-After"] == "1"
+    assert llm_server.requests == []
+
+    feedback.run_job(job.id)
+    job.refresh_from_db()
+    assert job.status == FeedbackJob.Status.DONE
+    assert job.reply == "Stub-Feedback"
+    assert feedback.claim_job(job.id) is False
+
+
+@pytest.mark.django_db
+def test_feedback_job_failure(student_client, openai_key, settings):
+    settings.FEEDBACK_JOB_BACKEND = "eager"
+    settings.OPENAI_API_BASE = "http://127.0.0.1:9/v1"
+    settings.OPENAI_MAX_RETRIES = 0
+    response = _post(student_client, "planning_feedback_job", {"planning": {}})
+    data = student_client.get(response.json()["status_url"]).json()
+    assert data["status"] == FeedbackJob.Status.FAILED
+    assert data["error"] == feedback.CONNECTION_ERROR
+
+
+@pytest.mark.django_db
+def test_feedback_job_unexpected_error(student_client, openai_key, settings, monkeypatch):
+    settings.FEEDBACK_JOB_BACKEND = "worker"
+    classroom = student_client.student.classroom
+    classroom.max_concurrent_feedback = 1
+    classroom.save()
+    response = _post(student_client, "planning_feedback_job", {"planning": {}})
+
+    def broken(messages):
+        raise KeyError("content")
+
+    monkeypatch.setattr(feedback, "request_completion", broken)
+    feedback.run_job(response.json()["job_id"])
+    data = student_client.get(response.json()["status_url"]).json()
+    assert data["status"] == FeedbackJob.Status.FAILED
+    assert data["error"] == feedback.JOB_ERROR
+    assert ratelimit.acquire_slot(classroom)
+
+
+@pytest.mark.django_db
+def test_worker_fails_stale_running_jobs(student_client, openai_key, settings):
+    settings.FEEDBACK_JOB_BACKEND = "worker"
+    classroom = student_client.student.classroom
+    classroom.max_concurrent_feedback = 1
+    classroom.save()
+    response = _post(student_client, "planning_feedback_job", {"planning": {}})
+    job = FeedbackJob.objects.get(id=response.json()["job_id"])
+    assert feedback.claim_job(job.id)
+    FeedbackJob.objects.filter(id=job.id).update(
+        started_at=timezone.now() - timedelta(minutes=10)
+    )
+
+    out = io.StringIO()
+    call_command("run_feedback_worker", "--once", "--stale-after=300", stdout=out)
+    assert "Failed 1 stale feedback job(s)." in out.getvalue()
+    job.refresh_from_db()
+    assert job.status == FeedbackJob.Status.FAILED
+    assert job.error == feedback.JOB_ERROR
+    assert ratelimit.acquire_slot(classroom)
+
+
+@pytest.mark.django_db
+def test_feedback_job_status_is_scoped_to_student(student_client, openai_key):
+    other = Student.objects.create(
+        classroom=student_client.student.classroom, pseudonym="S2"
+    )
+    job = FeedbackJob.objects.create(student=other, kind=FeedbackJob.Kind.PLANNING)
+    response = student_client.get(reverse("feedback_job_status", args=[job.id]))
+    assert response.status_code == 404
+
+
+def _stream(client, name, data):
+    response = _post(client, name, data)
+    assert response["Content-Type"] == "text/event-stream"
+    return b"".join(response).decode("utf-8")
+
+
+@pytest.mark.django_db
+@pytest.mark.filterwarnings("ignore:StreamingHttpResponse must consume")
+def test_planning_feedback_stream(student_client, llm_server, openai_key):
+    llm_server.reply = "Gut geplant"
+    body = _stream(student_client, "planning_feedback_stream", {"planning": {}})
+    assert 'event: token\ndata: {"content": "Gut "}' in body
+    assert 'event: done\ndata: {"feedback": "Gut geplant "}' in body
+    assert llm_server.requests[0]["stream"] is True
+    messages = _history(student_client, FeedbackJob.Kind.PLANNING)
+    assert messages[-1] == {"role": "assistant", "content": "Gut geplant "}
+
+
+@pytest.mark.django_db
+@pytest.mark.filterwarnings("ignore:StreamingHttpResponse must consume")
+def test_reflection_feedback_stream_error(student_client, openai_key, settings):
+    settings.OPENAI_API_BASE = "http://127.0.0.1:9/v1"
+    settings.OPENAI_MAX_RETRIES = 0
+    body = _stream(student_client, "reflection_feedback_stream", {"reflection": {}})
+    assert body.startswith("event: error")
+    assert _history(student_client, FeedbackJob.Kind.REFLECTION) == []
+
+
+@pytest.mark.django_db
+def test_feedback_stream_requires_login(client):
+    response = client.post(reverse("planning_feedback_stream"))
+    assert response.status_code == 403
+
+
+@pytest.mark.django_db
+def test_feedback_rate_limited_returns_503(
+    student_client, llm_server, openai_key, settings
+):
+    settings.OPENAI_MAX_RETRIES = 0
+    llm_server.errors = [(429, {})]
+    response = _post(student_client, "planning_feedback", {"planning": {}})
+    assert response.status_code == 503
+    assert response.json()["error"] == feedback.RATE_LIMIT_ERROR
+
+
+@pytest.mark.django_db
+@pytest.mark.filterwarnings("ignore:StreamingHttpResponse must consume")
+def test_feedback_stream_retries_before_first_token(
+    student_client, llm_server, openai_key
+):
+    llm_server.errors = [(429, {"Retry-After": "0"})]
+    body = _stream(student_client, "planning_feedback_stream", {"planning": {}})
+    assert "event: done" in body
+    assert len(llm_server.requests) == 2
+
+
+def _entries(student, count):
+    return [
+        SRLEntry.objects.create(
+            student=student,
+            session_date=f"2024-01-{day:02d}",
+            goals=[f"Ziel {day}"],
+            time_planning=[{"goal": f"Ziel {day}", "time": "00:30"}],
+            problems="Lange Beschreibung " * 20,
+        )
+        for day in range(1, count + 1)
+    ]
+
+
+@pytest.mark.django_db
+def test_prompt_keeps_recent_entries_and_summarizes_older(openai_key):
+    student = Student.objects.create(
+        classroom=Classroom.objects.create(
+            teacher=User.objects.create(username="t1"),
+            name="Klasse A",
+            group_type="EXPERIMENTAL",
+        ),
+        pseudonym="S1",
+    )
+    entries = _entries(student, 3)
+    openai_key.prompt_recent_entries = 1
+    openai_key.save()
+
+    prompt = feedback.build_messages(FeedbackJob.Kind.PLANNING, student, {})[0][
+        "content"
+    ]
+    assert prompt.count('"Datum"') == 1
+    assert '"Ziele": ["Ziel 3"]' in prompt
+    assert "2024-01-01 | Ziele: Ziel 1 | Zeit geplant/genutzt: 30/0 min" in prompt
+    student.refresh_from_db()
+    assert set(student.diary_summary) == {str(entries[0].id), str(entries[1].id)}
+
+    entries[0].goals = ["Neu"]
+    entries[0].save()
+    student.refresh_from_db()
+    assert set(student.diary_summary) == {str(entries[1].id)}
+
+
+@pytest.mark.django_db
+def test_prompt_respects_token_budget(openai_key):
+    student = Student.objects.create(
+        classroom=Classroom.objects.create(
+            teacher=User.objects.create(username="t1"),
+            name="Klasse A",
+            group_type="EXPERIMENTAL",
+        ),
+        pseudonym="S1",
+    )
+    _entries(student, 10)
+    full = feedback.build_messages(FeedbackJob.Kind.REFLECTION, student, {})[0]
+    openai_key.prompt_recent_entries = 10
+    openai_key.prompt_token_budget = feedback.estimate_tokens(full["content"]) - 200
+    openai_key.save()
+
+    prompt = feedback.build_messages(FeedbackJob.Kind.REFLECTION, student, {})[0]
+    assert feedback.estimate_tokens(prompt["content"]) <= openai_key.prompt_token_budget
+    assert 0 < prompt["content"].count('"Datum"') < 10
+    assert "Zusammenfassung früherer Einträge" in prompt["content"]
+
+
+@pytest.mark.django_db
+def test_unchanged_resubmission_is_answered_from_cache(
+    student_client, llm_server, openai_key
+):
+    draft = {"planning": {"goals": ["Z1"]}}
+    first = _post(student_client, "planning_feedback", draft).json()
+    second = _post(student_client, "planning_feedback", draft).json()
+    assert first == second
+    assert len(llm_server.requests) == 1
+    assert len(_history(student_client, FeedbackJob.Kind.PLANNING)) == 2
+
+    _post(student_client, "planning_feedback", {"planning": {"goals": ["Z2"]}})
+    _post(student_client, "planning_feedback", {"planning": {"goals": ["Z2"]}})
+    assert len(llm_server.requests) == 2
+    assert len(_history(student_client, FeedbackJob.Kind.PLANNING)) == 4
+    assert feedback.cache_stats() == {"hits": 2, "misses": 2, "hit_rate": 50}
+
+
+@pytest.mark.django_db
+def test_reply_cache_and_stats_are_shared_between_processes(settings):
+    messages = [{"role": "user", "content": "x"}]
+    feedback.store_reply("m", messages, "Antwort")
+    assert feedback.cached_reply("m", messages) == "Antwort"
+
+    # Cache instances of another process read the same database tables.
+    replies, counters = (
+        DatabaseCache(settings.CACHES[alias]["LOCATION"], settings.CACHES[alias])
+        for alias in ("feedback", "ratelimit")
+    )
+    assert replies.get(feedback._reply_cache_key("m", messages)) == "Antwort"
+    assert counters.get("dashboard:feedback_cache:hits") == 1
+
+
+@pytest.mark.django_db
+def test_cached_reply_completes_job_immediately(
+    student_client, llm_server, openai_key, settings
+):
+    settings.FEEDBACK_JOB_BACKEND = "worker"
+    _post(student_client, "planning_feedback", {"planning": {}})
+    student_client.post(reverse("planning_feedback_reset"))
+    response = _post(student_client, "planning_feedback_job", {"planning": {}})
+    assert response.json()["status"] == FeedbackJob.Status.DONE
+    assert len(llm_server.requests) == 1
+
+
+@pytest.mark.django_db
+def test_conversation_is_stored_outside_the_session(
+    student_client, llm_server, openai_key, settings
+):
+    settings.FEEDBACK_CONVERSATION_MAX_MESSAGES = 6
+    for i in range(5):
+        _post(student_client, "planning_feedback", {"planning": {"goals": [str(i)]}})
+    conversation_id = student_client.session["planning_ai_conversation"]
+    conversation = FeedbackConversation.objects.get(id=conversation_id)
+    messages = list(conversation.messages.values_list("content", flat=True))
+    assert len(messages) == 6
+    assert messages[0].startswith("Rolle des KI-Assistenten")
+    assert '["4"]' in messages[-2]
+    assert len(llm_server.requests[-1]["messages"]) == 7
+
+    student_client.post(reverse("planning_feedback_reset"))
+    assert "planning_ai_conversation" not in student_client.session
+    assert not FeedbackConversation.objects.exists()
+
+
+@pytest.mark.django_db
+def test_job_reply_is_saved_to_history_once(
+    student_client, llm_server, openai_key, settings
+):
+    settings.FEEDBACK_JOB_BACKEND = "eager"
+    response = _post(student_client, "planning_feedback_job", {"planning": {}})
+    status_url = response.json()["status_url"]
+    student_client.get(status_url)
+    student_client.get(status_url)
+    assert len(_history(student_client, FeedbackJob.Kind.PLANNING)) == 2
+
+
+@pytest.mark.django_db
+def test_feedback_quota_returns_429(student_client, llm_server, openai_key):
+    classroom = student_client.student.classroom
+    classroom.max_feedback_per_student_hour = 2
+    classroom.save()
+    for i in range(2):
+        response = _post(
+            student_client, "planning_feedback", {"planning": {"goals": [str(i)]}}
+        )
+        assert response.status_code == 200
+    response = _post(student_client, "reflection_feedback_job", {"reflection": {}})
+    assert response.status_code == 429
+    assert 0 < int(response["Retry-After"]) <= 1800
+    assert response.json()["retry_after"] == int(response["Retry-After"])
+    assert len(llm_server.requests) == 2
+
+
+@pytest.mark.django_db
+def test_feedback_quota_is_all_or_nothing(student_client, settings):
+    settings.FEEDBACK_GLOBAL_PER_MINUTE = 1
+    student = student_client.student
+    assert ratelimit.check_feedback(student) == 0
+    assert ratelimit.check_feedback(student) > 0
+    settings.FEEDBACK_GLOBAL_PER_MINUTE = 0
+    assert ratelimit.check_feedback(student) == 0
+    state = ratelimit.cache.get(f"ratelimit:feedback:student:{student.id}")
+    assert int(state[0]) == student.classroom.max_feedback_per_student_hour - 2
+
+
+@pytest.mark.django_db
+def test_feedback_concurrency_slots(student_client, llm_server, openai_key):
+    classroom = student_client.student.classroom
+    classroom.max_concurrent_feedback = 1
+    classroom.save()
+    assert ratelimit.acquire_slot(classroom)
+    response = _post(student_client, "planning_feedback", {"planning": {}})
+    assert response.status_code == 429
+    assert response["Retry-After"] == str(ratelimit.SLOT_RETRY_AFTER)
+    ratelimit.release_slot(classroom)
+    response = _post(student_client, "planning_feedback", {"planning": {}})
+    assert response.status_code == 200
+    assert ratelimit.acquire_slot(classroom)
+
+
+@pytest.mark.django_db
+def test_refused_slot_does_not_use_up_the_quota(student_client, llm_server, openai_key):
+    classroom = student_client.student.classroom
+    classroom.max_concurrent_feedback = 1
+    classroom.max_feedback_per_student_hour = 2
+    classroom.save()
+    assert ratelimit.acquire_slot(classroom)
+    for name in ("planning_feedback", "planning_feedback_job", "planning_feedback"):
+        response = _post(student_client, name, {"planning": {}})
+        assert response.status_code == 429
+        assert response["Retry-After"] == str(ratelimit.SLOT_RETRY_AFTER)
+    ratelimit.release_slot(classroom)
+
+    for goal in ("Z1", "Z2"):
+        response = _post(student_client, "planning_feedback", {"planning": {"goals": [goal]}})
+        assert response.status_code == 200
+    response = _post(student_client, "planning_feedback", {"planning": {}})
+    assert response.status_code == 429
+    assert int(response["Retry-After"]) > ratelimit.SLOT_RETRY_AFTER
+
+
+@pytest.mark.django_db
+def test_feedback_job_holds_a_concurrency_slot(
+    student_client, llm_server, openai_key, settings
+):
+    settings.FEEDBACK_JOB_BACKEND = "worker"
+    classroom = student_client.student.classroom
+    classroom.max_concurrent_feedback = 1
+    classroom.save()
+    response = _post(student_client, "planning_feedback_job", {"planning": {}})
+    assert response.status_code == 202
+    response = _post(student_client, "reflection_feedback_job", {"reflection": {}})
+    assert response.status_code == 429
+    assert response["Retry-After"] == str(ratelimit.SLOT_RETRY_AFTER)
+
+    feedback.run_job(FeedbackJob.objects.get().id)
+    assert ratelimit.acquire_slot(classroom)
@@ -1,4 +1,5 @@
 import pytest
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
 from django.contrib.auth.models import User
 from dashboard.models import Classroom, Student, AppSettings
 
@@ -19,6 +20,17 @@ def test_student_unique_pseudonym():
         Student.objects.create(classroom=classroom, pseudonym="S1")
 
 
+@pytest.mark.django_db
+def test_bulk_created_students_get_login_codes():
+    teacher = User.objects.create(username="t1")
+    classroom = Classroom.objects.create(teacher=teacher, name="Klasse A", group_type="CONTROL")
+    Student.objects.bulk_create(
+        Student(classroom=classroom, pseudonym=f"S{i}") for i in range(3)
+    )
+    codes = set(classroom.students.values_list("login_code", flat=True))
+    assert len(codes) == 3 and "" not in codes
+
+
 @pytest.mark.django_db
 def test_classroom_entry_limits_defaults():
     teacher = User.objects.create(username="t1")
@@ -33,3 +45,40 @@ def test_classroom_entry_limits_defaults():
 def test_appsettings_default_openai_model():
     settings = AppSettings.load()
     assert settings.openai_model == "gpt-4o-mini"
+
+
+@pytest.mark.django_db
+def test_appsettings_cached_is_invalidated_on_save(django_assert_num_queries, settings):
+    cached = AppSettings.cached()
+    with django_assert_num_queries(0):
+        assert AppSettings.cached() is cached
+
+    fresh = AppSettings.load()
+    fresh.openai_model = "gpt-4.1"
+    fresh.save()
+    settings.APP_SETTINGS_CACHE_TIMEOUT = 0
+    assert AppSettings.cached().openai_model == "gpt-4.1"
+
+    AppSettings.objects.update(openai_model="gpt-4o")
+    assert AppSettings.cached().openai_model == "gpt-4o"
+
+
+@pytest.mark.django_db
+def test_student_password_uses_student_hasher_and_rehashes(settings):
+    settings.STUDENT_PASSWORD_ITERATIONS = 1000
+    user = User.objects.create(username="t1")
+    classroom = Classroom.objects.create(teacher=user, name="A", group_type="CONTROL")
+    student = Student.objects.create(classroom=classroom, pseudonym="S1")
+    student.set_password("geheim123")
+    assert student.password.startswith("pbkdf2_sha256$1000$")
+
+    # Hashes made with the teacher settings are upgraded on login.
+    student.password = make_password("geheim123")
+    student.save()
+    assert not student.check_password("falsch")
+    default_iterations = PBKDF2PasswordHasher.iterations
+    assert student.password.startswith(f"pbkdf2_sha256${default_iterations}$")
+    assert student.check_password("geheim123")
+    student.refresh_from_db()
+    assert student.password.startswith("pbkdf2_sha256$1000$")
+    assert student.check_password("geheim123")
@@ -0,0 +1,58 @@
+import pytest
+
+from dashboard import openai_client
+from dashboard.openai_client import OpenAIError, _retry_delay
+
+
+def test_chat_completion_reuses_connection(llm_server):
+    for _ in range(3):
+        reply = openai_client.chat_completion("sk-test", "gpt-4o-mini", [])
+        assert reply == "Stub-Feedback"
+    assert len(llm_server.clients) == 1
+    assert openai_client.metrics.snapshot()["chat"]["calls"] == 3
+
+
+def test_chat_completion_retries_rate_limit(llm_server):
+    llm_server.errors = [(429, {"Retry-After": "0"}), (503, {})]
+    reply = openai_client.chat_completion("sk-test", "gpt-4o-mini", [])
+    assert reply == "Stub-Feedback"
+    assert len(llm_server.requests) == 3
+    stats = openai_client.metrics.snapshot()["chat"]
+    assert stats["retries"] == 2
+    assert stats["errors"] == 0
+
+
+def test_chat_completion_gives_up_after_max_retries(llm_server, settings):
+    settings.OPENAI_MAX_RETRIES = 1
+    llm_server.errors = [(500, {}), (500, {}), (500, {})]
+    with pytest.raises(OpenAIError) as excinfo:
+        openai_client.chat_completion("sk-test", "gpt-4o-mini", [])
+    assert excinfo.value.status == 500
+    assert len(llm_server.requests) == 2
+    assert openai_client.metrics.snapshot()["chat"]["errors"] == 1
+
+
+def test_long_retry_after_is_not_waited_for(llm_server, settings):
+    settings.OPENAI_BACKOFF_MAX = 5
+    llm_server.errors = [(429, {"Retry-After": "120"})]
+    with pytest.raises(OpenAIError) as excinfo:
+        openai_client.chat_completion("sk-test", "gpt-4o-mini", [])
+    assert excinfo.value.status == 429
+    assert len(llm_server.requests) == 1
+
+
+def test_retry_delay(settings):
+    settings.OPENAI_BACKOFF_BASE = 0.5
+    settings.OPENAI_BACKOFF_MAX = 3
+    assert _retry_delay(1) == 0.5
+    assert _retry_delay(2) == 1.0
+    assert _retry_delay(4) == 3
+    assert _retry_delay(1, "2") == 2.0
+    assert _retry_delay(1, "Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert _retry_delay(1, "10") is None
+
+
+def test_key_is_valid(llm_server):
+    assert openai_client.key_is_valid("sk-test") is True
+    assert openai_client.key_is_valid("sk-other") is False
+    assert openai_client.key_is_valid("") is False
@@ -1,9 +1,14 @@
+import io
 import json
 
 import pytest
 from django.urls import reverse
 from django.contrib.auth.models import User
 
+from dashboard.benchutils import legacy_entry_flat, synthetic_entries
+from dashboard.diary import diary_json, entries_json
+from dashboard.export_views import format_watermark
+from dashboard.exporters import ENTRY_COLUMNS, entry_nested, entry_row
 from dashboard.models import Classroom, Student, SRLEntry
 
 
@@ -63,3 +68,138 @@ def test_student_export_xlsx(client):
         response["Content-Type"]
         == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
+
+
+@pytest.mark.django_db
+def test_diary_json_matches_plain_serialization(django_assert_num_queries):
+    user = User.objects.create_user(username="t1", password="pass")
+    classroom = Classroom.objects.create(teacher=user, name="Klasse A", group_type="CONTROL")
+    student = Student.objects.create(classroom=classroom, pseudonym="S1")
+    SRLEntry.objects.create(student=student, session_date="2024-01-01", goals=["Z1"])
+    SRLEntry.objects.create(
+        student=student,
+        session_date="2024-01-02",
+        goals=["Z2"],
+        time_planning=[{"goal": "Z2", "time": "00:30"}],
+        problems="Zeile 1\nZeile 2",
+    )
+    header = {"Pseudonym": "S1", "Gesamtziel": None}
+    entries = [entry_nested(e) for e in student.entries.order_by("session_date")]
+    for indent in (None, 2):
+        expected = json.dumps(
+            {**header, "Einträge": entries}, ensure_ascii=False, indent=indent
+        )
+        assert diary_json(student, header, indent=indent) == expected
+    with django_assert_num_queries(1):
+        diary_json(student, header, indent=2)
+
+
+@pytest.mark.django_db
+def test_diary_cache_invalidated_on_entry_change():
+    user = User.objects.create_user(username="t1", password="pass")
+    classroom = Classroom.objects.create(teacher=user, name="Klasse A", group_type="CONTROL")
+    student = Student.objects.create(classroom=classroom, pseudonym="S1")
+    entry = SRLEntry.objects.create(student=student, session_date="2024-01-01", goals=["Z1"])
+    assert "Z1" in entries_json(student)
+    entry.goals = ["Z9"]
+    entry.save()
+    assert "Z9" in entries_json(student)
+    SRLEntry.objects.filter(id=entry.id).delete()
+    assert entries_json(student) == "[]"
+
+
+@pytest.mark.django_db
+def test_student_export_parquet(client):
+    pq = pytest.importorskip("pyarrow.parquet")
+    user = User.objects.create_user(username="t1", password="pass")
+    classroom = Classroom.objects.create(teacher=user, name="Klasse A", group_type="CONTROL")
+    student = Student.objects.create(classroom=classroom, pseudonym="S1")
+    SRLEntry.objects.create(
+        student=student,
+        session_date="2024-01-01",
+        goals=["Z1"],
+        strategy_check=[{"strategy": "Lesen", "used": True, "useful": False}],
+        time_usage=[{"goal": "Z1", "time": "01:15"}],
+    )
+    client.login(username="t1", password="pass")
+    url = reverse("student_export", args=[classroom.id, student.id])
+    response = client.get(url + "?format=parquet")
+    assert response.status_code == 200
+    rows = pq.read_table(io.BytesIO(response.content)).to_pylist()
+    assert rows[0]["strategy_check"] == [
+        {"strategy": "Lesen", "used": True, "useful": False, "adaptation": None}
+    ]
+    assert rows[0]["used_minutes"] == 75
+
+
+@pytest.mark.django_db
+def test_student_delta_export(client):
+    user = User.objects.create_user(username="t1", password="pass")
+    classroom = Classroom.objects.create(teacher=user, name="Klasse A", group_type="CONTROL")
+    student = Student.objects.create(classroom=classroom, pseudonym="S1")
+    old = SRLEntry.objects.create(student=student, session_date="2024-01-01", goals=["Z1"])
+    SRLEntry.objects.filter(id=old.id).update(updated_at="2024-01-01T12:00:00Z")
+    new = SRLEntry.objects.create(student=student, session_date="2024-01-02", goals=["Z2"])
+    client.login(username="t1", password="pass")
+    url = reverse("student_export", args=[classroom.id, student.id])
+
+    response = client.get(url, {"format": "json", "since": "2024-01-02"})
+    data = json.loads(response.content)
+    assert [e["Planung"]["Ziele"] for e in data["Einträge"]] == [["Z2"]]
+    assert response["X-Next-Watermark"] == format_watermark(new.updated_at)
+
+    response = client.get(url, {"format": "csv", "until": "2024-01-01T12:00:00Z"})
+    content = response.content.decode("utf-8")
+    assert "Z1" in content and "Z2" not in content
+
+    response = client.get(url, {"format": "json", "since": response["X-Next-Watermark"]})
+    assert "Z1" not in response.content.decode("utf-8")
+
+
+def test_entry_row_matches_legacy_flattening():
+    entry = synthetic_entries(1)[0]
+    legacy = legacy_entry_flat(entry)
+    assert entry_row(entry) == tuple(legacy[column] for column, _, _ in ENTRY_COLUMNS)
+
+
+@pytest.mark.django_db
+def test_student_export_etag_and_cache(client, django_assert_max_num_queries):
+    user = User.objects.create_user(username="t1", password="pass")
+    classroom = Classroom.objects.create(teacher=user, name="Klasse A", group_type="CONTROL")
+    student = Student.objects.create(classroom=classroom, pseudonym="S1")
+    entry = SRLEntry.objects.create(student=student, session_date="2024-01-01", goals=["Z1"])
+    client.login(username="t1", password="pass")
+    url = reverse("student_export", args=[classroom.id, student.id]) + "?format=csv"
+
+    first = client.get(url)
+    etag = first["ETag"]
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    assert client.get(url.replace("csv", "xlsx"))["ETag"] != etag
+
+    # session, user, classroom, student and the entry aggregate
+    with django_assert_max_num_queries(5):
+        cached = client.get(url)
+    assert cached.content == first.content
+    assert cached["ETag"] == etag
+
+    entry.goals = ["Z2"]
+    entry.save()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert "Z2" in response.content.decode("utf-8")
+
+    student.overall_goal = "Neu"
+    student.save()
+    assert client.get(url)["ETag"] != response["ETag"]
+
+
+@pytest.mark.django_db
+def test_student_export_ndjson(client):
+    user = User.objects.create_user(username="t1", password="pass")
+    classroom = Classroom.objects.create(teacher=user, name="Klasse A", group_type="CONTROL")
+    student = Student.objects.create(classroom=classroom, pseudonym="S1")
+    SRLEntry.objects.create(student=student, session_date="2024-01-01", goals=["Z1"])
+    client.login(username="t1", password="pass")
+    url = reverse("student_export", args=[classroom.id, student.id])
+    lines = client.get(url + "?format=ndjson").content.decode("utf-8").splitlines()
+    assert json.loads(lines[0]) == json.loads(client.get(url).content)
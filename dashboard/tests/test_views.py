@@ -2,6 +2,8 @@ import json
 import pytest
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.utils import timezone
+from dashboard import ratelimit
 from dashboard.models import Classroom, Student, SRLEntry, AppSettings
 
 
@@ -135,6 +137,28 @@ def test_class_entry_limits_prefills_form(client):
     assert b'value="6" selected' in response.content
 
 
+@pytest.mark.django_db
+def test_class_feedback_limits_updates_classroom(client):
+    user = User.objects.create_user(username="t1", password="pass")
+    client.login(username="t1", password="pass")
+    classroom = Classroom.objects.create(
+        teacher=user, name="Klasse A", group_type="EXPERIMENTAL"
+    )
+    response = client.post(
+        reverse("class_feedback_limits", args=[classroom.id]),
+        {
+            "max_feedback_per_student_hour": 5,
+            "max_feedback_per_class_minute": 0,
+            "max_concurrent_feedback": 2,
+        },
+    )
+    assert response.status_code == 302
+    classroom.refresh_from_db()
+    assert classroom.max_feedback_per_student_hour == 5
+    assert classroom.max_feedback_per_class_minute == 0
+    assert classroom.max_concurrent_feedback == 2
+
+
 @pytest.mark.django_db
 def test_class_time_limit_updates_classroom(client):
     user = User.objects.create_user(username="t1", password="pass")
@@ -214,3 +238,230 @@ def test_execution_time_usage_only_checked(client):
     entry.refresh_from_db()
     assert response.status_code == 200
     assert entry.time_usage == usage
+
+
+@pytest.mark.django_db
+def test_update_prompt_budget(client):
+    User.objects.create_user(username="t1", password="pass")
+    client.login(username="t1", password="pass")
+    url = reverse("update_prompt_budget")
+    response = client.post(
+        url,
+        data=json.dumps({"prompt_token_budget": 4000, "prompt_recent_entries": 3}),
+        content_type="application/json",
+    )
+    assert response.status_code == 200
+    settings = AppSettings.load()
+    assert settings.prompt_token_budget == 4000
+    assert settings.prompt_recent_entries == 3
+    response = client.post(
+        url, data=json.dumps({"prompt_token_budget": "x"}), content_type="application/json"
+    )
+    assert response.status_code == 400
+    for data in (
+        {"prompt_token_budget": 999},
+        {"prompt_token_budget": 128_001},
+        {"prompt_recent_entries": -1},
+        {"prompt_recent_entries": 70_000},
+    ):
+        response = client.post(url, data=json.dumps(data), content_type="application/json")
+        assert response.status_code == 400
+    settings = AppSettings.load()
+    assert settings.prompt_token_budget == 4000
+    assert settings.prompt_recent_entries == 3
+
+
+@pytest.mark.django_db
+def test_settings_shows_feedback_cache_stats(client):
+    User.objects.create_user(username="t1", password="pass")
+    client.login(username="t1", password="pass")
+    response = client.get(reverse("settings"))
+    assert response.context["feedback_cache"] == {"hits": 0, "misses": 0, "hit_rate": 0}
+    assert "0 Treffer" in response.content.decode("utf-8")
+
+
+@pytest.mark.django_db
+def test_update_openai_key_stores_validation_result(client, llm_server):
+    User.objects.create_user(username="t1", password="pass")
+    client.login(username="t1", password="pass")
+    url = reverse("update_openai_key")
+    response = client.post(
+        url, data=json.dumps({"openai_api_key": "sk-test"}), content_type="application/json"
+    )
+    assert response.json() == {"valid": True}
+    settings = AppSettings.load()
+    assert settings.openai_key_valid is True
+    assert settings.openai_key_checked_at is not None
+
+    llm_server.valid_key = "other"
+    response = client.post(
+        url, data=json.dumps({"openai_api_key": "sk-test"}), content_type="application/json"
+    )
+    assert response.json() == {"valid": True}
+    response = client.post(
+        url, data=json.dumps({"openai_api_key": "sk-x"}), content_type="application/json"
+    )
+    assert response.json() == {"valid": False}
+    assert AppSettings.load().openai_key_valid is False
+
+
+@pytest.mark.django_db
+def test_settings_renders_stored_key_status(
+    client, openai_key, django_capture_on_commit_callbacks
+):
+    User.objects.create_user(username="t1", password="pass")
+    client.login(username="t1", password="pass")
+    with django_capture_on_commit_callbacks() as callbacks:
+        response = client.get(reverse("settings"))
+    assert b"bg-gray-300" in response.content
+    assert len(callbacks) == 1
+
+    AppSettings.objects.update(openai_key_valid=True, openai_key_checked_at=timezone.now())
+    AppSettings.clear_cache()
+    with django_capture_on_commit_callbacks() as callbacks:
+        response = client.get(reverse("settings"))
+    assert b'id="api-key-status" class="w-4 h-4 rounded-full ml-2 bg-green-500"' in response.content
+    assert callbacks == []
+
+
+@pytest.mark.django_db
+def test_student_login_by_code_or_unique_pseudonym(client, django_assert_num_queries):
+    teacher = User.objects.create_user(username="t1", password="pass")
+    class_a = Classroom.objects.create(teacher=teacher, name="A", group_type="CONTROL")
+    class_b = Classroom.objects.create(teacher=teacher, name="B", group_type="CONTROL")
+    s1 = Student.objects.create(classroom=class_a, pseudonym="Fuchs")
+    Student.objects.create(classroom=class_b, pseudonym="Fuchs")
+    s3 = Student.objects.create(classroom=class_b, pseudonym="Dachs")
+    assert len(s1.login_code) == 8
+    url = reverse("student_login_step")
+
+    with django_assert_num_queries(1):
+        assert Student.for_login(s1.login_code.lower()) == s1
+    assert Student.for_login("Dachs") == s3
+
+    response = client.post(url, {"pseudonym": "Fuchs"})
+    assert "Zugangscode" in response.content.decode()
+    response = client.post(url, {"pseudonym": s1.login_code})
+    assert f'value="{s1.login_code}"' in response.content.decode()
+
+    response = client.post(
+        url, {"login_code": s1.login_code, "password1": "geheim123", "password2": "geheim123"}
+    )
+    assert response.status_code == 204
+    assert client.session["student_id"] == s1.id
+    # Once set, the password cannot be replaced through the login form; a
+    # repeated submit gets the password login instead.
+    response = client.post(
+        url, {"login_code": s1.login_code, "password1": "anders123", "password2": "anders123"}
+    )
+    assert response.status_code == 200
+    assert "Dein Passwort ist bereits gesetzt" in response.content.decode()
+    assert 'name="password"' in response.content.decode()
+    s1.refresh_from_db()
+    assert s1.check_password("geheim123")
+    response = client.post(
+        url, {"login_code": "NOPE", "password1": "anders123", "password2": "anders123"}
+    )
+    assert "Unbekanntes Pseudonym" in response.content.decode()
+
+    response = client.post(url, {"login_code": s1.login_code, "password": "falsch"})
+    assert "Falsches Passwort" in response.content.decode()
+    response = client.post(url, {"login_code": s1.login_code, "password": "geheim123"})
+    assert response.status_code == 204
+
+
+@pytest.mark.django_db
+def test_student_login_locks_out_before_hashing(client, settings, monkeypatch):
+    settings.LOGIN_FAILURES_PER_ACCOUNT = 2
+    settings.LOGIN_FAILURES_PER_IP = 4
+    settings.LOGIN_LOCKOUT_SECONDS = 30
+    teacher = User.objects.create_user(username="t1", password="pass")
+    classroom = Classroom.objects.create(teacher=teacher, name="A", group_type="CONTROL")
+    student = Student.objects.create(classroom=classroom, pseudonym="Fuchs")
+    student.set_password("geheim123")
+    url = reverse("student_login_step")
+    code = student.login_code
+
+    for _ in range(2):
+        response = client.post(url, {"login_code": code, "password": "falsch"})
+        assert "Falsches Passwort" in response.content.decode()
+
+    checked = []
+    monkeypatch.setattr(Student, "check_password", lambda self, raw: checked.append(raw))
+    response = client.post(url, {"login_code": code, "password": "geheim123"})
+    assert response.status_code == 429
+    assert 25 <= int(response["Retry-After"]) <= 30
+    assert "Zu viele Fehlversuche" in response.content.decode()
+    assert checked == []
+
+
+@pytest.mark.django_db
+def test_student_login_ip_budget_only_stops_unknown_accounts(client, settings):
+    settings.LOGIN_FAILURES_PER_IP = 2
+    teacher = User.objects.create_user(username="t1", password="pass")
+    classroom = Classroom.objects.create(teacher=teacher, name="A", group_type="CONTROL")
+    student = Student.objects.create(classroom=classroom, pseudonym="Fuchs")
+    student.set_password("geheim123")
+    new = Student.objects.create(classroom=classroom, pseudonym="Dachs")
+    url = reverse("student_login_step")
+
+    for name in ("X1", "X2"):
+        assert b"Unbekanntes Pseudonym" in client.post(url, {"pseudonym": name}).content
+    response = client.post(url, {"pseudonym": "X3"})
+    assert response.status_code == 429
+    assert "Zu viele Fehlversuche" in response.content.decode()
+    response = client.post(url, {"login_code": "NOPE", "password": "x"})
+    assert response.status_code == 429
+    response = client.post(
+        url, {"login_code": "NOPE", "password1": "geheim123", "password2": "geheim123"}
+    )
+    assert response.status_code == 429
+    assert int(response["Retry-After"]) > 0
+    assert "Zu viele Fehlversuche" in response.content.decode()
+
+    # The class shares the IP, but known accounts can still log in.
+    assert client.post(url, {"pseudonym": "Fuchs"}).status_code == 200
+    response = client.post(url, {"login_code": student.login_code, "password": "geheim123"})
+    assert response.status_code == 204
+    response = client.post(
+        url,
+        {"login_code": new.login_code, "password1": "geheim123", "password2": "geheim123"},
+    )
+    assert response.status_code == 204
+
+
+@pytest.mark.django_db
+def test_student_login_reads_client_ip_from_trusted_header(client, settings):
+    settings.LOGIN_FAILURES_PER_IP = 1
+    settings.LOGIN_CLIENT_IP_HEADER = "HTTP_X_FORWARDED_FOR"
+    url = reverse("student_login_step")
+    client.post(url, {"pseudonym": "X1"}, HTTP_X_FORWARDED_FOR="9.9.9.9, 1.1.1.1")
+    response = client.post(url, {"pseudonym": "X2"}, HTTP_X_FORWARDED_FOR="1.1.1.1")
+    assert response.status_code == 429
+    response = client.post(url, {"pseudonym": "X3"}, HTTP_X_FORWARDED_FOR="2.2.2.2")
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_login_lockout_doubles_and_resets(settings):
+    settings.LOGIN_FAILURES_PER_ACCOUNT = 2
+    settings.LOGIN_LOCKOUT_SECONDS = 10
+    ratelimit.login_failed("1.2.3.4", "CODE")
+    assert ratelimit.account_retry_after("CODE") == 0
+    ratelimit.login_failed("1.2.3.4", "CODE")
+    assert 9 < ratelimit.account_retry_after("CODE") <= 10
+    ratelimit.login_failed("1.2.3.4", "CODE")
+    assert 19 < ratelimit.account_retry_after("CODE") <= 20
+    assert ratelimit.account_retry_after("OTHER") == 0
+    ratelimit.login_succeeded("CODE")
+    assert ratelimit.account_retry_after("CODE") == 0
+
+
+@pytest.mark.django_db
+def test_login_ip_failures_use_a_token_bucket(settings):
+    settings.LOGIN_FAILURES_PER_IP = 2
+    settings.LOGIN_FAILURE_WINDOW = 60
+    assert ratelimit.login_failed("1.2.3.4") == 0
+    assert ratelimit.login_failed("1.2.3.4", "CODE") == 0
+    assert 29 < ratelimit.login_failed("1.2.3.4") <= 30
+    assert ratelimit.login_failed("5.6.7.8") == 0
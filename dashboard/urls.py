@@ -40,6 +40,11 @@ urlpatterns = [
         views.set_class_entry_limits,
         name="class_entry_limits",
     ),
+    path(
+        "classrooms/<int:classroom_id>/feedback-limits/",
+        views.set_class_feedback_limits,
+        name="class_feedback_limits",
+    ),
     path(
         "classrooms/<int:classroom_id>/time-limit/",
         views.set_class_time_limit,
@@ -55,7 +60,17 @@ urlpatterns = [
         visualization_views.classroom_visualization,
         name="classroom_visualization",
     ),
+    path("exports/", views.start_study_export, name="study_export_start"),
+    path(
+        "exports/<int:job_id>/", views.study_export_status, name="study_export_status"
+    ),
+    path(
+        "exports/<int:job_id>/download/",
+        views.study_export_download,
+        name="study_export_download",
+    ),
     path("settings/", views.settings_view, name="settings"),
     path("settings/openai-key/", views.update_openai_key, name="update_openai_key"),
     path("settings/openai-model/", views.update_openai_model, name="update_openai_model"),
+    path("settings/prompt-budget/", views.update_prompt_budget, name="update_prompt_budget"),
 ]
@@ -1,17 +1,25 @@
+import threading
+from datetime import timedelta
+
+from django.conf import settings as django_settings
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.urls import reverse
+from django.utils import timezone
 from django.views.decorators.http import require_POST
 import json
-import requests
 
-from .models import Classroom, Student, AppSettings
+from . import bulk_export, feedback, openai_client
+from .models import Classroom, Student, AppSettings, ExportJob
 from .forms import (
     ClassroomForm,
     StudentForm,
     ClassOverallGoalForm,
     ClassEntryLimitForm,
+    ClassFeedbackLimitForm,
     ClassTimeLimitForm,
 )
 
@@ -19,7 +27,42 @@ from .forms import (
 @login_required
 def classroom_list(request):
     classrooms = Classroom.objects.filter(teacher=request.user)
-    return render(request, "dashboard/classroom_list.html", {"classrooms": classrooms})
+    export_job = request.user.export_jobs.order_by("-created_at").first()
+    return render(
+        request,
+        "dashboard/classroom_list.html",
+        {"classrooms": classrooms, "export_job": export_job},
+    )
+
+
+@login_required
+@require_POST
+def start_study_export(request):
+    job = bulk_export.enqueue_export(request.user)
+    if request.headers.get("HX-Request"):
+        return render(request, "dashboard/study_export_status.html", {"job": job})
+    return redirect("classroom_list")
+
+
+@login_required
+def study_export_status(request, job_id):
+    job = get_object_or_404(ExportJob, id=job_id, teacher=request.user)
+    # Stops the polling of jobs that were lost with their process.
+    if bulk_export.is_stale(job):
+        bulk_export.reap_stale_exports()
+        job.refresh_from_db()
+    return render(request, "dashboard/study_export_status.html", {"job": job})
+
+
+@login_required
+def study_export_download(request, job_id):
+    job = get_object_or_404(
+        ExportJob, id=job_id, teacher=request.user, status=ExportJob.Status.DONE
+    )
+    path = bulk_export.export_path(job)
+    if not path.exists():
+        raise Http404
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=path.name)
 
 
 @login_required
@@ -95,6 +138,29 @@ def set_class_entry_limits(request, classroom_id):
     return redirect("classroom_list")
 
 
+@login_required
+def set_class_feedback_limits(request, classroom_id):
+    classroom = get_object_or_404(Classroom, id=classroom_id, teacher=request.user)
+    if request.method == "POST":
+        form = ClassFeedbackLimitForm(request.POST, instance=classroom)
+        if form.is_valid():
+            form.save()
+            if request.headers.get("HX-Request"):
+                response = HttpResponse()
+                response["HX-Redirect"] = reverse("classroom_list")
+                return response
+            return redirect("classroom_list")
+    else:
+        form = ClassFeedbackLimitForm(instance=classroom)
+    if request.headers.get("HX-Request"):
+        return render(
+            request,
+            "dashboard/class_feedback_limits_form.html",
+            {"form": form, "classroom": classroom},
+        )
+    return redirect("classroom_list")
+
+
 @login_required
 def set_class_time_limit(request, classroom_id):
     classroom = get_object_or_404(Classroom, id=classroom_id, teacher=request.user)
@@ -208,27 +274,60 @@ def student_detail(request, classroom_id, student_id):
 
 
 def validate_openai_key(key: str) -> bool:
-    if not key:
-        return False
+    return openai_client.key_is_valid(key)
+
+
+KEY_CHECK_LOCK = "openai-key-check"
+
+
+def refresh_key_status(key):
+    """Validate ``key`` and store the result if it is still the configured key."""
+    valid = validate_openai_key(key)
+    AppSettings.objects.filter(pk=1, openai_api_key=key).update(
+        openai_key_valid=valid, openai_key_checked_at=timezone.now()
+    )
+    AppSettings.clear_cache()
+    return valid
+
+
+def _refresh_key_status_in_thread(key):
     try:
-        response = requests.get(
-            "https://api.openai.com/v1/models",
-            headers={"Authorization": f"Bearer {key}"},
-            timeout=5,
-        )
-        return response.status_code == 200
-    except requests.RequestException:
-        return False
+        refresh_key_status(key)
+    finally:
+        cache.delete(KEY_CHECK_LOCK)
+        connection.close()
+
+
+def schedule_key_check(settings):
+    """Re-check the API key in a background thread if the last check is stale."""
+    if not settings.openai_api_key:
+        return
+    checked_at = settings.openai_key_checked_at
+    max_age = timedelta(seconds=django_settings.OPENAI_KEY_CHECK_INTERVAL)
+    if checked_at and timezone.now() - checked_at < max_age:
+        return
+    if not cache.add(KEY_CHECK_LOCK, 1, 60):
+        return
+    key = settings.openai_api_key
+    transaction.on_commit(
+        lambda: threading.Thread(
+            target=_refresh_key_status_in_thread, args=(key,), daemon=True
+        ).start()
+    )
 
 
 @login_required
 def settings_view(request):
-    settings = AppSettings.load()
-    key_valid = validate_openai_key(settings.openai_api_key)
+    settings = AppSettings.cached()
+    schedule_key_check(settings)
     return render(
         request,
         "dashboard/settings.html",
-        {"settings": settings, "key_valid": key_valid},
+        {
+            "settings": settings,
+            "key_valid": settings.openai_key_valid,
+            "feedback_cache": feedback.cache_stats(),
+        },
     )
 
 
@@ -238,9 +337,11 @@ def update_openai_key(request):
     data = json.loads(request.body.decode("utf-8"))
     key = data.get("openai_api_key", "")
     settings = AppSettings.load()
+    if key == settings.openai_api_key and settings.openai_key_checked_at:
+        return JsonResponse({"valid": bool(settings.openai_key_valid)})
     settings.openai_api_key = key
     settings.save()
-    valid = validate_openai_key(key)
+    valid = refresh_key_status(key)
     return JsonResponse({"valid": valid})
 
 
@@ -253,3 +354,36 @@ def update_openai_model(request):
     settings.openai_model = model
     settings.save()
     return JsonResponse({})
+
+
+# Allowed values for the prompt budget; 128k tokens is the context window of
+# the largest supported models.
+PROMPT_TOKEN_BUDGET_RANGE = (1000, 128_000)
+PROMPT_RECENT_ENTRIES_RANGE = (0, 50)
+
+
+@login_required
+@require_POST
+def update_prompt_budget(request):
+    data = json.loads(request.body.decode("utf-8"))
+    settings = AppSettings.load()
+    try:
+        budget = int(data.get("prompt_token_budget", settings.prompt_token_budget))
+        recent = int(data.get("prompt_recent_entries", settings.prompt_recent_entries))
+    except (TypeError, ValueError):
+        return JsonResponse({"error": "Ungültige Zahl"}, status=400)
+    low, high = PROMPT_TOKEN_BUDGET_RANGE
+    if not low <= budget <= high:
+        return JsonResponse(
+            {"error": f"Max. Tokens muss zwischen {low} und {high} liegen"}, status=400
+        )
+    low, high = PROMPT_RECENT_ENTRIES_RANGE
+    if not low <= recent <= high:
+        return JsonResponse(
+            {"error": f"Die Anzahl der Einträge muss zwischen {low} und {high} liegen"},
+            status=400,
+        )
+    settings.prompt_token_budget = budget
+    settings.prompt_recent_entries = recent
+    settings.save()
+    return JsonResponse({})
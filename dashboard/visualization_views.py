@@ -1,8 +1,14 @@
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from django.shortcuts import get_object_or_404, render
+
+from .class_stats import classroom_summary
+from .models import Classroom
 
 
 @login_required
 def classroom_visualization(request, classroom_id):
-    """Placeholder view for classroom data visualization."""
-    return HttpResponse("Visualization interface not implemented yet.")
+    """Analytics of a classroom, rendered from the per-day aggregates."""
+    classroom = get_object_or_404(Classroom, id=classroom_id, teacher=request.user)
+    context = classroom_summary(classroom)
+    context["classroom"] = classroom
+    return render(request, "dashboard/classroom_visualization.html", context)